@@ -12,25 +12,516 @@
 
 # Import python libs
 import os
+import time
+import optparse
 
 # Import salt libs
+import salt.client
 from salt import Master
 from salt.cli import SaltKey, SaltCMD
+from salt.utils.parsers import MixInMeta, OptionParserMeta
+from salt.utils.verify import verify_env
 
 # Import salt-ci libs
-from saltci import config
+from saltci import config, events, flaky, impact, keys, logs, pool, profiling, queue, retention
+from saltci.exceptions import (
+    SaltCIChangeImpactError, SaltCILogsError, SaltCIPoolError, SaltCIQueueError
+)
 
 
-class SaltCIMaster(Master):
+class SaltCIParserMeta(OptionParserMeta):
+    '''
+    Register the mix-ins of a salt-ci parser on it's own lists of mix-in functions.
+
+    :class:`OptionParserMeta` only creates those lists once, on the salt parser, so, the salt-ci
+    mix-ins would otherwise be registered on the lists inherited from, and shared with, it.
+    '''
+
+    def __new__(cls, name, bases, attrs):
+        for attr in ('_mixin_setup_funcs', '_mixin_process_funcs', '_mixin_after_parsed_funcs'):
+            if attr in attrs:
+                continue
+            funcs = attrs[attr] = []
+            for base in bases:
+                for func in getattr(base, attr, ()):
+                    if func not in funcs:
+                        funcs.append(func)
+        return super(SaltCIParserMeta, cls).__new__(cls, name, bases, attrs)
+
+
+class ChangeImpactMixIn(object):
+    '''
+    Allow `salt-ci` to only dispatch the tests affected by a git diff range.
+    '''
+    __metaclass__ = MixInMeta
+    _mixin_prio_ = 50
+
+    def _mixin_setup(self):
+        group = optparse.OptionGroup(self, 'Change Impact Selection')
+        group.add_option(
+            '--changed',
+            default=None,
+            metavar='GIT_DIFF_RANGE',
+            help=('Only run the tests affected by the changes on the provided git diff range, '
+                  'for example, \'origin/develop...HEAD\'.')
+        )
+        group.add_option(
+            '--repo-path',
+            default=None,
+            help='The git repository checkout to diff. Default: the current directory'
+        )
+        self.add_option_group(group)
+
+    def _mixin_after_parsed(self):
+        if not self.options.changed:
+            return
+
+        if isinstance(self.config['fun'], list):
+            self.error('Change impact selection does not support compound commands')
+
+        try:
+            paths = impact.changed_files(self.options.changed, self.options.repo_path)
+            tests = impact.select_tests(self.config, paths)
+        except SaltCIChangeImpactError, err:
+            self.error(str(err))
+
+        if tests is None:
+            # At least one of the changed paths is not on the index, run everything
+            return
+
+        if not tests:
+            self.exit(0, 'No tests are affected by the changes on {0}\n'.format(
+                self.options.changed
+            ))
+
+        self.config['arg'].append(
+            '{0}={1}'.format(
+                impact.get_config(self.config)['tests_kwarg'], ','.join(sorted(tests))
+            )
+        )
+
+
+class MinionPoolMixIn(object):
+    '''
+    Allow `salt-ci` to run it's job on build minions acquired from the master's warm pool.
+    '''
+    __metaclass__ = MixInMeta
+    _mixin_prio_ = 50
+
+    def _mixin_setup(self):
+        group = optparse.OptionGroup(self, 'Build Minions Pool')
+        group.add_option(
+            '--pool',
+            default=0,
+            type=int,
+            # Do not clash with the `pool` configuration section
+            dest='pool_count',
+            metavar='COUNT',
+            help=('Run the job on COUNT build minions acquired from the master\'s pool instead '
+                  'of the passed target, which is then ignored.')
+        )
+        self.add_option_group(group)
+
+    def _mixin_after_parsed(self):
+        self.pool_minions = []
+        if self.options.pool_count <= 0 or self.use_queue():
+            # Queued jobs get their build minions when the master publishes them
+            return
+        try:
+            self.pool_minions = pool.acquire(self.config, self.options.pool_count)
+        except SaltCIPoolError, err:
+            self.error(str(err))
+        self.config['tgt'] = self.pool_minions
+        self.selected_target_option = 'list'
+
+    def release_pool_minions(self):
+        if getattr(self, 'pool_minions', None):
+            pool.release(self.config, self.pool_minions)
+            self.pool_minions = []
+
+
+class JobQueueMixIn(object):
+    '''
+    Submit the `salt-ci` jobs to the master's job queue instead of publishing them right away.
+    '''
+    __metaclass__ = MixInMeta
+    _mixin_prio_ = 50
+
+    def _mixin_setup(self):
+        group = optparse.OptionGroup(self, 'Job Queue')
+        group.add_option(
+            '--queue',
+            default=None,
+            action='store_true',
+            # Do not clash with the `queue` configuration section
+            dest='use_queue',
+            help='Submit the job to the master\'s job queue'
+        )
+        group.add_option(
+            '--no-queue',
+            action='store_false',
+            dest='use_queue',
+            help='Publish the job right away, bypassing the master\'s job queue'
+        )
+        group.add_option(
+            '--project',
+            default=None,
+            help=('The project the job builds. Default: default. The jobs are only recorded as '
+                  'builds, and the queued ones only supersede the older ones, when the project, '
+                  'branch or revision is passed')
+        )
+        group.add_option(
+            '--branch',
+            default=None,
+            help='The project branch the job builds. Default: default'
+        )
+        group.add_option(
+            '--revision',
+            default=None,
+            help='The revision, commit, the job builds'
+        )
+        group.add_option(
+            '--priority',
+            default=None,
+            help='The priority class of the queued job'
+        )
+        self.add_option_group(group)
+
+    def build_info(self):
+        '''
+        Return the ``(project, branch, revision)`` the job builds.
+        '''
+        return (
+            self.options.project or 'default',
+            self.options.branch or 'default',
+            self.options.revision
+        )
+
+    def is_build(self):
+        '''
+        Return ``True`` if a build was requested, by passing it's project, branch or revision.
+        '''
+        return any(
+            value is not None
+            for value in (self.options.project, self.options.branch, self.options.revision)
+        )
+
+    def use_queue(self):
+        if self.options.use_queue is not None:
+            return self.options.use_queue
+        return queue.get_config(self.config)['enabled']
+
+    def run_direct(self):
+        '''
+        Publish the job, as a build, right away and print it's returns.
+        '''
+        if self.options.timeout <= 0:
+            self.options.timeout = self.config['timeout']
+        jid = events.new_jid()
+        project, branch, revision = self.build_info()
+        # Announced before publishing, so that the master knows it's a build before any return
+        events.fire_build(self.config, jid, project, branch, revision, self.config['fun'])
+        local = salt.client.LocalClient(mopts=self.config)
+        pub_data = local.pub(
+            self.config['tgt'],
+            self.config['fun'],
+            self.config['arg'],
+            self.selected_target_option or 'glob',
+            getattr(self.options, 'return') or '',
+            jid=jid
+        )
+        if not pub_data or not pub_data.get('minions'):
+            self.exit(2, 'No minions matched the target. No command was sent, no jid was '
+                         'assigned.\n')
+        if self.options.verbose:
+            print('Executing job with jid {0}'.format(pub_data['jid']))
+
+        for full_ret in local.get_cli_returns(pub_data['jid'], pub_data['minions'],
+                                              self.options.timeout,
+                                              verbose=self.options.verbose):
+            ret, out = self._format_ret(full_ret)
+            self._output_ret(ret, out)
+
+    def run_queued(self):
+        if self.options.timeout <= 0:
+            self.options.timeout = self.config['timeout']
+        project, branch, revision = self.build_info()
+        try:
+            queue_id = queue.submit(
+                self.config,
+                project,
+                branch,
+                self.config['tgt'],
+                self.config['fun'],
+                self.config['arg'],
+                expr_form=self.selected_target_option or 'glob',
+                ret=getattr(self.options, 'return'),
+                priority=self.options.priority,
+                pool_count=self.options.pool_count,
+                revision=revision,
+                # Without an explicit build, any two jobs of the default project would supersede
+                # each other
+                supersede=self.is_build()
+            )
+        except SaltCIQueueError, err:
+            self.error(str(err))
+
+        if self.options.verbose:
+            print('Queued job {0}'.format(queue_id))
+
+        try:
+            job = queue.wait_for_dispatch(self.config, queue_id)
+        except KeyboardInterrupt:
+            if queue.cancel(self.config, queue_id):
+                self.exit(1, 'Exiting on Ctrl-C, the queued job {0} was cancelled\n'.format(
+                    queue_id
+                ))
+            job = queue.get_job(self.config, queue_id)
+
+        if job['state'] == queue.CANCELLED:
+            if job.get('superseded_by'):
+                self.exit(1, 'The queued job {0} was superseded by {1}\n'.format(
+                    queue_id, job['superseded_by']
+                ))
+            self.exit(1, 'The queued job {0} was cancelled\n'.format(queue_id))
+        if job['error']:
+            self.exit(2, 'The queued job {0} failed: {1}\n'.format(queue_id, job['error']))
+
+        local = salt.client.LocalClient(mopts=self.config)
+        for full_ret in local.get_cli_returns(job['jid'], job['minions'], self.options.timeout,
+                                              verbose=self.options.verbose):
+            ret, out = self._format_ret(full_ret)
+            self._output_ret(ret, out)
+
+
+class FlakyTestsMixIn(object):
+    '''
+    Have `salt-ci` quarantine the flaky tests of the project, and retry, alone, the flaky tests
+    which failed, instead of having the whole job rerun. Only the jobs running one of the
+    configured test runner functions are concerned.
+    '''
+    __metaclass__ = MixInMeta
+    _mixin_prio_ = 50
+
+    def _mixin_setup(self):
+        group = optparse.OptionGroup(self, 'Flaky Tests')
+        group.add_option(
+            '--no-quarantine',
+            default=True,
+            action='store_false',
+            dest='flaky_quarantine',
+            help='Do not pass the project\'s quarantined tests to the minions'
+        )
+        group.add_option(
+            '--retry-flaky',
+            default=None,
+            type=int,
+            dest='flaky_retries',
+            metavar='COUNT',
+            help=('Retry the failed flaky tests up to COUNT times. Default: the configured '
+                  'number of retries, 0 disables it')
+        )
+        self.add_option_group(group)
+
+    def _mixin_after_parsed(self):
+        self.flaky_tests = {}
+        self.flaky_returns = {}
+        flaky_config = flaky.get_config(self.config)
+        if not flaky_config['enabled'] or isinstance(self.config['fun'], list) or \
+                self.config['fun'] not in flaky_config['functions']:
+            # Other functions would fail on the unexpected keyword arguments
+            return
+        if self.options.flaky_retries is None:
+            self.options.flaky_retries = flaky_config['max_retries']
+
+        self.flaky_tests = flaky.project_tests(self.config, self.build_info()[0])
+        quarantined = sorted(
+            name for name, test in self.flaky_tests.iteritems() if test['quarantined']
+        )
+        if quarantined and self.options.flaky_quarantine:
+            self.config['arg'].append(
+                '{0}={1}'.format(flaky_config['quarantine_kwarg'], ','.join(quarantined))
+            )
+
+    def _output_ret(self, ret, out):
+        super(FlakyTestsMixIn, self)._output_ret(ret, out)
+        if self.flaky_tests and isinstance(ret, dict):
+            self.flaky_returns.update(ret)
+
+    def _failed_flaky_tests(self, ret):
+        # Late import, only needed when there are flaky tests to retry
+        from saltci.results import iter_tests
+        return sorted(
+            name for name, success, _ in iter_tests(ret)
+            if not success and name in self.flaky_tests
+        )
+
+    def retry_flaky_tests(self):
+        if not self.flaky_returns or not self.options.flaky_retries:
+            return
+        if self.use_queue() and self.options.pool_count:
+            print('Not retrying the failed flaky tests, the build minions went back to the pool')
+            return
+        tests_kwarg = impact.get_config(self.config)['tests_kwarg']
+        arg = [
+            item for item in self.config['arg']
+            if not (isinstance(item, basestring) and item.startswith(tests_kwarg + '='))
+        ]
+        local = salt.client.LocalClient(mopts=self.config)
+        pending = dict(
+            (minion_id, self._failed_flaky_tests(ret))
+            for minion_id, ret in self.flaky_returns.iteritems()
+        )
+        self.flaky_returns = {}
+
+        for attempt in range(1, self.options.flaky_retries + 1):
+            pending = dict((minion_id, tests) for minion_id, tests in pending.iteritems() if tests)
+            if not pending:
+                return
+            for minion_id, tests in sorted(pending.iteritems()):
+                print('Retrying, attempt {0}, the failed flaky test(s) on {1}: {2}'.format(
+                    attempt, minion_id, ', '.join(tests)
+                ))
+                full_ret = local.cmd_full_return(
+                    [minion_id],
+                    self.config['fun'],
+                    arg + ['{0}={1}'.format(tests_kwarg, ','.join(tests))],
+                    timeout=self.options.timeout,
+                    expr_form='list'
+                )
+                ret, out = self._format_ret(full_ret)
+                super(FlakyTestsMixIn, self)._output_ret(ret, out)
+                if minion_id not in ret:
+                    # No answer, do not keep on trying
+                    pending[minion_id] = []
+                    continue
+                failed = set(self._failed_flaky_tests(ret[minion_id]))
+                passed = [test for test in tests if test not in failed]
+                if passed:
+                    print('Flaky test(s) passed on retry on {0}: {1}'.format(
+                        minion_id, ', '.join(passed)
+                    ))
+                pending[minion_id] = sorted(failed)
+
+
+class LogTailMixIn(object):
+    '''
+    Allow `salt-ci` to print, and follow, the build logs shipped by the CI minions.
+    '''
+    __metaclass__ = MixInMeta
+    _mixin_prio_ = 50
+
+    def _mixin_setup(self):
+        group = optparse.OptionGroup(self, 'Build Logs')
+        group.add_option(
+            '--tail',
+            default=None,
+            metavar='JID',
+            dest='tail_jid',
+            help=('Print the build logs of the job and keep on following them until they are '
+                  'complete. No target nor function are required.')
+        )
+        group.add_option(
+            '--no-follow',
+            default=True,
+            action='store_false',
+            dest='tail_follow',
+            help='When passing --tail, print the build logs shipped so far and exit'
+        )
+        self.add_option_group(group)
+
+    def process_tail_jid(self):
+        # This runs before salt's argument checks, no target nor function are needed to tail
+        if not self.options.tail_jid:
+            return
+        try:
+            logs.tail(self.config, self.options.tail_jid, follow=self.options.tail_follow)
+        except KeyboardInterrupt:
+            pass
+        except SaltCILogsError, err:
+            self.error(str(err))
+        self.exit(0)
+
+
+class BulkKeyOptionsMixIn(object):
+    '''
+    The `salt-ci-key` bulk key operations.
+    '''
+    __metaclass__ = MixInMeta
+    _mixin_prio_ = 50
+
+    def _mixin_setup(self):
+        group = optparse.OptionGroup(self, 'Bulk Key Operations')
+        group.add_option(
+            '--accept-match',
+            default=None,
+            action='append',
+            metavar='GLOB',
+            help=('Accept, in a single pass, all the pending keys whose minion id matches the '
+                  'glob. Can be passed several times.')
+        )
+        group.add_option(
+            '--accept-finger',
+            default=None,
+            action='append',
+            metavar='FINGERPRINT',
+            help=('Accept, in a single pass, all the pending keys with this fingerprint. Can be '
+                  'passed several times.')
+        )
+        group.add_option(
+            '--accept-fingers-file',
+            default=None,
+            help='Accept all the pending keys whose fingerprint is listed on the file'
+        )
+        group.add_option(
+            '--include-rejected',
+            default=False,
+            action='store_true',
+            help='When accepting keys, also accept the matching rejected keys'
+        )
+        group.add_option(
+            '--clean-ephemeral',
+            default=False,
+            action='store_true',
+            help='Delete the keys of the configured ephemeral minions which do not respond'
+        )
+        self.add_option_group(group)
+
+
+class SaltCIMaster(profiling.ProfilingMixIn, Master):
 
     # ConfigDirMixIn configuration filename attribute
     _config_filename_ = 'salt-ci-master'
 
+    # The salt functions timed when the profiling timings are enabled
+    _profiling_calls_ = profiling.MASTER_CALLS
+
     def setup_config(self):
         return config.saltci_master_config(self.get_config_file_path())
 
+    def prepare(self):
+        started = time.time()
+        super(SaltCIMaster, self).prepare()
+        # Start our own processes after salt has daemonized
+        self.event_processor = events.EventProcessor(
+            self.config, events.load_handlers(self.config)
+        )
+        self.event_processor.start()
+        if pool.get_config(self.config)['driver']:
+            self.pool_process = pool.PoolProcess(self.config)
+            self.pool_process.start()
+        if retention.get_config(self.config)['enabled']:
+            self.retention_process = retention.RetentionProcess(self.config)
+            self.retention_process.start()
+        if flaky.get_config(self.config)['enabled'] and self.config['SQLALCHEMY_DATABASE_URI']:
+            self.flaky_process = flaky.FlakyProcess(self.config)
+            self.flaky_process.start()
+        profiling.log_timing('startup', time.time() - started)
+
+
+class SaltCIKey(BulkKeyOptionsMixIn, SaltKey):
 
-class SaltCIKey(SaltKey):
+    __metaclass__ = SaltCIParserMeta
 
     # ConfigDirMixIn configuration filename attribute
     _config_filename_ = 'salt-ci-master'
@@ -38,11 +529,65 @@ class SaltCIKey(SaltKey):
     def setup_config(self):
         return config.saltci_master_config(self.get_config_file_path())
 
+    def run(self):
+        self.parse_args()
 
-class SaltCICMD(SaltCMD):
+        if self.config['verify_env']:
+            verify_env_dirs = []
+            if not self.config['gen_keys']:
+                verify_env_dirs.extend([
+                    self.config['pki_dir'],
+                    os.path.join(self.config['pki_dir'], keys.ACCEPTED),
+                    os.path.join(self.config['pki_dir'], keys.PENDING),
+                    os.path.join(self.config['pki_dir'], keys.REJECTED),
+                    os.path.dirname(self.config['key_logfile'])
+                ])
+            verify_env(
+                verify_env_dirs,
+                self.config['user'],
+                permissive=self.config['permissive_pki_access'],
+                pki_dir=self.config['pki_dir'],
+            )
+
+        self.setup_logfile_logger()
+        keys.SaltCIKeyCLI(self.config).run()
+
+
+class SaltCICMD(ChangeImpactMixIn, MinionPoolMixIn, JobQueueMixIn, FlakyTestsMixIn, LogTailMixIn,
+                profiling.ProfilingMixIn, SaltCMD):
+
+    __metaclass__ = SaltCIParserMeta
 
     # ConfigDirMixIn configuration filename attribute
     _config_filename_ = 'salt-ci-master'
 
+    # The salt functions timed when the profiling timings are enabled
+    _profiling_calls_ = profiling.CLI_CALLS
+
     def setup_config(self):
         return config.saltci_master_config(self.get_config_file_path())
+
+    def parse_args(self, args=None, values=None):
+        # Salt's `run()` parses the arguments itself, but we need to parse them before, to know
+        # if the job is to be queued.
+        if getattr(self, 'options', None) is not None:
+            return self.options, self.args
+        return super(SaltCICMD, self).parse_args(args, values)
+
+    def run(self):
+        self.parse_args()
+        # There's no log file to wait for
+        self.log_config_load()
+        try:
+            with profiling.timed('job', fun=self.config['fun'], queued=self.use_queue()):
+                if self.use_queue():
+                    self.run_queued()
+                elif self.is_build() and not getattr(self.options, 'batch', None):
+                    self.run_direct()
+                else:
+                    # Salt publishes the ad-hoc and batched runs, they're not recorded as builds
+                    super(SaltCICMD, self).run()
+                self.retry_flaky_tests()
+        finally:
+            self.release_pool_minions()
+            self.profiler.stop()
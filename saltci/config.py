@@ -48,6 +48,203 @@ _DEFAULT_SENDMAIL_CONFIG = dict(
     reply_to=None
 )
 
+_DEFAULT_IMPACT_CONFIG = dict(
+    # Where to store the change-impact index. Defaults to `<cachedir>/salt-ci/impact.idx`
+    index_path=None,
+    # The key, on the job return data, which holds the `{test: [paths]}` coverage mapping
+    coverage_key='coverage',
+    # Prefixes to strip from the paths reported by the minions so that they match the paths
+    # reported by `git diff`
+    strip_prefixes=[],
+    # Changes to paths matching these globs never trigger any tests. Mind that `*.txt` would also
+    # match the requirements files
+    ignore=['*.rst', 'doc/*'],
+    # The keyword argument name used to pass the selected tests to the minions
+    tests_kwarg='tests'
+)
+
+_DEFAULT_KEYS_CONFIG = dict(
+    # Pending keys whose minion id matches any of these globs are automatically accepted
+    accept_patterns=[],
+    # Pending keys whose fingerprint is on this allowlist are automatically accepted
+    accept_fingerprints=[],
+    # A file with additional allowed fingerprints, one per line
+    accept_fingers_file=None,
+    # Minion id globs of the ephemeral CI minions, their keys are deleted once they're gone
+    ephemeral_patterns=[],
+    # Seconds without any sign of life after which an ephemeral minion is pinged
+    ephemeral_ttl=600,
+    # How often, in seconds, to look for gone ephemeral minions
+    ephemeral_check_interval=60
+)
+
+_DEFAULT_POOL_CONFIG = dict(
+    # The pool driver name, see `saltci.pool.drivers`. No driver, no pool
+    driver=None,
+    # Driver specific options
+    driver_opts={},
+    # The address the build minions connect to. Defaults to the master interface or it's FQDN
+    master=None,
+    minion_id_prefix='salt-ci-build-',
+    # Booted build minions to keep idle, on top of the ones being waited for
+    min_idle=2,
+    # Maximum number of build minions, booting, idle or busy
+    max_size=10,
+    # Maximum number of build minions waiting, at once, to be booted
+    max_boots_per_check=5,
+    # How often, in seconds, to check the pool
+    check_interval=5,
+    # Seconds a build minion has to boot before being destroyed
+    boot_timeout=300,
+    # Seconds a build minion is kept idle, above `min_idle`, before being destroyed
+    idle_ttl=900,
+    # Seconds `salt-ci` waits for idle build minions
+    acquire_timeout=600,
+    keysize=2048
+)
+
+_DEFAULT_QUEUE_CONFIG = dict(
+    # Queue the `salt-ci` jobs by default, `--queue`/`--no-queue` override it
+    enabled=False,
+    # Priority classes, the lower the value the higher the priority
+    priorities={
+        'interactive': 0,
+        'default': 50,
+        'nightly': 100
+    },
+    default_priority='default',
+    # Maximum number of jobs running at once
+    max_running=20,
+    # Maximum number of jobs running at once per project
+    project_concurrency=4,
+    # Maximum number of jobs running at once per project branch
+    branch_concurrency=2,
+    # Per-project, `<project>`, and per-branch, `<project>/<branch>`, concurrency overrides
+    concurrency_overrides={},
+    # A new job, run with `--project`, `--branch` or `--revision`, cancels the older queued jobs
+    # of the same project and branch running the same function on the same target
+    supersede=True,
+    # Seconds after which a running job is considered finished
+    job_timeout=3600,
+    # Seconds without any return after which the minions which did not return yet are asked,
+    # like salt does, if they're still running the job. The job is done once none of them is
+    return_timeout=60,
+    # Seconds to keep the finished jobs on the queue
+    keep_finished=86400
+)
+
+_DEFAULT_LOGS_CONFIG = dict(
+    # Where to store the shipped build logs. Defaults to `<cachedir>/salt-ci/logs`
+    logs_dir=None,
+    # Minimum number of seconds between requests to resume an incomplete log transfer
+    resume_interval=10,
+    # Seconds `salt-ci --tail` waits for the first log of a job to be shipped before giving up
+    tail_timeout=60
+)
+
+_DEFAULT_STREAM_CONFIG = dict(
+    # Serve the live build events, as Server-Sent Events, from the master
+    enabled=False,
+    interface='0.0.0.0',
+    port=4520,
+    path='/events',
+    # The value of the `Access-Control-Allow-Origin` header, so that the dashboard, served from
+    # another port, can subscribe. `None` to not send it
+    allow_origin='*',
+    max_clients=5000,
+    # Bytes of unsent events after which a slow client is disconnected. It catches up, from the
+    # replay history, when it reconnects
+    max_buffer=262144,
+    # Number of recent events kept to replay to the reconnecting clients
+    history_size=2000,
+    # Seconds between the keep-alive comments sent to idle clients
+    keepalive=15
+)
+
+_DEFAULT_RETENTION_CONFIG = dict(
+    # Roll up, and then delete, the historical results. Salt's own job cache is pruned according
+    # to it's `keep_jobs` setting
+    enabled=False,
+    # Days the raw build and test results are kept, once rolled up
+    raw_ttl=30,
+    # Per-project `raw_ttl` overrides
+    project_raw_ttl={},
+    # Days the shipped build logs are kept
+    logs_ttl=14,
+    # A day is rolled up once this many more days went by since it ended, late job returns are
+    # then unlikely
+    rollup_delay=1,
+    # How often, in seconds, to roll up and compact
+    check_interval=3600,
+    # Builds deleted per compaction batch, each batch is it's own transaction
+    batch_size=500,
+    # Seconds to sleep between compaction batches, keeps the database I/O smooth
+    batch_sleep=0.5
+)
+
+_DEFAULT_FLAKY_CONFIG = dict(
+    # Score the tests flakiness from the recorded test results. A test is flaky when it both
+    # passes and fails on the same revision, only the builds run with `--revision` are scored
+    enabled=False,
+    # The test runner functions, which take the `quarantine_kwarg` and the change impact
+    # `tests_kwarg` keyword arguments. Only their jobs get the quarantined tests passed and have
+    # their failed flaky tests retried
+    functions=[],
+    # How often, in seconds, to analyze the new test results
+    check_interval=60,
+    # Test results analyzed per batch, each batch is it's own transaction
+    batch_size=5000,
+    # Maximum number of batches per check, the remaining ones are left for the next check
+    max_batches=20,
+    # Per revision decay of the past runs weight, the score follows the recent behaviour
+    decay=0.98,
+    # Tests whose score reaches `quarantine_score`, after failing and passing on at least
+    # `min_flaky_revisions` revisions, are quarantined, their failures no longer fail the jobs
+    quarantine=True,
+    quarantine_score=0.3,
+    min_flaky_revisions=3,
+    # The keyword argument name used to pass the quarantined tests to the minions
+    quarantine_kwarg='quarantine',
+    # `salt-ci` retries the failed tests scoring at least this much, alone, up to `max_retries`
+    # times, instead of having the whole job rerun
+    retry_score=0.05,
+    max_retries=2,
+    # Days the per revision test outcomes are kept
+    outcome_ttl=30
+)
+
+_DEFAULT_PROFILING_CONFIG = dict(
+    # Sending `signal` to a salt-ci process has it profiled, with cProfile, for `window` seconds,
+    # sending it again stops it earlier. The stats are then dumped to `profiles_dir`, which
+    # defaults to `<cachedir>/salt-ci/profiles`
+    enabled=False,
+    signal='SIGUSR2',
+    window=60,
+    profiles_dir=None,
+    # Also profile the first `window` seconds of the daemons, or the whole run of the commands
+    on_start=False,
+    # Log how long each startup and per job phase takes, the configuration load, the loader
+    # modules discovery, the key authentication, the job publish and the master's event handling
+    timings=False,
+    # Write the timings to this file, whatever the log levels, instead of logging them at the
+    # info level
+    timings_file=None
+)
+
+_DEFAULT_WEB_API_CONFIG = dict(
+    # Builds per page on the build listings, unless the request asks for less
+    API_PAGE_SIZE=50,
+    # The most builds a request can ask for
+    API_MAX_PAGE_SIZE=200,
+    # Seconds a process trusts it's last lookup of the job results generation, which is what
+    # invalidates the cached responses
+    API_GENERATION_TTL=1,
+    # Maximum number of responses cached per process
+    API_CACHE_SIZE=1000,
+    # The most days of history a request can ask for
+    API_MAX_HISTORY_DAYS=365
+)
+
 
 def saltci_master_config(path):
     '''
@@ -66,6 +263,54 @@ def saltci_master_config(path):
         log_file='/var/log/salt/salt-ci-master',
         pidfile='/var/run/salt-ci-master.pid',
         # <---- Primary Configuration Settings ---------------------------------------------------
+
+        # ----- Change Impact Settings ---------------------------------------------------------->
+        impact=_DEFAULT_IMPACT_CONFIG.copy(),
+        # <---- Change Impact Settings -----------------------------------------------------------
+
+        # ----- Bulk Key Management Settings ---------------------------------------------------->
+        keys=_DEFAULT_KEYS_CONFIG.copy(),
+        # <---- Bulk Key Management Settings -----------------------------------------------------
+
+        # ----- Build Minions Pool Settings ----------------------------------------------------->
+        pool=_DEFAULT_POOL_CONFIG.copy(),
+        # <---- Build Minions Pool Settings ------------------------------------------------------
+
+        # ----- Job Queue Settings -------------------------------------------------------------->
+        queue=_DEFAULT_QUEUE_CONFIG.copy(),
+        # <---- Job Queue Settings ---------------------------------------------------------------
+
+        # ----- Build Logs Settings ------------------------------------------------------------->
+        logs=_DEFAULT_LOGS_CONFIG.copy(),
+        # <---- Build Logs Settings --------------------------------------------------------------
+
+        # ----- Live Build Events Settings ------------------------------------------------------>
+        stream=_DEFAULT_STREAM_CONFIG.copy(),
+        # <---- Live Build Events Settings -------------------------------------------------------
+
+        # ----- Results Retention Settings ------------------------------------------------------>
+        retention=_DEFAULT_RETENTION_CONFIG.copy(),
+        # <---- Results Retention Settings -------------------------------------------------------
+
+        # ----- Flaky Tests Settings ------------------------------------------------------------>
+        flaky=_DEFAULT_FLAKY_CONFIG.copy(),
+        # <---- Flaky Tests Settings -------------------------------------------------------------
+
+        # ----- Profiling Settings -------------------------------------------------------------->
+        profiling=_DEFAULT_PROFILING_CONFIG.copy(),
+        # <---- Profiling Settings ---------------------------------------------------------------
+    )
+    # The job results are written to the database when one is configured
+    opts.update(_COMMON_DB_CONFIG.copy())
+    opts.update(
+
+        # ----- Include salt-ci's minion modules on the file server ----------------------------->
+        file_roots={
+            'base': saltconfig.DEFAULT_MASTER_OPTS['file_roots']['base'] + [
+                os.path.join(os.path.dirname(__file__), 'minion')
+            ]
+        },
+        # <---- Include salt-ci's minion modules on the file server ------------------------------
     )
     # Return final and parsed options
     return saltconfig.master_config(path, 'SALT_CI_MASTER_CONFIG', opts)
@@ -98,5 +343,54 @@ def saltci_notif_config(path, check_dns=True, env_var='SALT_CI_NOTIF_CONFIG'):
         # ----- Sendmail Settings --------------------------------------------------------------->
         sendmail=_DEFAULT_SENDMAIL_CONFIG.copy(),
         # <---- Sendmail Settings ----------------------------------------------------------------
+
+        # ----- Profiling Settings -------------------------------------------------------------->
+        profiling=_DEFAULT_PROFILING_CONFIG.copy(),
+        # <---- Profiling Settings ---------------------------------------------------------------
     )
     return saltconfig.minion_config(path, check_dns=check_dns, env_var=env_var, defaults=defaults)
+
+
+def saltci_web_config(path, env_var='SALT_CI_WEB_CONFIG'):
+    '''
+    Load `salt-ci-web` configuration from the provided path.
+    '''
+    opts = _COMMON_CONFIG.copy()
+    opts.update(_COMMON_DB_CONFIG.copy())
+    opts.update(_DEFAULT_WEB_API_CONFIG.copy())
+    opts.update(
+        # ----- Primary Configuration Settings -------------------------------------------------->
+        root_dir='/',
+        user='root',
+        verify_env=True,
+        default_include='salt-ci-web.d/*.conf',
+        log_file='/var/log/salt/salt-ci-web',
+        pidfile='/var/run/salt-ci-web.pid',
+        # <---- Primary Configuration Settings ---------------------------------------------------
+
+        # ----- Web Server Settings ------------------------------------------------------------->
+        host='0.0.0.0',
+        port=5000,
+        SECRET_KEY=None,
+        # <---- Web Server Settings --------------------------------------------------------------
+    )
+
+    overrides = saltconfig.load_config(path, env_var)
+    default_include = overrides.get('default_include', opts['default_include'])
+    include = overrides.get('include', [])
+    overrides.update(saltconfig.include_config(default_include, path, verbose=False))
+    overrides.update(saltconfig.include_config(include, path, verbose=True))
+    opts.update(overrides)
+    return opts
+
+
+def section_config(opts, name, defaults):
+    '''
+    Return the `name` configuration section from `opts` merged on top of `defaults`.
+
+    Salt does not deep merge the dictionaries loaded from the configuration files, so, a section
+    which only sets some of it's keys would otherwise lose all the remaining defaults.
+    '''
+    result = defaults.copy()
+    result.update(opts.get(name, None) or {})
+    return result
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+'''
+    saltci.database
+    ~~~~~~~~~~~~~~~
+
+    Salt-CI database.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import 3rd-party libs
+from flask import Flask
+from flask.ext.sqlalchemy import SQLAlchemy
+
+db = SQLAlchemy()
+
+# The `saltci_meta` key which is bumped every time new job results are written
+RESULTS_GENERATION = 'results_generation'
+
+
+def init_app(app):
+    '''
+    Setup the database on the Flask application.
+    '''
+    db.init_app(app)
+    # Our Flask-SQLAlchemy version has no application context support. There's a single
+    # application per process, bind to it.
+    db.app = app
+
+
+def make_app(opts):
+    '''
+    Return a bare Flask application, with the database setup from the `SQLALCHEMY_*` settings
+    found on ``opts``, for the processes, like the master's, which are not serving the web.
+    '''
+    app = Flask(__name__)
+    app.config.update((key, value) for key, value in opts.iteritems() if key.isupper())
+    init_app(app)
+    return app
+
+
+def get_generation(key=RESULTS_GENERATION):
+    '''
+    Return the current value of the ``key`` generation counter.
+    '''
+    from saltci.database.models import Meta
+    meta = Meta.query.get(key)
+    if meta is None:
+        return 0
+    return meta.value
+
+
+def bump_generation(key=RESULTS_GENERATION):
+    '''
+    Increment the ``key`` generation counter, on the current transaction.
+
+    The counter is incremented by the database itself, the processes writing job results bump
+    it concurrently.
+    '''
+    from saltci.database.models import Meta
+    table = Meta.__table__
+    bump = table.update().where(table.c.key == key).values(value=table.c.value + 1)
+    if not db.session.execute(bump).rowcount:
+        # The first bump ever. A concurrent first bump either waits for this transaction, SQLite
+        # serializes the writers, or fails on the duplicate key, it's bump is never lost
+        db.session.execute(table.insert().values(key=key, value=1))
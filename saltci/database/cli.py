@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+'''
+    saltci.database.cli
+    ~~~~~~~~~~~~~~~~~~~
+
+    Salt-CI database schema migrations tool.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import python libs
+import logging
+import optparse
+
+# Import salt libs
+from salt.utils import parsers
+
+# Import salt-ci libs
+from saltci import config
+
+log = logging.getLogger(__name__)
+
+
+class SaltCIMigrate(parsers.OptionParser, parsers.ConfigDirMixIn, parsers.MergeConfigMixIn,
+                    parsers.LogLevelMixIn):
+
+    __metaclass__ = parsers.OptionParserMeta
+
+    usage = '%prog [options] <status|upgrade [VERSION]|downgrade VERSION>'
+    description = 'Upgrade, or downgrade, the Salt-CI results database schema.'
+
+    # ConfigDirMixIn configuration filename attribute
+    _config_filename_ = 'salt-ci-master'
+
+    # Report the migrations progress
+    _default_logging_level_ = 'info'
+
+    def _mixin_setup(self):
+        group = optparse.OptionGroup(self, 'Migrations Options')
+        group.add_option(
+            '--database-uri',
+            default=None,
+            dest='SQLALCHEMY_DATABASE_URI',
+            help='The database to migrate. Default: the `salt-ci-master` configured one'
+        )
+        group.add_option(
+            '--batch-size',
+            default=5000,
+            type=int,
+            help='Rows per backfill batch. Default: %default'
+        )
+        group.add_option(
+            '--batch-sleep',
+            default=0,
+            type=float,
+            help=('Seconds to sleep between backfill batches, eases the load on a busy '
+                  'database. Default: %default')
+        )
+        self.add_option_group(group)
+
+    def _mixin_after_parsed(self):
+        if not self.args or self.args[0] not in ('status', 'upgrade', 'downgrade'):
+            self.print_help()
+            self.exit(1)
+        if self.args[0] == 'downgrade' and len(self.args) < 2:
+            self.error('Please pass the version to downgrade to')
+        if len(self.args) > 1:
+            try:
+                self.args[1] = int(self.args[1])
+            except ValueError:
+                self.error('The version must be an integer')
+        if self.options.batch_size <= 0:
+            self.error('The batch size must be a positive integer')
+
+    def setup_config(self):
+        return config.saltci_master_config(self.get_config_file_path())
+
+    def run(self):
+        self.parse_args()
+
+        url = self.config['SQLALCHEMY_DATABASE_URI']
+        if not url:
+            self.error('No database is configured, please set SQLALCHEMY_DATABASE_URI')
+
+        # Late import so logging works correctly
+        from saltci.database import versioning
+        versioning.BACKFILL_SETTINGS.update(
+            batch_size=self.options.batch_size,
+            batch_sleep=self.options.batch_sleep
+        )
+
+        command = self.args[0]
+        current = versioning.db_version(url)
+        latest = versioning.latest_version()
+        if command == 'status':
+            print('Database schema version {0}, latest version {1}'.format(current, latest))
+            self.exit(0 if current == latest else 1)
+
+        version = self.args[1] if len(self.args) > 1 else None
+        if command == 'upgrade':
+            if current == (latest if version is None else version):
+                print('The database schema is up to date')
+                return
+            log.info('Upgrading the database schema from version {0} to {1}'.format(
+                current, latest if version is None else version
+            ))
+            versioning.upgrade(url, version)
+        else:
+            log.info('Downgrading the database schema from version {0} to {1}'.format(
+                current, version
+            ))
+            versioning.downgrade(url, version)
+        print('Database schema version {0}'.format(versioning.db_version(url)))
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+'''
+    Initial schema, the builds and their minions results.
+
+    Only the missing tables are created, the databases created before the migrations existed
+    already have them.
+'''
+
+# Import 3rd-party libs
+from sqlalchemy import (
+    Boolean, Column, DateTime, ForeignKey, Index, Integer, MetaData, String, Table, Text,
+    UniqueConstraint
+)
+
+meta = MetaData()
+
+meta_table = Table(
+    'saltci_meta', meta,
+    Column('key', String(64), primary_key=True),
+    Column('value', Integer, nullable=False)
+)
+
+builds = Table(
+    'builds', meta,
+    Column('id', Integer, primary_key=True),
+    Column('jid', String(20), unique=True, nullable=False),
+    Column('project', String(128), nullable=False),
+    Column('branch', String(255), nullable=False),
+    Column('fun', String(255)),
+    Column('created', DateTime, nullable=False),
+    Column('updated', DateTime, nullable=False),
+    Column('returned', Integer, nullable=False),
+    Column('failed', Integer, nullable=False),
+    Index('ix_builds_project_id', 'project', 'id'),
+    Index('ix_builds_project_branch_id', 'project', 'branch', 'id')
+)
+
+build_results = Table(
+    'build_results', meta,
+    Column('id', Integer, primary_key=True),
+    Column('build_id', Integer, ForeignKey('builds.id'), nullable=False),
+    Column('minion_id', String(255), nullable=False),
+    Column('success', Boolean, nullable=False),
+    Column('retcode', Integer),
+    Column('created', DateTime, nullable=False),
+    Column('data', Text),
+    UniqueConstraint('build_id', 'minion_id')
+)
+
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+    for table in (meta_table, builds, build_results):
+        table.create(checkfirst=True)
+
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+    for table in (build_results, builds, meta_table):
+        table.drop(checkfirst=True)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+'''
+    Build revisions and the individual test results.
+
+    The test results already reported on the stored job returns are backfilled.
+'''
+
+# Import python libs
+import json
+
+# Import 3rd-party libs
+from migrate import changeset  # pylint: disable=W0611
+from sqlalchemy import (
+    Boolean, Column, Float, ForeignKey, Index, Integer, MetaData, String, Table, select
+)
+
+# Import salt-ci libs
+from saltci.database.versioning import backfill, create_index
+
+
+def _iter_tests(data):
+    # Frozen copy of `saltci.results.iter_tests`, as it was when this migration was written
+    try:
+        ret = json.loads(data)
+    except (TypeError, ValueError):
+        return
+    if not isinstance(ret, dict) or not isinstance(ret.get('tests'), dict):
+        return
+    for name, result in ret['tests'].iteritems():
+        if isinstance(result, dict):
+            yield name, result.get('result') is True, result.get('duration')
+        else:
+            yield name, result is True, None
+
+
+def upgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    builds = Table('builds', meta, autoload=True)
+    build_results = Table('build_results', meta, autoload=True)
+
+    if 'revision' not in builds.c:
+        # Nullable and without a default, no table rewrite
+        Column('revision', String(64)).create(builds)
+
+    test_results = Table(
+        'test_results', meta,
+        Column('id', Integer, primary_key=True),
+        Column('result_id', Integer, ForeignKey('build_results.id'), nullable=False, index=True),
+        Column('build_id', Integer, ForeignKey('builds.id'), nullable=False),
+        Column('name', String(255), nullable=False),
+        Column('success', Boolean, nullable=False),
+        Column('duration', Float)
+    )
+    # Created empty, along with the result id index, which keeps the backfill resumable
+    test_results.create(checkfirst=True)
+
+    def process(connection, rows):
+        done = set(
+            row[0] for row in connection.execute(
+                select([test_results.c.result_id]).where(
+                    test_results.c.result_id.between(rows[0].id, rows[-1].id)
+                )
+            )
+        )
+        values = []
+        for row in rows:
+            if row.id in done:
+                continue
+            for name, success, duration in _iter_tests(row.data):
+                values.append({
+                    'result_id': row.id,
+                    'build_id': row.build_id,
+                    'name': name,
+                    'success': success,
+                    'duration': duration
+                })
+        if values:
+            connection.execute(test_results.insert(), values)
+
+    backfill(
+        migrate_engine, build_results, process, 'the test results',
+        where=build_results.c.data.like('%"tests"%')
+    )
+
+    # Cheaper to build once the table is filled
+    create_index(migrate_engine, 'ix_test_results_name_build_id', 'test_results',
+                 ['name', 'build_id'])
+    create_index(migrate_engine, 'ix_builds_project_revision', 'builds', ['project', 'revision'])
+
+
+def downgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    builds = Table('builds', meta, autoload=True)
+    Table('test_results', meta, autoload=True).drop()
+    Index('ix_builds_project_revision', builds.c.project, builds.c.revision).drop()
+    builds.c.revision.drop()
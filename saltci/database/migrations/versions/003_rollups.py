@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+'''
+    Daily build and test rollups, and the indexes the retention compaction needs.
+'''
+
+# Import 3rd-party libs
+from sqlalchemy import (
+    Column, Date, Float, Index, Integer, MetaData, String, Table, UniqueConstraint
+)
+
+# Import salt-ci libs
+from saltci.database.versioning import create_index
+
+
+def _tables(meta):
+    daily_rollups = Table(
+        'daily_rollups', meta,
+        Column('id', Integer, primary_key=True),
+        Column('day', Date, nullable=False, index=True),
+        Column('project', String(128), nullable=False),
+        Column('branch', String(255), nullable=False),
+        Column('builds', Integer, nullable=False),
+        Column('passed', Integer, nullable=False),
+        Column('failed', Integer, nullable=False),
+        UniqueConstraint('project', 'branch', 'day')
+    )
+    test_rollups = Table(
+        'test_rollups', meta,
+        Column('id', Integer, primary_key=True),
+        Column('day', Date, nullable=False, index=True),
+        Column('project', String(128), nullable=False),
+        Column('name', String(255), nullable=False),
+        Column('runs', Integer, nullable=False),
+        Column('passed', Integer, nullable=False),
+        Column('failed', Integer, nullable=False),
+        Column('duration_p50', Float),
+        Column('duration_p90', Float),
+        Column('duration_p99', Float),
+        UniqueConstraint('project', 'name', 'day')
+    )
+    return daily_rollups, test_rollups
+
+
+def upgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    for table in _tables(meta):
+        table.create(checkfirst=True)
+    create_index(migrate_engine, 'ix_builds_created', 'builds', ['created'])
+    create_index(migrate_engine, 'ix_test_results_build_id', 'test_results', ['build_id'])
+
+
+def downgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    for table in _tables(meta):
+        table.drop(checkfirst=True)
+    builds = Table('builds', meta, autoload=True)
+    test_results = Table('test_results', meta, autoload=True)
+    Index('ix_builds_created', builds.c.created).drop()
+    Index('ix_test_results_build_id', test_results.c.build_id).drop()
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+'''
+    Test flakiness scores and the per revision test outcomes they're computed from.
+'''
+
+# Import 3rd-party libs
+from sqlalchemy import (
+    Boolean, Column, DateTime, Float, Index, Integer, MetaData, String, Table, UniqueConstraint
+)
+
+
+def _tables(meta):
+    test_flakiness = Table(
+        'test_flakiness', meta,
+        Column('id', Integer, primary_key=True),
+        Column('project', String(128), nullable=False),
+        Column('name', String(255), nullable=False),
+        Column('runs', Integer, nullable=False),
+        Column('failures', Integer, nullable=False),
+        Column('revisions', Integer, nullable=False),
+        Column('flaky_revisions', Integer, nullable=False),
+        Column('weight', Float, nullable=False),
+        Column('flaky_weight', Float, nullable=False),
+        Column('score', Float, nullable=False),
+        Column('quarantined', Boolean, nullable=False),
+        Column('last_flaky', DateTime),
+        Column('updated', DateTime, nullable=False),
+        UniqueConstraint('project', 'name'),
+        Index('ix_test_flakiness_project_score', 'project', 'score')
+    )
+    test_revision_outcomes = Table(
+        'test_revision_outcomes', meta,
+        Column('id', Integer, primary_key=True),
+        Column('project', String(128), nullable=False),
+        Column('revision', String(64), nullable=False),
+        Column('name', String(255), nullable=False),
+        Column('passed', Integer, nullable=False),
+        Column('failed', Integer, nullable=False),
+        Column('updated', DateTime, nullable=False, index=True),
+        UniqueConstraint('project', 'revision', 'name')
+    )
+    return test_flakiness, test_revision_outcomes
+
+
+def upgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    for table in _tables(meta):
+        table.create(checkfirst=True)
+
+
+def downgrade(migrate_engine):
+    meta = MetaData(bind=migrate_engine)
+    for table in _tables(meta):
+        table.drop(checkfirst=True)
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+'''
+    saltci.database.migrations.versions
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Salt-CI database migration scripts.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+'''
+    saltci.database.models
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Salt-CI database models.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import python libs
+import json
+from datetime import datetime
+
+# Import salt-ci libs
+from saltci.database import db
+
+
+class Meta(db.Model):
+    __tablename__ = 'saltci_meta'
+
+    key = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+
+class Build(db.Model):
+    '''
+    A salt-ci job, the results of all the minions which ran it.
+    '''
+    __tablename__ = 'builds'
+    __table_args__ = (
+        # Keyset pagination of the filtered listings
+        db.Index('ix_builds_project_id', 'project', 'id'),
+        db.Index('ix_builds_project_branch_id', 'project', 'branch', 'id'),
+        db.Index('ix_builds_project_revision', 'project', 'revision'),
+        # Rollups and compaction
+        db.Index('ix_builds_created', 'created'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    jid = db.Column(db.String(20), unique=True, nullable=False)
+    project = db.Column(db.String(128), nullable=False)
+    branch = db.Column(db.String(255), nullable=False)
+    revision = db.Column(db.String(64))
+    fun = db.Column(db.String(255))
+    created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    returned = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+
+    results = db.relationship(
+        'BuildResult', backref='build', lazy='dynamic', cascade='all, delete-orphan'
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'jid': self.jid,
+            'project': self.project,
+            'branch': self.branch,
+            'revision': self.revision,
+            'fun': self.fun,
+            'created': self.created.isoformat(),
+            'updated': self.updated.isoformat(),
+            'returned': self.returned,
+            'failed': self.failed
+        }
+
+
+class BuildResult(db.Model):
+    '''
+    The job return of a single minion.
+    '''
+    __tablename__ = 'build_results'
+    __table_args__ = (
+        db.UniqueConstraint('build_id', 'minion_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    build_id = db.Column(db.Integer, db.ForeignKey('builds.id'), nullable=False)
+    minion_id = db.Column(db.String(255), nullable=False)
+    success = db.Column(db.Boolean, nullable=False)
+    retcode = db.Column(db.Integer)
+    created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    data = db.Column(db.Text)
+
+    def to_dict(self):
+        return {
+            'minion_id': self.minion_id,
+            'success': self.success,
+            'retcode': self.retcode,
+            'created': self.created.isoformat(),
+            'return': json.loads(self.data) if self.data else None
+        }
+
+
+class TestResult(db.Model):
+    '''
+    The result of a single test, as reported on a minion job return.
+    '''
+    __tablename__ = 'test_results'
+    __table_args__ = (
+        db.Index('ix_test_results_name_build_id', 'name', 'build_id'),
+        db.Index('ix_test_results_build_id', 'build_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    result_id = db.Column(
+        db.Integer, db.ForeignKey('build_results.id'), nullable=False, index=True
+    )
+    build_id = db.Column(db.Integer, db.ForeignKey('builds.id'), nullable=False)
+    name = db.Column(db.String(255), nullable=False)
+    success = db.Column(db.Boolean, nullable=False)
+    duration = db.Column(db.Float)
+
+
+class DailyRollup(db.Model):
+    '''
+    The daily build counts of a project branch.
+    '''
+    __tablename__ = 'daily_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('project', 'branch', 'day'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False, index=True)
+    project = db.Column(db.String(128), nullable=False)
+    branch = db.Column(db.String(255), nullable=False)
+    builds = db.Column(db.Integer, nullable=False)
+    passed = db.Column(db.Integer, nullable=False)
+    failed = db.Column(db.Integer, nullable=False)
+
+    def to_dict(self):
+        return {
+            'day': self.day.isoformat(),
+            'project': self.project,
+            'branch': self.branch,
+            'builds': self.builds,
+            'passed': self.passed,
+            'failed': self.failed
+        }
+
+
+class TestRollup(db.Model):
+    '''
+    The daily results and duration percentiles of a project test.
+    '''
+    __tablename__ = 'test_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('project', 'name', 'day'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False, index=True)
+    project = db.Column(db.String(128), nullable=False)
+    name = db.Column(db.String(255), nullable=False)
+    runs = db.Column(db.Integer, nullable=False)
+    passed = db.Column(db.Integer, nullable=False)
+    failed = db.Column(db.Integer, nullable=False)
+    duration_p50 = db.Column(db.Float)
+    duration_p90 = db.Column(db.Float)
+    duration_p99 = db.Column(db.Float)
+
+    def to_dict(self):
+        return {
+            'day': self.day.isoformat(),
+            'project': self.project,
+            'name': self.name,
+            'runs': self.runs,
+            'passed': self.passed,
+            'failed': self.failed,
+            'duration_p50': self.duration_p50,
+            'duration_p90': self.duration_p90,
+            'duration_p99': self.duration_p99
+        }
+
+
+class TestFlakiness(db.Model):
+    '''
+    The flakiness score of a project test, see :mod:`saltci.flaky`.
+    '''
+    __tablename__ = 'test_flakiness'
+    __table_args__ = (
+        db.UniqueConstraint('project', 'name'),
+        db.Index('ix_test_flakiness_project_score', 'project', 'score'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    project = db.Column(db.String(128), nullable=False)
+    name = db.Column(db.String(255), nullable=False)
+    runs = db.Column(db.Integer, nullable=False, default=0)
+    failures = db.Column(db.Integer, nullable=False, default=0)
+    revisions = db.Column(db.Integer, nullable=False, default=0)
+    flaky_revisions = db.Column(db.Integer, nullable=False, default=0)
+    # Decayed counts of the revisions and of the flaky revisions
+    weight = db.Column(db.Float, nullable=False, default=0)
+    flaky_weight = db.Column(db.Float, nullable=False, default=0)
+    score = db.Column(db.Float, nullable=False, default=0)
+    quarantined = db.Column(db.Boolean, nullable=False, default=False)
+    last_flaky = db.Column(db.DateTime)
+    updated = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'project': self.project,
+            'name': self.name,
+            'runs': self.runs,
+            'failures': self.failures,
+            'revisions': self.revisions,
+            'flaky_revisions': self.flaky_revisions,
+            'score': self.score,
+            'quarantined': self.quarantined,
+            'last_flaky': self.last_flaky.isoformat() if self.last_flaky else None
+        }
+
+
+class TestRevisionOutcome(db.Model):
+    '''
+    How many times a test passed and failed on a revision.
+    '''
+    __tablename__ = 'test_revision_outcomes'
+    __table_args__ = (
+        db.UniqueConstraint('project', 'revision', 'name'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    project = db.Column(db.String(128), nullable=False)
+    revision = db.Column(db.String(64), nullable=False)
+    name = db.Column(db.String(255), nullable=False)
+    passed = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+    updated = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+'''
+    saltci.database.versioning
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Salt-CI database schema migrations.
+
+    The migration scripts, see `saltci/database/migrations/versions`, are run by
+    `sqlalchemy-migrate`. They must not lock the large tables for long, the master keeps writing
+    job results while they run:
+
+    * only add nullable columns without defaults, no table rewrite
+    * fill in existing rows with :func:`backfill`, in small id ranged batches, each on it's own
+      transaction
+    * build the indexes on existing tables with :func:`create_index`, concurrently on PostgreSQL
+      and as online DDL on MySQL
+
+    Upgrade the database before upgrading the master and the web dashboard, the previous code
+    keeps working against the upgraded schema.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import python libs
+import os
+import time
+import logging
+
+# Import 3rd-party libs
+import sqlalchemy
+from migrate.versioning import api
+from migrate.exceptions import DatabaseNotControlledError
+
+log = logging.getLogger(__name__)
+
+REPOSITORY = os.path.join(os.path.dirname(__file__), 'migrations')
+
+# Seconds between backfill progress reports
+PROGRESS_INTERVAL = 5
+
+# Tweaked by `salt-ci-migrate`, the migration scripts are only passed the engine
+BACKFILL_SETTINGS = {
+    # Rows per batch
+    'batch_size': 5000,
+    # Seconds to sleep between batches, eases the I/O load on a busy database
+    'batch_sleep': 0
+}
+
+
+def db_version(url):
+    '''
+    Return the database schema version, ``0`` when the database is not under version control.
+    The database is never changed.
+    '''
+    try:
+        return api.db_version(url, REPOSITORY)
+    except DatabaseNotControlledError:
+        return 0
+
+
+def version_control(url):
+    '''
+    Put the database under version control, at version ``0``, unless it already is.
+    '''
+    try:
+        api.db_version(url, REPOSITORY)
+    except DatabaseNotControlledError:
+        # The initial migration creates only the missing tables, so, databases created before
+        # the migrations existed start from scratch too
+        api.version_control(url, REPOSITORY, 0)
+
+
+def latest_version():
+    '''
+    Return the latest schema version.
+    '''
+    return api.version(REPOSITORY)
+
+
+def upgrade(url, version=None):
+    version_control(url)
+    api.upgrade(url, REPOSITORY, version)
+
+
+def downgrade(url, version):
+    version_control(url)
+    api.downgrade(url, REPOSITORY, version)
+
+
+def backfill(engine, table, process, description, where=None):
+    '''
+    Call ``process(connection, rows)`` with the rows of ``table``, in id ranged batches, each one
+    on it's own transaction. ``where`` optionally filters the rows of each batch.
+
+    A range scan on the primary key never locks more than a batch of rows, and, unlike paging
+    with ``OFFSET``, costs the same no matter how far the backfill got. The rows inserted while
+    the backfill runs are picked up too.
+    '''
+    batch_size = BACKFILL_SETTINGS['batch_size']
+    pk = table.c.id
+    first, last = engine.execute(
+        sqlalchemy.select([sqlalchemy.func.min(pk), sqlalchemy.func.max(pk)])
+    ).fetchone()
+    if first is None:
+        log.info('Backfilling {0}: nothing to do'.format(description))
+        return
+
+    started = reported = time.time()
+    done = 0
+    position = first - 1
+    while True:
+        if position >= last:
+            # Catch up with the rows inserted meanwhile
+            last = engine.execute(sqlalchemy.select([sqlalchemy.func.max(pk)])).scalar()
+            if position >= last:
+                break
+
+        query = table.select().where(pk > position).where(pk <= position + batch_size)
+        if where is not None:
+            query = query.where(where)
+        with engine.begin() as connection:
+            rows = connection.execute(query.order_by(pk)).fetchall()
+            if rows:
+                process(connection, rows)
+        position += batch_size
+        done += len(rows)
+
+        now = time.time()
+        if now - reported >= PROGRESS_INTERVAL:
+            reported = now
+            log.info(
+                'Backfilling {0}: {1:.1f}% ({2} rows, {3:.0f} rows/s)'.format(
+                    description,
+                    100.0 * min(position - first + 1, last - first + 1) / (last - first + 1),
+                    done,
+                    done / (now - started)
+                )
+            )
+        if BACKFILL_SETTINGS['batch_sleep']:
+            time.sleep(BACKFILL_SETTINGS['batch_sleep'])
+
+    log.info('Backfilled {0}: {1} rows in {2:.1f} seconds'.format(
+        description, done, time.time() - started
+    ))
+
+
+def _pg_index_valid(engine, name):
+    # `None` if the index does not exist
+    return engine.execute(
+        sqlalchemy.text(
+            'SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+            'WHERE c.relname = :name'
+        ),
+        name=name
+    ).scalar()
+
+
+def create_index(engine, name, table, columns, unique=False):
+    '''
+    Create an index on an existing, possibly large and busy, table without blocking it's writes.
+    '''
+    preparer = engine.dialect.identifier_preparer
+    statement = '{0} INDEX {1} ON {2} ({3})'.format(
+        'CREATE UNIQUE' if unique else 'CREATE',
+        preparer.quote_identifier(name),
+        preparer.quote_identifier(table),
+        ', '.join(preparer.quote_identifier(column) for column in columns)
+    )
+    started = time.time()
+
+    if engine.dialect.name == 'postgresql':
+        valid = _pg_index_valid(engine, name)
+        if valid:
+            log.info('Index {0} already exists'.format(name))
+            return
+        if valid is False:
+            # Left over by an interrupted concurrent build
+            log.info('Dropping the invalid index {0}'.format(name))
+            _pg_autocommit(engine, 'DROP INDEX {0}'.format(preparer.quote_identifier(name)))
+        log.info('Building the index {0} concurrently'.format(name))
+        _pg_autocommit(engine, statement.replace(' INDEX ', ' INDEX CONCURRENTLY ', 1))
+    else:
+        inspector = sqlalchemy.engine.reflection.Inspector.from_engine(engine)
+        if name in [index['name'] for index in inspector.get_indexes(table)]:
+            log.info('Index {0} already exists'.format(name))
+            return
+        if engine.dialect.name == 'mysql':
+            # InnoDB online DDL, concurrent reads and writes are allowed
+            statement += ' ALGORITHM=INPLACE LOCK=NONE'
+        log.info('Building the index {0}'.format(name))
+        engine.execute(statement)
+
+    log.info('Built the index {0} in {1:.1f} seconds'.format(name, time.time() - started))
+
+
+def _pg_autocommit(engine, statement):
+    # `CONCURRENTLY` can not run inside a transaction block
+    connection = engine.raw_connection()
+    isolation_level = connection.connection.isolation_level
+    try:
+        connection.connection.set_isolation_level(0)
+        cursor = connection.cursor()
+        cursor.execute(statement)
+        cursor.close()
+    finally:
+        # The connection goes back to the pool
+        connection.connection.set_isolation_level(isolation_level)
+        connection.close()
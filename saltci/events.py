@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+'''
+    saltci.events
+    ~~~~~~~~~~~~~
+
+    Salt-CI master event processing.
+
+    A single process subscribes to salt's master event bus and hands every event over to the
+    registered handlers, that way, no matter how many Salt-CI features are interested in the job
+    returns, the event bus is only consumed once.
+
+    Salt-CI fires a :data:`BUILD_EVENT_TAG` event, with the project, branch and revision being
+    built, right before publishing a build job, using a job id it picked. Only the returns of
+    those jobs are builds, salt-ci's own housekeeping jobs, the key manager pings for example,
+    are not.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import python libs
+import time
+import logging
+import multiprocessing
+from datetime import datetime
+
+# Import salt libs
+import salt.utils.event
+
+# Import salt-ci libs
+from saltci import profiling
+
+log = logging.getLogger(__name__)
+
+# The tag of the events fired before publishing a build job. Salt's event tags are at most 20
+# characters long
+BUILD_EVENT_TAG = 'saltci_build'
+
+
+def is_job_return(tag, data):
+    '''
+    Return ``True`` if the event is a minion job return.
+
+    Salt fires the job returns using the job ID as the event tag.
+    '''
+    return isinstance(data, dict) and \
+        'return' in data and 'id' in data and data.get('jid', None) == tag
+
+
+def new_jid():
+    '''
+    Return a new job id, in salt's format, to publish a job with.
+    '''
+    return '{0:%Y%m%d%H%M%S%f}'.format(datetime.now())
+
+
+def fire_build(opts, jid, project, branch, revision, fun, event=None):
+    '''
+    Announce, on the master event bus, that the job ``jid`` about to be published is a build.
+    '''
+    if event is None:
+        event = salt.utils.event.MasterEvent(opts['sock_dir'])
+    event.fire_event(
+        {
+            'jid': jid,
+            'project': project,
+            'branch': branch,
+            'revision': revision,
+            'fun': fun
+        },
+        BUILD_EVENT_TAG
+    )
+
+
+def is_build(tag, data):
+    '''
+    Return ``True`` if the event announces a build job.
+    '''
+    return tag == BUILD_EVENT_TAG and isinstance(data, dict) and bool(data.get('jid'))
+
+
+class EventHandler(object):
+    '''
+    Base class for the handlers of the master events.
+    '''
+
+    # How often, in seconds, to call :meth:`maintenance`
+    maintenance_interval = 60
+
+    def __init__(self, opts):
+        self.opts = opts
+
+    def setup(self):
+        '''
+        Called once, within the event processing process, before any event is handled.
+        '''
+
+    def handle_event(self, tag, data):
+        '''
+        Handle a single event.
+        '''
+        raise NotImplementedError
+
+    def maintenance(self):
+        '''
+        Periodic work, called at most every :attr:`maintenance_interval` seconds.
+        '''
+
+
+class EventProcessor(multiprocessing.Process):
+    '''
+    Consume salt's master event bus and dispatch the events to the Salt-CI handlers.
+    '''
+
+    def __init__(self, opts, handlers):
+        super(EventProcessor, self).__init__(name='EventProcessor')
+        self.opts = opts
+        self.handlers = handlers
+        self.daemon = True
+
+    def run(self):
+        event = salt.utils.event.MasterEvent(self.opts['sock_dir'])
+        last_maintenance = {}
+        for handler in self.handlers:
+            with profiling.timed('handler_setup', handler=handler.__class__.__name__):
+                handler.setup()
+            last_maintenance[handler] = time.time()
+        timings = profiling.timings_enabled()
+
+        while True:
+            payload = event.get_event(wait=1, full=True)
+            if payload is not None:
+                # handler name -> seconds spent on the event
+                spent = {}
+                for handler in self.handlers:
+                    started = time.time()
+                    try:
+                        handler.handle_event(payload['tag'], payload['data'])
+                    except Exception, err:
+                        log.error(
+                            'Failed to handle event {0!r} on {1}: {2}'.format(
+                                payload['tag'], handler.__class__.__name__, err
+                            ),
+                            exc_info=True
+                        )
+                    if timings:
+                        spent[handler.__class__.__name__] = time.time() - started
+                if timings and is_job_return(payload['tag'], payload['data']):
+                    fields = dict(
+                        (name, '{0:.4f}'.format(seconds)) for name, seconds in spent.iteritems()
+                    )
+                    profiling.log_timing(
+                        'job_return',
+                        sum(spent.itervalues()),
+                        jid=payload['tag'],
+                        minion=payload['data']['id'],
+                        **fields
+                    )
+
+            now = time.time()
+            for handler in self.handlers:
+                if now - last_maintenance[handler] < handler.maintenance_interval:
+                    continue
+                last_maintenance[handler] = now
+                try:
+                    handler.maintenance()
+                except Exception, err:
+                    log.error(
+                        'Failed to run the maintenance of {0}: {1}'.format(
+                            handler.__class__.__name__, err
+                        ),
+                        exc_info=True
+                    )
+
+
+def load_handlers(opts):
+    '''
+    Return the event handlers enabled on the provided configuration.
+    '''
+    # Late imports so that the handlers can import from this module
+    from saltci.impact import ImpactRecorder
+    from saltci.keys import KeyManager
+    from saltci.logs import LogWriter
+    from saltci.pool import MinionPool
+    from saltci.queue import JobQueue
+    from saltci.results import ResultRecorder
+    from saltci.stream import EventStream
+
+    return [
+        ImpactRecorder(opts),
+        KeyManager(opts),
+        MinionPool(opts),
+        JobQueue(opts),
+        LogWriter(opts),
+        ResultRecorder(opts),
+        EventStream(opts),
+    ]
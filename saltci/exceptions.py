@@ -22,3 +22,28 @@ class SaltCIStartupException(SaltCIException):
     '''
     This exception is raised to let the user that something is wrong and Salt-CI could not start
     '''
+
+
+class SaltCIChangeImpactError(SaltCIException):
+    '''
+    This exception is raised when the change-impact index cannot be read or the changed files
+    cannot be determined.
+    '''
+
+
+class SaltCIPoolError(SaltCIException):
+    '''
+    This exception is raised when the minion pool fails to manage it's build minions.
+    '''
+
+
+class SaltCIQueueError(SaltCIException):
+    '''
+    This exception is raised when a job cannot be queued or it's queued state cannot be tracked.
+    '''
+
+
+class SaltCILogsError(SaltCIException):
+    '''
+    This exception is raised when the build logs of a job cannot be found.
+    '''
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+'''
+    saltci.flaky
+    ~~~~~~~~~~~~
+
+    Flaky tests detection.
+
+    A test is flaky on a revision when it both passed and failed on it. Each test's score is the
+    share of the revisions it ran on where it was flaky, with the past revisions weighing less
+    and less, so that a fixed test's score fades away. Only the builds which were run, queued or
+    not, with a ``--revision`` can be scored.
+
+    The analysis runs on it's own process, the master's event processing is never held up by it,
+    and is incremental, every check only reads the test results recorded since the
+    previous one, tracked by a watermark on ``saltci_meta``, and updates the per revision
+    outcomes and the scores of the tests seen. The scores of the tests worth retrying, and
+    whether they're quarantined, are exported to a shared state file, `salt-ci` reads it without
+    querying the database.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import python libs
+import time
+import logging
+import multiprocessing
+from datetime import datetime, timedelta
+
+# Import salt-ci libs
+from saltci import database
+from saltci.config import section_config, _DEFAULT_FLAKY_CONFIG
+from saltci.utils import SharedState
+
+log = logging.getLogger(__name__)
+
+# The `saltci_meta` key holding the id of the last analyzed test result
+WATERMARK = 'flaky_test_result'
+
+# Stale per revision outcomes deleted per check
+PRUNE_BATCH_SIZE = 1000
+
+
+def get_config(opts):
+    '''
+    Return the flaky tests configuration merged with it's defaults.
+    '''
+    return section_config(opts, 'flaky', _DEFAULT_FLAKY_CONFIG)
+
+
+class FlakyState(SharedState):
+    '''
+    The tests worth retrying, ``{project: {name: {'score': ..., 'quarantined': ...}}}``, shared
+    between the master and `salt-ci`.
+    '''
+
+    name = 'flaky'
+    default = {'projects': {}}
+
+
+def project_tests(opts, project):
+    '''
+    Return the ``{name: {'score': ..., 'quarantined': ...}}`` tests worth retrying of ``project``.
+    '''
+    return FlakyState(opts).read()['projects'].get(project, {})
+
+
+def analyzed_until():
+    '''
+    Return the id of the last analyzed test result.
+    '''
+    from saltci.database.models import Meta
+    meta = Meta.query.get(WATERMARK)
+    return meta.value if meta is not None else 0
+
+
+def first_pending_build():
+    '''
+    Return the id of the oldest build with test results which were not analyzed yet, or ``None``.
+    '''
+    from saltci.database.models import TestResult
+    return database.db.session.query(database.db.func.min(TestResult.build_id)).filter(
+        TestResult.id > analyzed_until()
+    ).scalar()
+
+
+def _load(model, project, names, **filters):
+    # `{name: instance}` of the ``project`` rows for ``names``
+    instances = {}
+    names = list(names)
+    for idx in range(0, len(names), 500):
+        query = model.query.filter(model.project == project, model.name.in_(names[idx:idx + 500]))
+        if filters:
+            query = query.filter_by(**filters)
+        for instance in query:
+            instances[instance.name] = instance
+    return instances
+
+
+def analyze_batch(config, now=None):
+    '''
+    Analyze the next batch of test results, on it's own transaction. Returns the projects
+    whose tests were analyzed, an empty set once everything was analyzed.
+    '''
+    from saltci.database.models import (
+        Build, Meta, TestFlakiness, TestResult, TestRevisionOutcome
+    )
+
+    now = now or datetime.utcnow()
+    watermark = analyzed_until()
+    rows = database.db.session.query(
+        TestResult.id, TestResult.name, TestResult.success, Build.project, Build.revision
+    ).join(Build, TestResult.build_id == Build.id).filter(
+        TestResult.id > watermark
+    ).order_by(TestResult.id).limit(config['batch_size']).all()
+    if not rows:
+        return set()
+
+    # project -> test names, (project, revision) -> test names
+    names = {}
+    revision_names = {}
+    for _, name, _, project, revision in rows:
+        names.setdefault(project, set()).add(name)
+        if revision:
+            revision_names.setdefault((project, revision), set()).add(name)
+
+    scores = {}
+    for project, project_names in names.iteritems():
+        for name, instance in _load(TestFlakiness, project, project_names).iteritems():
+            scores[(project, name)] = instance
+    outcomes = {}
+    for (project, revision), project_names in revision_names.iteritems():
+        loaded = _load(TestRevisionOutcome, project, project_names, revision=revision)
+        for name, instance in loaded.iteritems():
+            outcomes[(project, revision, name)] = instance
+
+    for _, name, success, project, revision in rows:
+        score = scores.get((project, name))
+        if score is None:
+            score = scores[(project, name)] = TestFlakiness(
+                project=project, name=name, runs=0, failures=0, revisions=0,
+                flaky_revisions=0, weight=0.0, flaky_weight=0.0, score=0.0, quarantined=False
+            )
+            database.db.session.add(score)
+        score.runs += 1
+        score.failures += not success
+        score.updated = now
+        if not revision:
+            # Nothing to compare against
+            continue
+
+        outcome = outcomes.get((project, revision, name))
+        if outcome is None:
+            outcome = outcomes[(project, revision, name)] = TestRevisionOutcome(
+                project=project, revision=revision, name=name, passed=0, failed=0
+            )
+            database.db.session.add(outcome)
+            score.revisions += 1
+            score.weight = score.weight * config['decay'] + 1
+            score.flaky_weight *= config['decay']
+
+        was_flaky = outcome.passed and outcome.failed
+        if success:
+            outcome.passed += 1
+        else:
+            outcome.failed += 1
+        outcome.updated = now
+        if not was_flaky and outcome.passed and outcome.failed:
+            score.flaky_revisions += 1
+            score.flaky_weight += 1
+            score.last_flaky = now
+
+    for score in scores.itervalues():
+        score.score = score.flaky_weight / score.weight if score.weight else 0.0
+        score.quarantined = bool(config['quarantine']) and \
+            score.score >= config['quarantine_score'] and \
+            score.flaky_revisions >= config['min_flaky_revisions']
+
+    meta = Meta.query.get(WATERMARK)
+    if meta is None:
+        meta = Meta(key=WATERMARK)
+        database.db.session.add(meta)
+    meta.value = rows[-1][0]
+    try:
+        database.db.session.commit()
+    except Exception:
+        database.db.session.rollback()
+        raise
+    return set(names)
+
+
+def export(opts, config, projects):
+    '''
+    Write the tests worth retrying of ``projects`` to the shared state.
+    '''
+    from saltci.database.models import TestFlakiness
+
+    exported = {}
+    for project in projects:
+        exported[project] = dict(
+            (row.name, {'score': row.score, 'quarantined': row.quarantined})
+            for row in TestFlakiness.query.filter(
+                TestFlakiness.project == project,
+                TestFlakiness.score >= config['retry_score']
+            )
+        )
+    with FlakyState(opts).locked() as state:
+        state['projects'].update(exported)
+
+
+def prune(config, now=None):
+    '''
+    Delete a batch of the per revision outcomes older than ``outcome_ttl`` days.
+    '''
+    from saltci.database.models import TestRevisionOutcome
+
+    cutoff = (now or datetime.utcnow()) - timedelta(days=config['outcome_ttl'])
+    ids = [
+        row[0] for row in database.db.session.query(TestRevisionOutcome.id).filter(
+            TestRevisionOutcome.updated < cutoff
+        ).limit(PRUNE_BATCH_SIZE)
+    ]
+    if not ids:
+        return 0
+    try:
+        TestRevisionOutcome.query.filter(TestRevisionOutcome.id.in_(ids)).delete(
+            synchronize_session=False
+        )
+        database.db.session.commit()
+    except Exception:
+        database.db.session.rollback()
+        raise
+    return len(ids)
+
+
+class FlakyProcess(multiprocessing.Process):
+    '''
+    Periodically analyze the newly recorded test results.
+    '''
+
+    def __init__(self, opts):
+        super(FlakyProcess, self).__init__(name='FlakyProcess')
+        self.opts = opts
+        self.daemon = True
+
+    def run(self):
+        config = get_config(self.opts)
+        database.make_app(self.opts)
+        while True:
+            try:
+                self.check(config)
+            except Exception, err:
+                log.error('Failed to analyze the test results: {0}'.format(err), exc_info=True)
+            time.sleep(config['check_interval'])
+
+    def check(self, config):
+        projects = set()
+        # Bounded, so that a backlog does not delay the exports for too long
+        for _ in range(config['max_batches']):
+            analyzed = analyze_batch(config)
+            if not analyzed:
+                break
+            projects.update(analyzed)
+        if projects:
+            # Once per check, not per batch, every bump invalidates the web API cached responses
+            try:
+                database.bump_generation()
+                database.db.session.commit()
+            except Exception:
+                database.db.session.rollback()
+                raise
+            export(self.opts, config, projects)
+            log.debug('Analyzed the test results of {0}'.format(', '.join(sorted(projects))))
+        prune(config)
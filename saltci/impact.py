@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+'''
+    saltci.impact
+    ~~~~~~~~~~~~~
+
+    Change-impact test selection.
+
+    The test runs report, per test, which source files were executed. That coverage data is
+    turned into a `file -> tests` index which allows `salt-ci` to only dispatch the tests affected
+    by a git diff range.
+
+    The index is stored in a compact binary format which is mmap'ed by the readers, this way, a
+    lookup is a binary search over the file entries and never requires loading the whole index.
+    All integers are little endian unsigned 32 bit integers::
+
+        header      magic, version, tests count, files count, postings count
+        tests       (name offset, name length) for each test
+        files       (path offset, path length, postings offset, postings count) for each file,
+                    sorted by path
+        postings    the test indexes which cover each file
+        strings     the UTF-8 encoded test names and paths
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import python libs
+import os
+import mmap
+import struct
+import fnmatch
+import logging
+import tempfile
+import subprocess
+
+# Import salt-ci libs
+from saltci.config import section_config, _DEFAULT_IMPACT_CONFIG
+from saltci.events import EventHandler, is_job_return
+from saltci.exceptions import SaltCIChangeImpactError
+
+log = logging.getLogger(__name__)
+
+_MAGIC = 'SCII'
+_VERSION = 1
+_HEADER = struct.Struct('<4sIIII')
+_TEST_ENTRY = struct.Struct('<II')
+_FILE_ENTRY = struct.Struct('<IIII')
+_POSTING = struct.Struct('<I')
+
+
+def _encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def get_config(opts):
+    '''
+    Return the change-impact configuration merged with it's defaults.
+    '''
+    config = section_config(opts, 'impact', _DEFAULT_IMPACT_CONFIG)
+    if not config['index_path']:
+        config['index_path'] = os.path.join(opts['cachedir'], 'salt-ci', 'impact.idx')
+    return config
+
+
+class ChangeImpactIndex(object):
+    '''
+    Read-only, mmap'ed, access to a change-impact index file.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._mmap = None
+        self.tests_count = self.files_count = self.postings_count = 0
+
+        if not os.path.isfile(path) or os.path.getsize(path) == 0:
+            # No index yet, behave as an empty one
+            return
+
+        with open(path, 'rb') as fd_:
+            self._mmap = mmap.mmap(fd_.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._mmap) < _HEADER.size:
+            self.close()
+            raise SaltCIChangeImpactError('{0} is not a valid impact index'.format(path))
+
+        magic, version, self.tests_count, self.files_count, self.postings_count = \
+            _HEADER.unpack_from(self._mmap, 0)
+        if magic != _MAGIC or version != _VERSION:
+            self.close()
+            raise SaltCIChangeImpactError(
+                '{0} is not a version {1} impact index'.format(path, _VERSION)
+            )
+
+        self._tests_offset = _HEADER.size
+        self._files_offset = self._tests_offset + self.tests_count * _TEST_ENTRY.size
+        self._postings_offset = self._files_offset + self.files_count * _FILE_ENTRY.size
+        self._strings_offset = self._postings_offset + self.postings_count * _POSTING.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def _string(self, offset, length):
+        start = self._strings_offset + offset
+        return self._mmap[start:start + length]
+
+    def _file_entry(self, index):
+        return _FILE_ENTRY.unpack_from(self._mmap, self._files_offset + index * _FILE_ENTRY.size)
+
+    def _test_name(self, index):
+        return self._string(
+            *_TEST_ENTRY.unpack_from(self._mmap, self._tests_offset + index * _TEST_ENTRY.size)
+        )
+
+    def _postings(self, offset, count):
+        start = self._postings_offset + offset * _POSTING.size
+        return struct.unpack_from('<{0}I'.format(count), self._mmap, start)
+
+    def tests_for(self, path):
+        '''
+        Return the tests which cover ``path`` or ``None`` if the path is not on the index.
+        '''
+        if self._mmap is None:
+            return None
+
+        path = _encode(path)
+        low, high = 0, self.files_count
+        while low < high:
+            middle = (low + high) // 2
+            path_offset, path_length, postings_offset, postings_count = self._file_entry(middle)
+            current = self._string(path_offset, path_length)
+            if current < path:
+                low = middle + 1
+            elif current > path:
+                high = middle
+            else:
+                return set(
+                    self._test_name(idx) for idx in self._postings(postings_offset, postings_count)
+                )
+        return None
+
+    def load(self):
+        '''
+        Load the whole index as a ``{test: set(paths)}`` dictionary.
+        '''
+        coverage = {}
+        if self._mmap is None:
+            return coverage
+
+        tests = [self._test_name(idx) for idx in range(self.tests_count)]
+        for test in tests:
+            coverage[test] = set()
+
+        for index in range(self.files_count):
+            path_offset, path_length, postings_offset, postings_count = self._file_entry(index)
+            path = self._string(path_offset, path_length)
+            for idx in self._postings(postings_offset, postings_count):
+                coverage[tests[idx]].add(path)
+        return coverage
+
+
+def write_index(path, coverage):
+    '''
+    Atomically write a ``{test: paths}`` coverage mapping as a change-impact index.
+    '''
+    tests = sorted(_encode(test) for test in coverage)
+    test_ids = dict((test, idx) for idx, test in enumerate(tests))
+
+    files = {}
+    for test, paths in coverage.iteritems():
+        test_id = test_ids[_encode(test)]
+        for fpath in paths:
+            files.setdefault(_encode(fpath), set()).add(test_id)
+
+    strings = []
+    state = {'size': 0}
+
+    def add_string(value):
+        offset = state['size']
+        strings.append(value)
+        state['size'] += len(value)
+        return offset, len(value)
+
+    tests_table = [_TEST_ENTRY.pack(*add_string(test)) for test in tests]
+    files_table = []
+    postings = []
+    for fpath in sorted(files):
+        covering = sorted(files[fpath])
+        path_offset, path_length = add_string(fpath)
+        files_table.append(
+            _FILE_ENTRY.pack(path_offset, path_length, len(postings), len(covering))
+        )
+        postings.extend(covering)
+
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+
+    fd_, tmp_path = tempfile.mkstemp(prefix='.impact-', dir=dirname)
+    try:
+        with os.fdopen(fd_, 'wb') as wfh:
+            wfh.write(_HEADER.pack(_MAGIC, _VERSION, len(tests), len(files), len(postings)))
+            wfh.write(''.join(tests_table))
+            wfh.write(''.join(files_table))
+            wfh.write(struct.pack('<{0}I'.format(len(postings)), *postings))
+            wfh.write(''.join(strings))
+        # Readers which already have the previous index mmap'ed keep on using it
+        os.rename(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def update_index(path, coverage):
+    '''
+    Replace, on the index, the coverage data of the tests found in ``coverage``.
+
+    Tests which are not part of ``coverage`` keep their previously recorded data. A test reported
+    without any covered paths is removed from the index.
+
+    The index is not updated in place, it's loaded and written back whole, so, an update costs as
+    much as the whole index, no matter how few tests changed. Batch the updates, like
+    :class:`ImpactRecorder` does.
+    '''
+    with ChangeImpactIndex(path) as index:
+        current = index.load()
+
+    for test, paths in coverage.iteritems():
+        test = _encode(test)
+        if paths:
+            current[test] = set(_encode(fpath) for fpath in paths)
+        else:
+            current.pop(test, None)
+
+    write_index(path, current)
+    log.info(
+        'Updated the change-impact index {0} with the coverage of {1} test(s)'.format(
+            path, len(coverage)
+        )
+    )
+
+
+def changed_files(diff_range, repo_path=None):
+    '''
+    Return the paths changed on the git ``diff_range``, relative to the repository root.
+    '''
+    try:
+        proc = subprocess.Popen(
+            ['git', 'diff', '--name-only', '-z', diff_range],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=repo_path
+        )
+    except OSError, err:
+        raise SaltCIChangeImpactError('Failed to run git: {0}'.format(err))
+
+    out, err = proc.communicate()
+    if proc.returncode != 0:
+        raise SaltCIChangeImpactError(
+            'Failed to get the changed files for {0!r}: {1}'.format(diff_range, err.strip())
+        )
+    return [fpath for fpath in out.split('\0') if fpath]
+
+
+def select_tests(opts, paths):
+    '''
+    Return the tests affected by the changes to ``paths``.
+
+    ``None`` is returned when any of the changed paths is unknown to the index, in which case the
+    whole test suite needs to run since nothing can be assumed about that path.
+    '''
+    config = get_config(opts)
+    selected = set()
+    with ChangeImpactIndex(config['index_path']) as index:
+        for fpath in paths:
+            if any(fnmatch.fnmatch(fpath, pattern) for pattern in config['ignore']):
+                continue
+            tests = index.tests_for(fpath)
+            if tests is None:
+                log.info('{0} is not on the change-impact index'.format(fpath))
+                return None
+            selected.update(tests)
+    return selected
+
+
+class ImpactRecorder(EventHandler):
+    '''
+    Feed the coverage data found on the job returns to the change-impact index.
+
+    The updates are batched and written on :meth:`maintenance` so that a test run returning from
+    several minions only rewrites the index once.
+    '''
+
+    maintenance_interval = 5
+
+    def setup(self):
+        self.config = get_config(self.opts)
+        self.pending = {}
+
+    def _normalize_path(self, fpath):
+        for prefix in self.config['strip_prefixes']:
+            if fpath.startswith(prefix):
+                fpath = fpath[len(prefix):].lstrip('/')
+                break
+        return os.path.normpath(fpath)
+
+    def handle_event(self, tag, data):
+        if not is_job_return(tag, data):
+            return
+        ret = data['return']
+        if not isinstance(ret, dict) or not isinstance(ret.get(self.config['coverage_key']), dict):
+            return
+        for test, paths in ret[self.config['coverage_key']].iteritems():
+            self.pending[test] = [self._normalize_path(fpath) for fpath in paths or ()]
+
+    def maintenance(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        update_index(self.config['index_path'], pending)
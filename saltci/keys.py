@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+'''
+    saltci.keys
+    ~~~~~~~~~~~
+
+    Bulk minion key management.
+
+    Salt's key management re-scans the whole `pki_dir` on every single operation, which, when
+    bringing up hundreds of ephemeral CI minions, makes accepting their keys painfully slow.
+    :class:`KeyIndex` scans the key directories once and keeps an in-memory index of the keys
+    which is updated as the keys are accepted, rejected or deleted.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import python libs
+import os
+import time
+import hashlib
+import fnmatch
+import logging
+
+# Import salt libs
+import salt.key
+import salt.utils
+import salt.client
+import salt.utils.event
+
+# Import salt-ci libs
+from saltci.config import section_config, _DEFAULT_KEYS_CONFIG
+from saltci.events import EventHandler
+
+log = logging.getLogger(__name__)
+
+ACCEPTED = 'minions'
+PENDING = 'minions_pre'
+REJECTED = 'minions_rejected'
+
+
+def get_config(opts):
+    '''
+    Return the bulk key management configuration merged with it's defaults.
+    '''
+    return section_config(opts, 'keys', _DEFAULT_KEYS_CONFIG)
+
+
+def finger(pub):
+    '''
+    Return the fingerprint of a public key string, the same way ``salt.utils.pem_finger`` does for
+    a public key file.
+    '''
+    key = ''.join(pub.strip().splitlines(True)[1:-1])
+    pre = hashlib.md5(key).hexdigest()
+    return ':'.join(pre[idx:idx + 2] for idx in range(0, len(pre), 2))
+
+
+def load_fingerprints(path):
+    '''
+    Load a fingerprint allowlist file, one fingerprint per line, comments start with ``#``.
+    '''
+    fingerprints = set()
+    with salt.utils.fopen(path, 'r') as rfh:
+        for line in rfh:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                fingerprints.add(line.lower())
+    return fingerprints
+
+
+class KeyIndex(object):
+    '''
+    In-memory index of the minion keys found on the master's `pki_dir`.
+    '''
+
+    def __init__(self, opts):
+        self.opts = opts
+        self.event = salt.utils.event.MasterEvent(opts['sock_dir'])
+        self.keys = {}
+        self._fingers = {}
+        self.refresh()
+
+    def refresh(self):
+        '''
+        Re-scan the key directories, one ``listdir`` per key status.
+        '''
+        for status in (ACCEPTED, PENDING, REJECTED):
+            dirname = os.path.join(self.opts['pki_dir'], status)
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            self.keys[status] = set(os.listdir(dirname))
+        self._fingers.clear()
+
+    def _path(self, status, minion_id):
+        return os.path.join(self.opts['pki_dir'], status, minion_id)
+
+    def status(self, minion_id):
+        '''
+        Return the status of the minion key or ``None`` if it's unknown.
+        '''
+        for status, keys in self.keys.iteritems():
+            if minion_id in keys:
+                return status
+        return None
+
+    def match(self, patterns, status=PENDING):
+        '''
+        Return the sorted minion ids, under ``status``, matching any of the glob ``patterns``.
+        '''
+        if isinstance(patterns, basestring):
+            patterns = [patterns]
+        return salt.utils.isorted(
+            minion_id for minion_id in self.keys[status]
+            if any(fnmatch.fnmatch(minion_id, pattern) for pattern in patterns)
+        )
+
+    def finger(self, minion_id, status=PENDING):
+        '''
+        Return, and cache, the fingerprint of the minion key.
+        '''
+        if (status, minion_id) not in self._fingers:
+            self._fingers[(status, minion_id)] = salt.utils.pem_finger(
+                self._path(status, minion_id)
+            )
+        return self._fingers[(status, minion_id)]
+
+    def _move(self, minion_ids, src, dst, act):
+        moved = []
+        for minion_id in minion_ids:
+            if minion_id not in self.keys[src]:
+                continue
+            try:
+                os.rename(self._path(src, minion_id), self._path(dst, minion_id))
+            except (IOError, OSError), err:
+                log.warning('Failed to {0} the key of {1}: {2}'.format(act, minion_id, err))
+                continue
+            self.keys[src].discard(minion_id)
+            self.keys[dst].add(minion_id)
+            self._fingers.pop((src, minion_id), None)
+            self.event.fire_event({'result': True, 'act': act, 'id': minion_id}, 'key')
+            moved.append(minion_id)
+        return moved
+
+    def accept(self, minion_ids, include_rejected=False):
+        '''
+        Accept the pending, and if ``include_rejected`` is ``True`` the rejected, keys of
+        ``minion_ids``. Returns the accepted minion ids.
+        '''
+        accepted = self._move(minion_ids, PENDING, ACCEPTED, 'accept')
+        if include_rejected:
+            accepted.extend(self._move(minion_ids, REJECTED, ACCEPTED, 'accept'))
+        return accepted
+
+    def reject(self, minion_ids):
+        '''
+        Reject the pending keys of ``minion_ids``. Returns the rejected minion ids.
+        '''
+        return self._move(minion_ids, PENDING, REJECTED, 'reject')
+
+    def delete(self, minion_ids):
+        '''
+        Delete the keys of ``minion_ids``, whatever their status. Returns the deleted minion ids.
+        '''
+        deleted = []
+        for minion_id in minion_ids:
+            status = self.status(minion_id)
+            if status is None:
+                continue
+            try:
+                os.remove(self._path(status, minion_id))
+            except (IOError, OSError), err:
+                log.warning('Failed to delete the key of {0}: {1}'.format(minion_id, err))
+                continue
+            self.keys[status].discard(minion_id)
+            self._fingers.pop((status, minion_id), None)
+            self.event.fire_event({'result': True, 'act': 'delete', 'id': minion_id}, 'key')
+            deleted.append(minion_id)
+        return deleted
+
+    def preseed(self, minion_id, pub):
+        '''
+        Place a public key directly as accepted, for minions whose key pair the master generated.
+        '''
+        with salt.utils.fopen(self._path(ACCEPTED, minion_id), 'w+') as wfh:
+            wfh.write(pub)
+        for status in (PENDING, REJECTED):
+            if minion_id in self.keys[status]:
+                self.delete([minion_id])
+        self.keys[ACCEPTED].add(minion_id)
+        self.event.fire_event({'result': True, 'act': 'accept', 'id': minion_id}, 'key')
+
+    def bulk_accept(self, patterns=(), fingerprints=()):
+        '''
+        Accept, in a single pass, every pending key whose minion id matches any of the glob
+        ``patterns`` or whose fingerprint is part of the ``fingerprints`` allowlist.
+        '''
+        fingerprints = set(fpr.lower() for fpr in fingerprints)
+        candidates = set(self.match(patterns)) if patterns else set()
+        if fingerprints:
+            for minion_id in self.keys[PENDING].difference(candidates):
+                if self.finger(minion_id) in fingerprints:
+                    candidates.add(minion_id)
+        return self.accept(salt.utils.isorted(candidates))
+
+    def clean_ephemeral(self, patterns, alive):
+        '''
+        Delete the accepted keys of the ephemeral minions, matched by the glob ``patterns``, which
+        are not part of ``alive``.
+        '''
+        alive = set(alive)
+        return self.delete(
+            [minion_id for minion_id in self.match(patterns, ACCEPTED) if minion_id not in alive]
+        )
+
+
+class SaltCIKeyCLI(salt.key.KeyCLI):
+    '''
+    Salt's key CLI with the index backed, bulk, key operations.
+    '''
+
+    def __init__(self, opts):
+        super(SaltCIKeyCLI, self).__init__(opts)
+        self.index = KeyIndex(opts)
+
+    def _print_keys(self, minion_ids, message):
+        if self.opts.get('quiet', False):
+            return
+        for minion_id in minion_ids:
+            print(message.format(minion_id))
+
+    def accept(self, match, include_rejected=False):
+        include_rejected = include_rejected or self.opts.get('include_rejected', False)
+        if not include_rejected and not self.opts.get('yes', False):
+            # Salt's own accept, which only knows about the pending keys
+            return super(SaltCIKeyCLI, self).accept(match)
+        matches = self.index.match(match)
+        if include_rejected:
+            matches.extend(self.index.match(match, REJECTED))
+        if not matches:
+            print('The key glob {0} does not match any unaccepted {1}keys.'.format(
+                match, 'or rejected ' if include_rejected else ''
+            ))
+            return
+        self._print_keys(
+            self.index.accept(matches, include_rejected=include_rejected),
+            'Key for minion {0} accepted.'
+        )
+
+    def bulk_accept(self):
+        fingerprints = set(self.opts.get('accept_finger') or ())
+        if self.opts.get('accept_fingers_file'):
+            fingerprints.update(load_fingerprints(self.opts['accept_fingers_file']))
+        self._print_keys(
+            self.index.bulk_accept(self.opts.get('accept_match') or (), fingerprints),
+            'Key for minion {0} accepted.'
+        )
+
+    def clean_ephemeral(self):
+        config = get_config(self.opts)
+        if not config['ephemeral_patterns']:
+            print('No ephemeral minion patterns are configured.')
+            return
+        local = salt.client.LocalClient(mopts=self.opts)
+        alive = set()
+        for pattern in config['ephemeral_patterns']:
+            alive.update(local.cmd(pattern, 'test.ping', timeout=self.opts['timeout']))
+        self._print_keys(
+            self.index.clean_ephemeral(config['ephemeral_patterns'], alive),
+            'Key for ephemeral minion {0} deleted.'
+        )
+
+    def run(self):
+        if self.opts.get('accept_match') or self.opts.get('accept_finger') or \
+                self.opts.get('accept_fingers_file'):
+            self.bulk_accept()
+        elif self.opts.get('clean_ephemeral'):
+            self.clean_ephemeral()
+        else:
+            super(SaltCIKeyCLI, self).run()
+
+
+class KeyManager(EventHandler):
+    '''
+    Automatically accept the pending keys allowed by the configuration, and delete the keys of
+    the ephemeral minions which are no longer alive.
+    '''
+
+    def setup(self):
+        self.config = get_config(self.opts)
+        self.index = KeyIndex(self.opts)
+        self.fingerprints = set(fpr.lower() for fpr in self.config['accept_fingerprints'])
+        if self.config['accept_fingers_file']:
+            self.fingerprints.update(load_fingerprints(self.config['accept_fingers_file']))
+        self.maintenance_interval = self.config['ephemeral_check_interval']
+        self.local = None
+        self.last_seen = {}
+        # minion_id -> when the quiet ephemeral minion was pinged
+        self.pinged = {}
+
+    def _allowed(self, minion_id, pub):
+        if any(fnmatch.fnmatch(minion_id, pattern) for pattern in self.config['accept_patterns']):
+            return True
+        return bool(self.fingerprints) and finger(pub) in self.fingerprints
+
+    def handle_event(self, tag, data):
+        if not isinstance(data, dict) or 'id' not in data:
+            return
+        self.last_seen[data['id']] = time.time()
+
+        if tag != 'auth' or data.get('act') != 'pend':
+            return
+        if not self._allowed(data['id'], data.get('pub', '')):
+            return
+        # The minion has just been placed in pending, the index does not know about it yet
+        self.index.keys[PENDING].add(data['id'])
+        if self.index.accept([data['id']]):
+            log.info('Automatically accepted the key of {0}'.format(data['id']))
+
+    def maintenance(self):
+        if not self.config['ephemeral_patterns']:
+            return
+        now = time.time()
+
+        # The minions pinged on the previous checks have answered, their returns were seen by
+        # `handle_event`, or are gone
+        gone = []
+        for minion_id, pinged in self.pinged.items():
+            if self.last_seen.get(minion_id, 0) >= pinged:
+                self.pinged.pop(minion_id)
+            elif now - pinged >= self.opts['timeout']:
+                self.pinged.pop(minion_id)
+                gone.append(minion_id)
+        for minion_id in self.index.delete(gone):
+            self.last_seen.pop(minion_id, None)
+            log.info('Deleted the key of the gone ephemeral minion {0}'.format(minion_id))
+
+        self.index.refresh()
+        stale = [
+            minion_id for minion_id in self.index.match(self.config['ephemeral_patterns'], ACCEPTED)
+            if now - self.last_seen.get(minion_id, 0) > self.config['ephemeral_ttl'] and
+            minion_id not in self.pinged
+        ]
+        if not stale:
+            return
+        # Give the quiet ones a chance to prove they're still alive, without waiting for them
+        if self.local is None:
+            self.local = salt.client.LocalClient(mopts=self.opts)
+        self.local.cmd_async(stale, 'test.ping', expr_form='list')
+        for minion_id in stale:
+            self.pinged[minion_id] = now
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+'''
+    saltci.logs
+    ~~~~~~~~~~~
+
+    Build logs shipped by the CI minions.
+
+    The ``cilog`` execution module, see `saltci/minion/_modules/cilog.py`, ships the build output
+    to the master, as it's produced, in compressed chunks over the event bus. The master appends
+    them, ordered by their offset, to a log file per job and minion, requesting the minion to
+    resume the transfer whenever a chunk goes missing.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import python libs
+import os
+import re
+import sys
+import time
+import zlib
+import logging
+
+# Import salt libs
+import salt.utils
+import salt.client
+
+# Import salt-ci libs
+from saltci.config import section_config, _DEFAULT_LOGS_CONFIG
+from saltci.events import EventHandler
+from saltci.exceptions import SaltCILogsError
+
+log = logging.getLogger(__name__)
+
+# Salt's event tags are at most 20 characters long
+LOG_EVENT_TAG = 'saltci_log'
+
+# Salt's job IDs, also the build logs directory names
+JID_RE = re.compile(r'^\d{20}$')
+
+
+def get_config(opts):
+    '''
+    Return the build logs configuration merged with it's defaults.
+    '''
+    config = section_config(opts, 'logs', _DEFAULT_LOGS_CONFIG)
+    if not config['logs_dir']:
+        config['logs_dir'] = os.path.join(opts['cachedir'], 'salt-ci', 'logs')
+    return config
+
+
+def valid_log_key(jid, minion_id):
+    '''
+    Return ``True`` if ``jid`` and ``minion_id`` are safe to build a log path from.
+    '''
+    if not isinstance(jid, basestring) or not JID_RE.match(jid):
+        return False
+    if not isinstance(minion_id, basestring) or not minion_id:
+        return False
+    return os.sep not in minion_id and '..' not in minion_id
+
+
+def log_path(config, jid, minion_id):
+    '''
+    Return the path to the build log of ``minion_id`` for the job ``jid``.
+    '''
+    return os.path.join(config['logs_dir'], jid, '{0}.log'.format(minion_id))
+
+
+def _eof_path(config, jid, minion_id):
+    return os.path.join(config['logs_dir'], jid, '{0}.eof'.format(minion_id))
+
+
+class LogWriter(EventHandler):
+    '''
+    Append the shipped log chunks to the job log files.
+    '''
+
+    def setup(self):
+        self.config = get_config(self.opts)
+        self.maintenance_interval = self.config['resume_interval']
+        self.local = None
+        # (jid, minion_id) -> next expected offset
+        self.expected = {}
+        # (jid, minion_id) -> final log size, of the transfers which are missing chunks
+        self.pending_eof = {}
+        # (jid, minion_id) -> when the transfer was last resumed
+        self.resumed = {}
+
+    def _expected(self, key):
+        if key not in self.expected:
+            path = log_path(self.config, *key)
+            self.expected[key] = os.path.getsize(path) if os.path.isfile(path) else 0
+        return self.expected[key]
+
+    def _resume(self, key, offset):
+        now = time.time()
+        if now - self.resumed.get(key, 0) < self.config['resume_interval']:
+            return
+        self.resumed[key] = now
+        jid, minion_id = key
+        log.info('Resuming the log transfer of {0} for job {1} from {2}'.format(
+            minion_id, jid, offset
+        ))
+        if self.local is None:
+            self.local = salt.client.LocalClient(mopts=self.opts)
+        self.local.cmd_async([minion_id], 'cilog.resume', [jid, offset], expr_form='list')
+
+    def _finish(self, key, size):
+        path = log_path(self.config, *key)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        # The job might not have produced any output at all
+        salt.utils.fopen(path, 'ab').close()
+        with salt.utils.fopen(_eof_path(self.config, *key), 'w+') as wfh:
+            wfh.write(str(size))
+        for mapping in (self.expected, self.pending_eof, self.resumed):
+            mapping.pop(key, None)
+
+    def handle_event(self, tag, data):
+        if tag != LOG_EVENT_TAG or not isinstance(data, dict) or 'id' not in data:
+            return
+
+        chunk = data.get('data')
+        if not isinstance(chunk, dict) or not valid_log_key(chunk.get('jid'), data['id']):
+            log.warning('Ignoring an invalid log chunk from {0!r}'.format(data['id']))
+            return
+        key = (chunk['jid'], data['id'])
+        expected = self._expected(key)
+
+        if chunk['eof']:
+            if chunk['size'] == expected:
+                self._finish(key, expected)
+            else:
+                self.pending_eof[key] = chunk['size']
+                self._resume(key, expected)
+            return
+
+        offset = chunk['offset']
+        if offset > expected:
+            # We've lost at least one chunk
+            self._resume(key, expected)
+            return
+
+        payload = zlib.decompress(chunk['data'])
+        if offset + len(payload) <= expected:
+            # Already written
+            return
+
+        path = log_path(self.config, *key)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with salt.utils.fopen(path, 'ab') as wfh:
+            wfh.write(payload[expected - offset:])
+        self.expected[key] = expected = offset + len(payload)
+
+        if self.pending_eof.get(key) == expected:
+            self._finish(key, expected)
+
+    def maintenance(self):
+        # Keep on resuming the transfers which know their final size but did not get there yet
+        for key, size in self.pending_eof.items():
+            if self._expected(key) < size:
+                self._resume(key, self._expected(key))
+
+
+def _job_cached(opts, jid):
+    '''
+    Return ``True`` if the master's job cache knows about the job ``jid``.
+    '''
+    return os.path.isdir(
+        salt.utils.jid_dir(jid, opts['cachedir'], opts.get('hash_type', 'md5'))
+    )
+
+
+def tail(opts, jid, follow=True, interval=1, out=sys.stdout):
+    '''
+    Print the build logs of the job ``jid`` and, if ``follow`` is ``True``, keep on printing
+    them as they're shipped until all of them are complete.
+
+    When the job ran on several minions, the lines are prefixed by the minion id.
+
+    Raises :class:`~saltci.exceptions.SaltCILogsError` when following an unknown job, or one
+    which did not ship any log within the configured ``tail_timeout``.
+    '''
+    if not JID_RE.match(jid):
+        raise SaltCILogsError('{0!r} is not a job ID'.format(jid))
+    config = get_config(opts)
+    jobdir = os.path.join(config['logs_dir'], jid)
+    if follow and not os.path.isdir(jobdir) and not _job_cached(opts, jid):
+        raise SaltCILogsError('Unknown job {0}'.format(jid))
+    started = time.time()
+    positions = {}
+    partial = {}
+
+    while True:
+        minions = []
+        if os.path.isdir(jobdir):
+            minions = sorted(fn_[:-4] for fn_ in os.listdir(jobdir) if fn_.endswith('.log'))
+        elif follow and time.time() - started > config['tail_timeout']:
+            raise SaltCILogsError(
+                'No build log was shipped for the job {0} within {1} seconds'.format(
+                    jid, config['tail_timeout']
+                )
+            )
+
+        complete = bool(minions)
+        for minion_id in minions:
+            # Checked before reading, the log is complete once the marker exists
+            finished = os.path.isfile(_eof_path(config, jid, minion_id))
+            path = log_path(config, jid, minion_id)
+            with salt.utils.fopen(path, 'rb') as rfh:
+                rfh.seek(positions.get(minion_id, 0))
+                while True:
+                    data = rfh.read(65536)
+                    if not data:
+                        break
+                    if len(minions) == 1:
+                        out.write(data)
+                        continue
+                    lines = (partial.pop(minion_id, '') + data).split('\n')
+                    partial[minion_id] = lines.pop()
+                    if len(partial[minion_id]) > 65536:
+                        # Do not buffer endless lines
+                        lines.append(partial.pop(minion_id))
+                    for line in lines:
+                        out.write('{0}: {1}\n'.format(minion_id, line))
+                positions[minion_id] = rfh.tell()
+            if not finished:
+                complete = False
+            elif partial.get(minion_id):
+                out.write('{0}: {1}\n'.format(minion_id, partial.pop(minion_id)))
+        out.flush()
+
+        if complete or not follow:
+            return
+        time.sleep(interval)
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+'''
+    saltci.minion._modules.cilog
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Run build commands on the CI minions while shipping their output, as it's produced, to the
+    salt-ci master in compressed and sequence numbered chunks.
+
+    The output is never kept in memory, it's spooled to a local file from which the chunks are
+    read, this also allows the master to request the transfer to be resumed from any offset. Once
+    the command ends, a ``<jid>.done`` marker holding the final log size is written next to the
+    spooled log, a resumed transfer only ships the end of the log after it.
+    The spooled logs are kept for ``cilog_spool_keep`` seconds, one day by default, and pruned as
+    the next builds run.
+
+    Sync this module to the build minions with ``saltutil.sync_modules``.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import python libs
+import os
+import time
+import zlib
+import logging
+import subprocess
+
+# Import salt libs
+import salt.crypt
+import salt.utils
+import salt.payload
+
+log = logging.getLogger(__name__)
+
+# Keep in sync with `saltci.logs.LOG_EVENT_TAG`
+LOG_EVENT_TAG = 'saltci_log'
+
+# Tell salt explicitly what functions this module provides
+__load__ = ['run', 'resume']
+
+
+def _spool_dir():
+    return os.path.join(__opts__['cachedir'], 'salt-ci', 'logs')
+
+
+def _spool_path(jid):
+    return os.path.join(_spool_dir(), '{0}.log'.format(jid))
+
+
+def _done_path(jid):
+    return os.path.join(_spool_dir(), '{0}.done'.format(jid))
+
+
+def _final_size(jid):
+    '''
+    Return the final size of the job log, or ``None`` if the command is still running.
+    '''
+    try:
+        with salt.utils.fopen(_done_path(jid), 'r') as rfh:
+            return int(rfh.read().strip())
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _prune_spools():
+    '''
+    Remove the spooled logs older than ``cilog_spool_keep`` seconds, the master no longer asks
+    for those to be resumed.
+    '''
+    spool_dir = _spool_dir()
+    if not os.path.isdir(spool_dir):
+        return
+    oldest = time.time() - __opts__.get('cilog_spool_keep', 86400)
+    for fn_ in os.listdir(spool_dir):
+        path = os.path.join(spool_dir, fn_)
+        try:
+            if fn_.endswith(('.log', '.done')) and os.path.getmtime(path) < oldest:
+                os.remove(path)
+        except OSError, err:
+            log.warning('Failed to prune the spooled log {0}: {1}'.format(path, err))
+
+
+def _current_jid():
+    '''
+    Find the ID of the job running this function through the minion's process data.
+    '''
+    proc_dir = os.path.join(__opts__['cachedir'], 'proc')
+    serial = salt.payload.Serial(__opts__)
+    pid = os.getpid()
+    for fn_ in os.listdir(proc_dir):
+        try:
+            with salt.utils.fopen(os.path.join(proc_dir, fn_), 'rb') as rfh:
+                data = serial.load(rfh)
+        except Exception:
+            continue
+        if data.get('pid') == pid:
+            return data['jid']
+    return None
+
+
+def _send(load):
+    '''
+    Send a log event to the master. The request waits for the master's reply which keeps the
+    minion from producing chunks faster than the master consumes them.
+    '''
+    if 'cilog.auth' not in __context__:
+        __context__['cilog.auth'] = salt.crypt.SAuth(__opts__)
+        __context__['cilog.sreq'] = salt.payload.SREQ(__opts__['master_uri'])
+    try:
+        __context__['cilog.sreq'].send(
+            'aes', __context__['cilog.auth'].crypticle.dumps(load), tries=3
+        )
+        return True
+    except Exception, err:
+        log.warning('Failed to ship a log chunk to the master: {0}'.format(err))
+        return False
+
+
+def _ship(jid, seq, offset, data, eof=False, size=None):
+    return _send({
+        'id': __opts__['id'],
+        'tag': LOG_EVENT_TAG,
+        'cmd': '_minion_event',
+        'data': {
+            'jid': jid,
+            'seq': seq,
+            'offset': offset,
+            'data': zlib.compress(data, __opts__.get('cilog_compression', 6)),
+            'eof': eof,
+            'size': size
+        }
+    })
+
+
+def _ship_file(jid, rfh, offset, chunk_size, seq=0):
+    while True:
+        data = rfh.read(chunk_size)
+        if not data:
+            return seq, offset
+        _ship(jid, seq, offset, data)
+        seq += 1
+        offset += len(data)
+
+
+def run(cmd, cwd=None, env=None, jid=None, chunk_size=65536, tail=8192):
+    '''
+    Run ``cmd`` shipping it's combined stdout and stderr to the salt-ci master while it runs.
+
+    Only the last ``tail`` bytes of the output are part of the job return, the whole log is
+    available on the master.
+
+    CLI Example::
+
+        salt-ci 'build-*' cilog.run 'python setup.py test'
+    '''
+    jid = jid or _current_jid()
+    if jid is None:
+        return {'error': 'Unable to find the job ID, please pass it as `jid`'}
+
+    _prune_spools()
+    spool = _spool_path(jid)
+    if not os.path.isdir(os.path.dirname(spool)):
+        os.makedirs(os.path.dirname(spool))
+
+    with salt.utils.fopen(spool, 'w+b') as wfh:
+        proc = subprocess.Popen(
+            cmd, shell=True, cwd=cwd, env=env, stdout=wfh, stderr=subprocess.STDOUT
+        )
+        seq = offset = 0
+        with salt.utils.fopen(spool, 'rb') as rfh:
+            while proc.poll() is None:
+                seq, offset = _ship_file(jid, rfh, offset, chunk_size, seq)
+                # Let some more output accumulate
+                time.sleep(1)
+            # Whatever was written since the last poll
+            seq, offset = _ship_file(jid, rfh, offset, chunk_size, seq)
+            # Written before the eof is shipped, any resume requested after it knows the log is
+            # complete
+            with salt.utils.fopen(_done_path(jid), 'w+') as wfh:
+                wfh.write(str(offset))
+            _ship(jid, seq, offset, '', eof=True, size=offset)
+
+            rfh.seek(max(0, offset - tail))
+            output = rfh.read(tail)
+
+    return {
+        'retcode': proc.returncode,
+        'log_size': offset,
+        'log_chunks': seq,
+        'tail': output
+    }
+
+
+def resume(jid, offset, chunk_size=65536):
+    '''
+    Re-ship the log of the job ``jid`` starting at ``offset``. The end of the log is only
+    shipped once the command ended, while it runs, ``run`` ships the rest of the log itself.
+
+    CLI Example::
+
+        salt-ci 'build-1' cilog.resume 20130415123456789012 1048576
+    '''
+    spool = _spool_path(jid)
+    if not os.path.isfile(spool):
+        return {'error': 'No log for the job {0}'.format(jid)}
+
+    offset = int(offset)
+    # Checked before reading, the spooled log is complete once the marker exists
+    final_size = _final_size(jid)
+    with salt.utils.fopen(spool, 'rb') as rfh:
+        rfh.seek(offset)
+        # The master orders the chunks by their offset, the sequence number only has to be unique
+        # within this transfer
+        seq, size = _ship_file(jid, rfh, offset, chunk_size)
+    if final_size is not None:
+        _ship(jid, seq, final_size, '', eof=True, size=final_size)
+    return {'log_size': size, 'resumed_from': offset, 'complete': final_size is not None}
@@ -10,27 +10,51 @@
     :license: Apache 2.0, see LICENSE for more details.
 '''
 
+# Import python libs
+import time
+
 # Import salt libs
 from salt import Minion
 from salt.cli import SaltCall
 
 # Import salt-ci libs
-from saltci import config
+from saltci import config, profiling
 
 
 
-class SaltCINotif(Minion):
+class SaltCINotif(profiling.ProfilingMixIn, Minion):
 
     # ConfigDirMixIn configuration filename attribute
     _config_filename_ = 'salt-ci-notif'
 
+    # The salt functions timed when the profiling timings are enabled
+    _profiling_calls_ = profiling.MINION_CALLS
+
     def setup_config(self):
         return config.saltci_notif_config(self.get_config_file_path())
 
+    def prepare(self):
+        started = time.time()
+        # Salt authenticates and loads the minion modules when preparing
+        super(SaltCINotif, self).prepare()
+        profiling.log_timing('startup', time.time() - started)
+
 
-class SaltCINotifCall(SaltCall):
+class SaltCINotifCall(profiling.ProfilingMixIn, SaltCall):
     # ConfigDirMixIn configuration filename attribute
     _config_filename_ = 'salt-ci-notif'
 
+    # The salt functions timed when the profiling timings are enabled
+    _profiling_calls_ = profiling.MINION_CALLS
+
     def setup_config(self):
         return config.saltci_notif_config(self.get_config_file_path())
+
+    def run(self):
+        try:
+            with profiling.timed('job'):
+                super(SaltCINotifCall, self).run()
+        finally:
+            # `parse_args` did not run if salt bailed out early
+            if getattr(self, 'profiler', None) is not None:
+                self.profiler.stop()
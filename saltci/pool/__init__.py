@@ -0,0 +1,425 @@
+# -*- coding: utf-8 -*-
+'''
+    saltci.pool
+    ~~~~~~~~~~~
+
+    Warm pool of ephemeral build minions.
+
+    The master keeps a number of pre-booted, pre-authenticated, build minions idle so that a job
+    does not have to wait on a cold boot and a key exchange. The minion's key pair is generated by
+    the master and it's public key accepted before the minion even boots.
+
+    The pool state is shared, through a locked file on the master's cache directory, between the
+    master, which boots, recycles and tears down the minions, and `salt-ci`, which acquires and
+    releases them for it's jobs. The number of acquire requests waiting for a minion is the queue
+    depth used to scale the pool.
+
+    The master's event processing only decides, on the pool state, which minions to boot, reset or
+    destroy, the pool process then carries it out.
+
+    A busy minion records the host and pid of the process which acquired it, the master takes
+    it back once that process is gone, whether `salt-ci` was killed or failed before releasing
+    it.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import python libs
+import os
+import time
+import uuid
+import errno
+import socket
+import shutil
+import logging
+import tempfile
+import multiprocessing
+
+# Import salt libs
+import salt.crypt
+import salt.utils
+
+# Import salt-ci libs
+from saltci.config import section_config, _DEFAULT_POOL_CONFIG
+from saltci.events import EventHandler
+from saltci.exceptions import SaltCIPoolError
+from saltci.keys import KeyIndex
+from saltci.pool.drivers import get_driver
+from saltci.utils import SharedState
+
+log = logging.getLogger(__name__)
+
+# Minion states
+PENDING = 'pending'
+BOOTING = 'booting'
+IDLE = 'idle'
+BUSY = 'busy'
+DIRTY = 'dirty'
+DESTROYING = 'destroying'
+STATES = (PENDING, BOOTING, IDLE, BUSY, DIRTY, DESTROYING)
+
+# Seconds after which a waiting acquire request which was not retried is dropped
+WAITING_TTL = 60
+
+
+def get_config(opts):
+    '''
+    Return the minion pool configuration merged with it's defaults.
+    '''
+    return section_config(opts, 'pool', _DEFAULT_POOL_CONFIG)
+
+
+class PoolState(SharedState):
+    '''
+    The minion pool state, shared between the master and `salt-ci`.
+
+    The state is a dictionary with the following keys:
+
+    ``minions``
+        ``{minion_id: {'state': ..., 'since': ..., 'owner': ..., 'host': ..., 'pid': ...}}``
+    ``waiting``
+        ``{owner: {'count': ..., 'since': ..., 'seen': ...}}``, the pending acquire requests
+    '''
+
+    name = 'pool'
+    default = {'minions': {}, 'waiting': {}}
+
+
+def default_owner():
+    '''
+    Return the pool owner name of the current process.
+    '''
+    return '{0}-{1}'.format(socket.gethostname(), os.getpid())
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError, err:
+        return err.errno != errno.ESRCH
+    return True
+
+
+def try_acquire(opts, count, owner, since=None):
+    '''
+    Acquire ``count`` idle build minions from the pool without waiting.
+
+    When there aren't enough idle minions, ``None`` is returned and the request is kept as
+    waiting, so that the pool scales up, until it either succeeds or :func:`cancel` is called.
+    '''
+    with PoolState(opts).locked() as state:
+        idle = salt.utils.isorted(
+            minion_id for minion_id, minion in state['minions'].iteritems()
+            if minion['state'] == IDLE
+        )
+        if len(idle) < count:
+            waiting = state['waiting'].setdefault(owner, {'since': since or time.time()})
+            waiting.update(count=count, seen=time.time())
+            return None
+
+        acquired = idle[:count]
+        for minion_id in acquired:
+            state['minions'][minion_id].update(
+                state=BUSY,
+                since=time.time(),
+                owner=owner,
+                host=socket.gethostname(),
+                pid=os.getpid()
+            )
+        state['waiting'].pop(owner, None)
+        return acquired
+
+
+def cancel(opts, owner):
+    '''
+    Cancel a waiting acquire request.
+    '''
+    with PoolState(opts).locked() as state:
+        state['waiting'].pop(owner, None)
+
+
+def acquire(opts, count=1, timeout=None, owner=None):
+    '''
+    Acquire ``count`` idle build minions from the pool, waiting at most ``timeout`` seconds for
+    them. Returns the acquired minion ids.
+    '''
+    config = get_config(opts)
+    if timeout is None:
+        timeout = config['acquire_timeout']
+    if count > config['max_size']:
+        raise SaltCIPoolError(
+            'Cannot acquire {0} minions from a pool of at most {1}'.format(
+                count, config['max_size']
+            )
+        )
+
+    owner = owner or default_owner()
+    started = time.time()
+    try:
+        while True:
+            acquired = try_acquire(opts, count, owner, started)
+            if acquired is not None:
+                return acquired
+            if time.time() - started > timeout:
+                raise SaltCIPoolError(
+                    'Timed out waiting for {0} idle build minion(s)'.format(count)
+                )
+            time.sleep(1)
+    except BaseException:
+        cancel(opts, owner)
+        raise
+
+
+def release(opts, minion_ids, owner=None):
+    '''
+    Hand the build minions back to the pool, they'll be reset or recycled before being reused.
+    Only the minions still acquired by ``owner`` are released.
+    '''
+    owner = owner or default_owner()
+    with PoolState(opts).locked() as state:
+        for minion_id in minion_ids:
+            minion = state['minions'].get(minion_id)
+            if minion is None or minion['state'] != BUSY or minion.get('owner') != owner:
+                # Already taken back by the master
+                continue
+            minion.update(state=DIRTY, since=time.time(), owner=None, host=None, pid=None)
+
+
+class MinionPool(EventHandler):
+    '''
+    Keep the configured number of build minions booted and idle.
+
+    Only the pool state is updated here, the minions are booted, reset and destroyed by the
+    :class:`PoolProcess` so that the slow driver calls and key generation do not hold the
+    master's event processing.
+    '''
+
+    def setup(self):
+        self.config = get_config(self.opts)
+        self.maintenance_interval = self.config['check_interval']
+        self.state = PoolState(self.opts)
+        self.enabled = bool(self.config['driver'])
+
+    def handle_event(self, tag, data):
+        if not self.enabled or tag != 'minion_start' or not isinstance(data, dict):
+            return
+        with self.state.locked() as state:
+            minion = state['minions'].get(data.get('id'))
+            # The minion might have started before the pool process is done creating it
+            if minion is not None and minion['state'] in (PENDING, BOOTING):
+                minion.update(state=IDLE, since=time.time())
+                log.info('Build minion {0} is ready'.format(data['id']))
+
+    def _is_stale(self, minion):
+        # A busy minion whose owner, on this host, is gone
+        if minion['state'] != BUSY or not minion.get('pid'):
+            return False
+        return minion.get('host') == socket.gethostname() and not _pid_alive(minion['pid'])
+
+    def maintenance(self):
+        if not self.enabled:
+            return
+
+        now = time.time()
+        with self.state.locked() as state:
+            minions = state['minions']
+
+            for owner, waiting in state['waiting'].items():
+                if now - waiting['seen'] > WAITING_TTL:
+                    # The requester is gone
+                    state['waiting'].pop(owner)
+
+            for minion_id, minion in minions.iteritems():
+                if self._is_stale(minion):
+                    log.warning(
+                        'Taking back build minion {0}, it\'s owner {1} is gone'.format(
+                            minion_id, minion.get('owner')
+                        )
+                    )
+                    minion.update(state=DIRTY, since=now, owner=None, host=None, pid=None)
+                expired = minion['state'] == BOOTING and \
+                    now - minion['since'] > self.config['boot_timeout']
+                if expired:
+                    log.warning('Build minion {0} failed to boot in time'.format(minion_id))
+                    minion.update(state=DESTROYING, since=now)
+
+            # Scale the pool from the queue depth
+            counts = dict((name, 0) for name in STATES)
+            for minion in minions.itervalues():
+                counts[minion['state']] += 1
+            waiting = sum(entry['count'] for entry in state['waiting'].itervalues())
+            wanted = min(
+                self.config['min_idle'] + waiting,
+                self.config['max_size'] - counts[BUSY] - counts[DIRTY] - counts[DESTROYING]
+            )
+            available = counts[PENDING] + counts[BOOTING] + counts[IDLE]
+
+            # Do not queue more boots than the pool process gets to on each of it's checks
+            boots = min(wanted - available, self.config['max_boots_per_check'] - counts[PENDING])
+            for _ in range(boots):
+                minion_id = '{0}{1}'.format(
+                    self.config['minion_id_prefix'], uuid.uuid4().hex[:12]
+                )
+                minions[minion_id] = {'state': PENDING, 'since': now, 'owner': None}
+
+            if available > wanted:
+                # Scale down, the longest idle minions first
+                idle = sorted(
+                    (minion['since'], minion_id) for minion_id, minion in minions.iteritems()
+                    if minion['state'] == IDLE and now - minion['since'] > self.config['idle_ttl']
+                )
+                for _, minion_id in idle[:available - wanted]:
+                    minions[minion_id].update(state=DESTROYING, since=now)
+
+
+class PoolProcess(multiprocessing.Process):
+    '''
+    Boot, reset and destroy the build minions, as decided by the :class:`MinionPool`.
+    '''
+
+    def __init__(self, opts):
+        super(PoolProcess, self).__init__(name='PoolProcess')
+        self.opts = opts
+        self.daemon = True
+
+    def setup(self):
+        self.config = get_config(self.opts)
+        self.state = PoolState(self.opts)
+        self.driver = get_driver(self.config['driver'], self.opts, self.config['driver_opts'])
+        self.keys = KeyIndex(self.opts)
+
+    def run(self):
+        self.setup()
+        self.reconcile()
+        while True:
+            try:
+                self.check()
+            except Exception, err:
+                log.error('Failed to check the build minions: {0}'.format(err), exc_info=True)
+            # Minions are waited for, check more often than the pool decisions are taken
+            time.sleep(1)
+
+    def _minion_config(self, minion_id):
+        master = self.config['master']
+        if not master:
+            master = self.opts['interface']
+            if master == '0.0.0.0':
+                master = socket.getfqdn()
+        return {
+            'id': minion_id,
+            'master': master,
+            'master_port': self.opts['ret_port'],
+            'pki_dir': '/etc/salt/pki/minion'
+        }
+
+    def _boot(self, minion_id):
+        keydir = tempfile.mkdtemp()
+        try:
+            salt.crypt.gen_keys(keydir, 'minion', self.config['keysize'])
+            with salt.utils.fopen(os.path.join(keydir, 'minion.pem')) as rfh:
+                priv = rfh.read()
+            with salt.utils.fopen(os.path.join(keydir, 'minion.pub')) as rfh:
+                pub = rfh.read()
+        finally:
+            shutil.rmtree(keydir, ignore_errors=True)
+
+        # Accept the key before the minion boots, no key exchange wait
+        self.keys.preseed(minion_id, pub)
+        try:
+            self.driver.create(minion_id, self._minion_config(minion_id), priv, pub)
+        except SaltCIPoolError:
+            self.keys.delete([minion_id])
+            raise
+        log.info('Booting build minion {0}'.format(minion_id))
+
+    def _destroy(self, minion_id):
+        try:
+            self.driver.destroy(minion_id)
+        except SaltCIPoolError, err:
+            log.error('Failed to destroy build minion {0}: {1}'.format(minion_id, err))
+        self.keys.delete([minion_id])
+        log.info('Destroyed build minion {0}'.format(minion_id))
+
+    def reconcile(self):
+        '''
+        Destroy the build minions the driver knows about but the pool state does not, and forget
+        the ones the driver no longer knows about, left behind by a master crash for example.
+        '''
+        try:
+            existing = set(self.driver.list())
+        except (NotImplementedError, SaltCIPoolError), err:
+            log.warning('Unable to list the build minions: {0}'.format(err))
+            return
+        gone = []
+        with self.state.locked() as state:
+            known = set(state['minions'])
+            for minion_id in known:
+                minion = state['minions'][minion_id]
+                if minion['state'] == PENDING:
+                    if minion_id in existing:
+                        # Interrupted while being created
+                        minion.update(state=DESTROYING, since=time.time())
+                elif minion_id not in existing:
+                    gone.append(minion_id)
+                    state['minions'].pop(minion_id)
+        prefix = self.config['minion_id_prefix']
+        orphans = sorted(
+            minion_id for minion_id in existing - known if minion_id.startswith(prefix)
+        )
+        for minion_id in orphans:
+            log.warning('Destroying the orphaned build minion {0}'.format(minion_id))
+            self._destroy(minion_id)
+        if gone:
+            gone.sort()
+            self.keys.delete(gone)
+            log.warning('Forgot the vanished build minion(s) {0}'.format(', '.join(gone)))
+
+    def _update(self, minion_id, expected, **fields):
+        '''
+        Update, or forget when no ``fields`` are passed, the ``minion_id`` build minion if it's
+        still on the ``expected`` state.
+        '''
+        with self.state.locked() as state:
+            minion = state['minions'].get(minion_id)
+            if minion is None or minion['state'] != expected:
+                return
+            if fields:
+                minion.update(fields)
+            else:
+                state['minions'].pop(minion_id)
+
+    def check(self):
+        '''
+        Carry out the pending pool work, the minions are destroyed first to make room for the
+        new ones.
+        '''
+        minions = self.state.read()['minions']
+        pending = dict((name, []) for name in (DESTROYING, DIRTY, PENDING))
+        for minion_id, minion in minions.iteritems():
+            if minion['state'] in pending:
+                pending[minion['state']].append((minion['since'], minion_id))
+
+        for _, minion_id in sorted(pending[DESTROYING]):
+            self._destroy(minion_id)
+            self._update(minion_id, DESTROYING)
+
+        for _, minion_id in sorted(pending[DIRTY]):
+            try:
+                if self.driver.reset(minion_id):
+                    self._update(minion_id, DIRTY, state=BOOTING, since=time.time())
+                    continue
+            except SaltCIPoolError, err:
+                log.error('Failed to reset build minion {0}: {1}'.format(minion_id, err))
+            self._destroy(minion_id)
+            self._update(minion_id, DIRTY)
+
+        for _, minion_id in sorted(pending[PENDING]):
+            try:
+                self._boot(minion_id)
+            except SaltCIPoolError, err:
+                log.error('Failed to boot build minion {0}: {1}'.format(minion_id, err))
+                self._update(minion_id, PENDING)
+            else:
+                self._update(minion_id, PENDING, state=BOOTING, since=time.time())
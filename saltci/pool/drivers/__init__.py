@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+'''
+    saltci.pool.drivers
+    ~~~~~~~~~~~~~~~~~~~
+
+    Minion pool drivers.
+
+    A driver knows how to bring up and tear down a build minion. Each driver lives on it's own
+    module, within this package, and exposes it's :class:`PoolDriver` subclass as ``Driver``.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import python libs
+import logging
+import subprocess
+
+# Import salt-ci libs
+from saltci.exceptions import SaltCIPoolError
+
+log = logging.getLogger(__name__)
+
+
+def get_driver(name, opts, driver_opts):
+    '''
+    Load and return an instance of the ``name`` pool driver.
+    '''
+    try:
+        module = __import__('saltci.pool.drivers.{0}'.format(name), fromlist=['Driver'])
+    except ImportError, err:
+        raise SaltCIPoolError('Failed to load the {0!r} pool driver: {1}'.format(name, err))
+    return module.Driver(opts, driver_opts)
+
+
+class PoolDriver(object):
+    '''
+    Base class for the minion pool drivers.
+    '''
+
+    def __init__(self, opts, driver_opts):
+        self.opts = opts
+        self.driver_opts = driver_opts
+
+    def _run(self, *cmd):
+        log.debug('Running {0!r}'.format(cmd))
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        out = proc.communicate()[0]
+        if proc.returncode != 0:
+            raise SaltCIPoolError(
+                '{0!r} failed with exit code {1}: {2}'.format(cmd, proc.returncode, out.strip())
+            )
+        return out
+
+    def create(self, minion_id, minion_config, priv, pub):
+        '''
+        Create and boot the ``minion_id`` build minion.
+
+        :param minion_config: The salt minion configuration dictionary to use.
+        :param priv: The minion's private key, already accepted by the master.
+        :param pub: The minion's public key, already accepted by the master.
+        '''
+        raise NotImplementedError
+
+    def reset(self, minion_id):
+        '''
+        Reset a used build minion back to a pristine state. Return ``False`` when the driver is
+        unable to, in which case the minion is destroyed and a fresh one is booted instead.
+        '''
+        return False
+
+    def destroy(self, minion_id):
+        '''
+        Tear down the ``minion_id`` build minion.
+        '''
+        raise NotImplementedError
+
+    def list(self):
+        '''
+        Return the ids of the build minions known by the driver.
+        '''
+        raise NotImplementedError
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+'''
+    saltci.pool.drivers.lxc
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    LXC minion pool driver.
+
+    Build minions are cloned from a template container which already has salt-minion installed
+    and enabled at boot. Snapshot clones, the default, make booting a fresh build minion cheap
+    enough that used minions are simply destroyed instead of reset.
+
+    The minion's keys and configuration are written, before it boots, to the clone's writable
+    root filesystem, the delta directory of overlayfs and aufs snapshots. Snapshots backed by
+    block devices, LVM for example, can not be pre-seeded, set ``snapshot`` to ``False`` for
+    those templates.
+
+    Driver options::
+
+        pool:
+          driver: lxc
+          driver_opts:
+            template: salt-ci-template
+            lxc_path: /var/lib/lxc
+            snapshot: True
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import python libs
+import os
+
+# Import 3rd-party libs
+import yaml
+
+# Import salt libs
+import salt.utils
+
+# Import salt-ci libs
+from saltci.exceptions import SaltCIPoolError
+from saltci.pool.drivers import PoolDriver
+
+
+class Driver(PoolDriver):
+
+    def __init__(self, opts, driver_opts):
+        super(Driver, self).__init__(opts, driver_opts)
+        if not driver_opts.get('template', None):
+            raise SaltCIPoolError('The lxc pool driver requires a \'template\' container')
+        self.template = driver_opts['template']
+        self.lxc_path = driver_opts.get('lxc_path', '/var/lib/lxc')
+        self.snapshot = driver_opts.get('snapshot', True)
+
+    def _rootfs(self, minion_id):
+        '''
+        Return the directory where the files of the, not yet started, ``minion_id`` clone are
+        written, according to it's ``lxc.rootfs``.
+        '''
+        rootfs = None
+        with salt.utils.fopen(os.path.join(self.lxc_path, minion_id, 'config')) as rfh:
+            for line in rfh:
+                key, sep, value = line.partition('=')
+                if sep and key.strip() in ('lxc.rootfs', 'lxc.rootfs.path'):
+                    rootfs = value.strip()
+        if not rootfs:
+            return os.path.join(self.lxc_path, minion_id, 'rootfs')
+
+        backend, sep, path = rootfs.partition(':')
+        if sep and backend in ('overlayfs', 'overlay', 'aufs'):
+            # `<backend>:<template rootfs>:<delta>`, only the delta directory is writable, the
+            # rootfs directory is just the, still empty, mount point
+            return path.rsplit(':', 1)[-1]
+        if sep and backend == 'dir':
+            rootfs = path
+        if not os.path.isdir(rootfs):
+            raise SaltCIPoolError(
+                'Unable to pre-seed the build minion {0}, it\'s root filesystem, {1!r}, is not a '
+                'directory. Set the lxc driver\'s \'snapshot\' option to False'.format(
+                    minion_id, rootfs
+                )
+            )
+        return rootfs
+
+    def _write(self, path, contents, mode):
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with salt.utils.fopen(path, 'w+') as wfh:
+            wfh.write(contents)
+        os.chmod(path, mode)
+
+    def create(self, minion_id, minion_config, priv, pub):
+        cmd = ['lxc-clone', '-P', self.lxc_path, '-o', self.template, '-n', minion_id]
+        if self.snapshot:
+            cmd.append('-s')
+        self._run(*cmd)
+
+        rootfs = self._rootfs(minion_id)
+        pki_dir = os.path.join(rootfs, minion_config['pki_dir'].lstrip('/'))
+        self._write(os.path.join(pki_dir, 'minion.pem'), priv, 0400)
+        self._write(os.path.join(pki_dir, 'minion.pub'), pub, 0644)
+        self._write(
+            os.path.join(rootfs, 'etc', 'salt', 'minion.d', 'salt-ci-pool.conf'),
+            yaml.safe_dump(minion_config, default_flow_style=False),
+            0644
+        )
+        self._run('lxc-start', '-P', self.lxc_path, '-d', '-n', minion_id)
+
+    def destroy(self, minion_id):
+        self._run('lxc-destroy', '-P', self.lxc_path, '-f', '-n', minion_id)
+
+    def list(self):
+        return self._run('lxc-ls', '-P', self.lxc_path, '-1').split()
@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+'''
+    saltci.profiling
+    ~~~~~~~~~~~~~~~~
+
+    Opt-in profiling of the salt-ci daemons and commands.
+
+    With ``timings`` enabled, how long each startup and per job phase takes is logged as a single
+    ``key=value`` line, easy to grep and to aggregate::
+
+        phase=key_auth seconds=0.5321 call=salt.crypt.Auth.sign_in minion=ci-1 pid=1234 ...
+
+    The configuration load is timed by :class:`ProfilingMixIn` and the master's event handling by
+    :class:`saltci.events.EventProcessor`. Salt's own loader modules discovery, key
+    authentication and job publish functions, see :data:`MASTER_CALLS`, :data:`MINION_CALLS` and
+    :data:`CLI_CALLS`, are only wrapped when the timings are enabled.
+
+    With profiling ``enabled``, sending ``signal`` to any salt-ci process, the master's
+    sub-processes included, runs it's main thread under cProfile for ``window`` seconds, or until
+    the signal is sent again, and then dumps the stats to
+    ``<profiles_dir>/<name>-<process>-<pid>-<time>.pstats``, to be loaded with :mod:`pstats`.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import python libs
+import os
+import json
+import time
+import signal
+import cProfile
+import inspect
+import logging
+import functools
+import importlib
+import multiprocessing
+import multiprocessing.util
+from contextlib import contextmanager
+
+# Import salt-ci libs
+from saltci.config import section_config, _DEFAULT_PROFILING_CONFIG
+
+log = logging.getLogger(__name__)
+
+# The phase timings logger
+timings_log = logging.getLogger('saltci.timings')
+
+# Whether the phase timings are logged on this process
+_timings = False
+
+
+def _sign_in_fields(args, kwargs):
+    # salt.crypt.Auth.sign_in(self)
+    return {'minion': args[0].opts.get('id')}
+
+
+def _auth_fields(args, kwargs):
+    # salt.master.ClearFuncs._auth(self, load)
+    return {'minion': args[1].get('id')}
+
+
+def _publish_fields(args, kwargs):
+    # salt.client.LocalClient.pub(self, tgt, fun, ...)
+    return {'fun': args[2] if len(args) > 2 else kwargs.get('fun')}
+
+
+# (module, class, function, phase, fields) of the salt functions whose calls are timed, ``fields``
+# returns the extra fields to log from the call arguments
+_LOADER_CALLS = (
+    ('salt.loader', None, 'grains', 'module_discovery', None),
+    ('salt.loader', None, 'minion_mods', 'module_discovery', None),
+    ('salt.loader', None, 'returners', 'module_discovery', None),
+)
+
+MASTER_CALLS = _LOADER_CALLS + (
+    ('salt.loader', None, 'runner', 'module_discovery', None),
+    ('salt.loader', None, 'wheels', 'module_discovery', None),
+    ('salt.master', 'ClearFuncs', '_auth', 'key_auth', _auth_fields),
+    ('salt.client', 'LocalClient', 'pub', 'job_publish', _publish_fields),
+)
+
+MINION_CALLS = _LOADER_CALLS + (
+    ('salt.crypt', 'Auth', 'sign_in', 'key_auth', _sign_in_fields),
+)
+
+CLI_CALLS = (
+    ('salt.client', 'LocalClient', 'pub', 'job_publish', _publish_fields),
+)
+
+
+def get_config(opts):
+    '''
+    Return the profiling configuration merged with it's defaults.
+    '''
+    config = section_config(opts, 'profiling', _DEFAULT_PROFILING_CONFIG)
+    if not config['profiles_dir']:
+        config['profiles_dir'] = os.path.join(opts['cachedir'], 'salt-ci', 'profiles')
+    return config
+
+
+def timings_enabled():
+    '''
+    Return ``True`` if the phase timings are logged on this process.
+    '''
+    return _timings
+
+
+def _format_value(value):
+    if not isinstance(value, basestring):
+        value = str(value)
+    if not value or any(char.isspace() or char in '"=' for char in value):
+        return json.dumps(value)
+    return value
+
+
+def log_timing(phase, seconds, **fields):
+    '''
+    Log how long ``phase`` took, along with the extra ``fields``, if the timings are enabled.
+    '''
+    if not _timings:
+        return
+    fields.update(process=multiprocessing.current_process().name, pid=os.getpid())
+    timings_log.info(' '.join(
+        ['phase={0}'.format(phase), 'seconds={0:.4f}'.format(seconds)] +
+        ['{0}={1}'.format(key, _format_value(fields[key])) for key in sorted(fields)]
+    ))
+
+
+@contextmanager
+def timed(phase, **fields):
+    '''
+    Time the enclosed block as ``phase``. The yielded ``fields`` can be added to.
+    '''
+    started = time.time()
+    try:
+        yield fields
+    except Exception, err:
+        fields['error'] = err.__class__.__name__
+        raise
+    finally:
+        log_timing(phase, time.time() - started, **fields)
+
+
+def _timed_function(func, phase, name, fields):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        extra = {'call': name}
+        if fields is not None:
+            try:
+                extra.update(fields(args, kwargs))
+            except Exception:
+                # The timings never break salt's calls
+                pass
+        with timed(phase, **extra):
+            return func(*args, **kwargs)
+    wrapper.saltci_timed = True
+    return wrapper
+
+
+def instrument(calls):
+    '''
+    Wrap the salt functions listed on ``calls`` so that their calls are timed.
+    '''
+    for module_name, class_name, func_name, phase, fields in calls:
+        name = '.'.join(part for part in (module_name, class_name, func_name) if part)
+        try:
+            owner = importlib.import_module(module_name)
+        except ImportError, err:
+            log.debug('Not timing {0}: {1}'.format(name, err))
+            continue
+        if class_name is not None:
+            owner = getattr(owner, class_name, None)
+        # Only plain functions, static and class methods are left alone
+        func = vars(owner).get(func_name) if owner is not None else None
+        if not inspect.isfunction(func) or getattr(func, 'saltci_timed', False):
+            log.debug('Not timing {0}, it\'s not a function on this salt version'.format(name))
+            continue
+        setattr(owner, func_name, _timed_function(func, phase, name, fields))
+
+
+class Profiler(object):
+    '''
+    Profile the main thread of the current process, for a time window, and dump the stats.
+    '''
+
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+        self.profile = None
+        self.started = None
+        self.timer = False
+
+    def install(self):
+        '''
+        Have the configured signal start, and stop, the profiling. Called from the main thread.
+        '''
+        signum = getattr(signal, str(self.config['signal']).upper(), None)
+        if not str(self.config['signal']).upper().startswith('SIG') or \
+                not isinstance(signum, int):
+            log.error('Unknown profiling signal {0!r}'.format(self.config['signal']))
+            return
+        signal.signal(signum, self._toggle)
+        # Have the interrupted system calls restarted instead of failing
+        signal.siginterrupt(signum, False)
+        # The processes forked by multiprocessing do not carry on a running profile
+        multiprocessing.util.register_after_fork(self, Profiler._discard)
+
+    def start_if_configured(self):
+        '''
+        Start profiling if configured to profile from the start.
+        '''
+        if self.config['enabled'] and self.config['on_start']:
+            self.start()
+
+    def start(self):
+        '''
+        Start profiling, for the configured window, unless already profiling.
+        '''
+        if self.profile is not None:
+            return
+        if signal.getsignal(signal.SIGALRM) in (signal.SIG_DFL, None):
+            signal.signal(signal.SIGALRM, self._window_ended)
+            signal.siginterrupt(signal.SIGALRM, False)
+            signal.setitimer(signal.ITIMER_REAL, self.config['window'])
+            self.timer = True
+            log.info('Profiling {0} for {1} seconds'.format(self.name, self.config['window']))
+        else:
+            log.warning(
+                'SIGALRM is in use, profiling {0} until {1} is sent again'.format(
+                    self.name, self.config['signal']
+                )
+            )
+        self.started = time.time()
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def stop(self):
+        '''
+        Stop profiling and dump the stats. Returns the stats file path.
+        '''
+        if self.profile is None:
+            return None
+        self.profile.disable()
+        profile, self.profile = self.profile, None
+        if self.timer:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, signal.SIG_DFL)
+            self.timer = False
+
+        now = time.time()
+        path = os.path.join(
+            self.config['profiles_dir'],
+            '{0}-{1}-{2}-{3}{4:03d}.pstats'.format(
+                self.name,
+                multiprocessing.current_process().name,
+                os.getpid(),
+                time.strftime('%Y%m%d%H%M%S', time.localtime(now)),
+                int(now * 1000) % 1000
+            )
+        )
+        try:
+            if not os.path.isdir(self.config['profiles_dir']):
+                os.makedirs(self.config['profiles_dir'])
+            profile.dump_stats(path)
+        except (IOError, OSError), err:
+            log.error('Failed to write the profile {0}: {1}'.format(path, err))
+            return None
+        log.info('Profiled {0} for {1:.1f} seconds, the stats were written to {2}'.format(
+            self.name, time.time() - self.started, path
+        ))
+        return path
+
+    def _toggle(self, signum, frame):
+        if self.profile is None:
+            self.start()
+        else:
+            self.stop()
+
+    def _window_ended(self, signum, frame):
+        self.stop()
+
+    def _discard(self):
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile = None
+            self.timer = False
+
+
+def _setup_timings(config, calls):
+    global _timings
+    _timings = True
+    timings_log.setLevel(logging.INFO)
+    if config['timings_file'] and not timings_log.handlers:
+        try:
+            handler = logging.FileHandler(config['timings_file'])
+        except IOError, err:
+            log.warning(
+                'Failed to open {0}, logging the timings: {1}'.format(config['timings_file'], err)
+            )
+        else:
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            timings_log.addHandler(handler)
+            timings_log.propagate = False
+    instrument(calls)
+
+
+def setup(opts, name, calls=()):
+    '''
+    Enable the configured timings, timing the salt ``calls``, and install the profiling signal
+    handler. Returns the process :class:`Profiler`.
+    '''
+    config = get_config(opts)
+    if config['timings']:
+        _setup_timings(config, calls)
+    profiler = Profiler(name, config)
+    if config['enabled']:
+        profiler.install()
+    return profiler
+
+
+class ProfilingMixIn(object):
+    '''
+    Set up the profiling of a salt-ci daemon or command and time it's configuration load.
+    '''
+
+    # The salt functions to time, `MASTER_CALLS`, `MINION_CALLS` or `CLI_CALLS`
+    _profiling_calls_ = ()
+
+    def parse_args(self, args=None, values=None):
+        started = time.time()
+        options, args = super(ProfilingMixIn, self).parse_args(args, values)
+        self._config_load_time = time.time() - started
+        self.profiler = setup(self.config, self._config_filename_, self._profiling_calls_)
+        if not getattr(self.options, 'daemon', False):
+            # Daemons start profiling once in the background, see `daemonize_if_required`
+            self.profiler.start_if_configured()
+        return options, args
+
+    def setup_logfile_logger(self):
+        super(ProfilingMixIn, self).setup_logfile_logger()
+        self.log_config_load()
+
+    def log_config_load(self):
+        '''
+        Log how long the configuration took to load, once the logging is set up.
+        '''
+        if getattr(self, '_config_load_time', None) is None:
+            return
+        log_timing('config_load', self._config_load_time, config=self.get_config_file_path())
+        self._config_load_time = None
+
+    def daemonize_if_required(self):
+        super(ProfilingMixIn, self).daemonize_if_required()
+        if self.options.daemon:
+            self.profiler.start_if_configured()
@@ -0,0 +1,454 @@
+# -*- coding: utf-8 -*-
+'''
+    saltci.queue
+    ~~~~~~~~~~~~
+
+    Persistent job queue.
+
+    `salt-ci` submits it's jobs to the queue and the master publishes them once there's capacity
+    for them. The scheduling is done by strict priority class, limited by the global, per-project
+    and per-branch concurrency caps. Within a priority class, the project with the fewest running
+    jobs, and then the one which started a job the longest ago, goes first, so that a project
+    flooding the queue does not starve the others.
+
+    A newly submitted build of an explicit project, branch or revision supersedes, cancelling
+    them, the older queued jobs of the same project and branch running the same function, with
+    the same arguments, on the same target, no need to build a commit which is no longer the
+    branch head.
+
+    A running job is done once all it's minions returned or, like salt's own job returns
+    collection, once the minions which did not return, asked after ``return_timeout`` seconds
+    without any return, are no longer running it.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import python libs
+import time
+import uuid
+import logging
+
+# Import salt libs
+import salt.utils
+import salt.client
+import salt.utils.event
+
+# Import salt-ci libs
+from saltci import pool
+from saltci.config import section_config, _DEFAULT_QUEUE_CONFIG
+from saltci.events import EventHandler, fire_build, is_job_return, new_jid
+from saltci.exceptions import SaltCIQueueError
+from saltci.utils import SharedState
+
+log = logging.getLogger(__name__)
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+# Taken off the queue, being published by the master
+PUBLISHING = 'publishing'
+DONE = 'done'
+CANCELLED = 'cancelled'
+
+# The tag of the events fired as the master publishes and finishes the queued jobs. Salt's event
+# tags are at most 20 characters long
+QUEUE_EVENT_TAG = 'saltci_queue'
+
+
+def get_config(opts):
+    '''
+    Return the job queue configuration merged with it's defaults.
+    '''
+    return section_config(opts, 'queue', _DEFAULT_QUEUE_CONFIG)
+
+
+class QueueState(SharedState):
+    '''
+    The job queue, shared between the master and `salt-ci`.
+
+    ``jobs``
+        ``{queue_id: job}``
+    ``last_started``
+        ``{project: timestamp}``, used to share the capacity fairly among the projects
+    '''
+
+    name = 'queue'
+    default = {'jobs': {}, 'last_started': {}}
+
+
+def _supersede_key(job):
+    return (
+        job['project'],
+        job['branch'],
+        repr(job['fun']),
+        repr(job['arg']),
+        repr(job['tgt']),
+        job['expr_form'],
+        job['pool_count']
+    )
+
+
+def submit(opts, project, branch, tgt, fun, arg=(), expr_form='glob', ret='', priority=None,
+           pool_count=0, timeout=None, revision=None, supersede=True):
+    '''
+    Submit a job to the queue and return it's queue id. When ``supersede`` is ``True``, and
+    superseding is enabled, the older identical queued jobs are cancelled.
+    '''
+    config = get_config(opts)
+    if priority is None:
+        priority = config['default_priority']
+    if priority not in config['priorities']:
+        raise SaltCIQueueError(
+            'Unknown priority class {0!r}, known classes: {1}'.format(
+                priority, ', '.join(sorted(config['priorities']))
+            )
+        )
+
+    queue_id = uuid.uuid4().hex
+    job = {
+        'id': queue_id,
+        'state': QUEUED,
+        'project': project,
+        'branch': branch,
+        'revision': revision,
+        'priority': priority,
+        'tgt': tgt,
+        'fun': fun,
+        'arg': list(arg),
+        'expr_form': expr_form,
+        'ret': ret,
+        'pool_count': pool_count,
+        'supersede': supersede,
+        'timeout': timeout or config['job_timeout'],
+        'submitted': time.time(),
+        'started': None,
+        'finished': None,
+        'jid': None,
+        'minions': [],
+        'returned': [],
+        'pool_minions': [],
+        'error': None
+    }
+
+    superseded = []
+    with QueueState(opts).locked() as state:
+        if config['supersede'] and supersede:
+            key = _supersede_key(job)
+            for other in state['jobs'].itervalues():
+                if other['state'] == QUEUED and other.get('supersede', True) and \
+                        _supersede_key(other) == key:
+                    other.update(state=CANCELLED, finished=time.time(), superseded_by=queue_id)
+                    superseded.append(other['id'])
+                    log.info('Queued job {0} superseded by {1}'.format(other['id'], queue_id))
+        state['jobs'][queue_id] = job
+
+    for other_id in superseded:
+        # It might have been waiting on build minions
+        pool.cancel(opts, other_id)
+    return queue_id
+
+
+def get_job(opts, queue_id):
+    '''
+    Return the queued job or ``None`` if it's unknown.
+    '''
+    return QueueState(opts).read()['jobs'].get(queue_id)
+
+
+def cancel(opts, queue_id):
+    '''
+    Cancel a job which is still queued. Returns ``True`` if the job was cancelled.
+    '''
+    with QueueState(opts).locked() as state:
+        job = state['jobs'].get(queue_id)
+        if job is None or job['state'] != QUEUED:
+            return False
+        job.update(state=CANCELLED, finished=time.time())
+    pool.cancel(opts, queue_id)
+    return True
+
+
+def wait_for_dispatch(opts, queue_id, timeout=None, interval=1):
+    '''
+    Wait until the master publishes, or cancels, the queued job and return it.
+    '''
+    started = time.time()
+    while True:
+        job = get_job(opts, queue_id)
+        if job is None:
+            raise SaltCIQueueError('Unknown queued job {0}'.format(queue_id))
+        if job['state'] not in (QUEUED, PUBLISHING):
+            return job
+        if timeout is not None and time.time() - started > timeout:
+            raise SaltCIQueueError('Timed out waiting for the job {0} to start'.format(queue_id))
+        time.sleep(interval)
+
+
+def _concurrency(config, project, branch=None):
+    overrides = config['concurrency_overrides']
+    if branch is None:
+        return overrides.get(project, config['project_concurrency'])
+    return overrides.get('{0}/{1}'.format(project, branch), config['branch_concurrency'])
+
+
+def schedule(config, state, now=None):
+    '''
+    Return the queued jobs which should start now, in order.
+    '''
+    now = now or time.time()
+    jobs = state['jobs'].values()
+    running = [job for job in jobs if job['state'] in (RUNNING, PUBLISHING)]
+    slots = config['max_running'] - len(running)
+    if slots <= 0:
+        return []
+
+    per_project = {}
+    per_branch = {}
+    for job in running:
+        per_project[job['project']] = per_project.get(job['project'], 0) + 1
+        branch = (job['project'], job['branch'])
+        per_branch[branch] = per_branch.get(branch, 0) + 1
+
+    last_started = dict(state['last_started'])
+    selected = []
+    queued = [job for job in jobs if job['state'] == QUEUED]
+    for priority in sorted(set(config['priorities'].itervalues())):
+        pending = [job for job in queued if config['priorities'].get(job['priority']) == priority]
+        while pending and slots > 0:
+            eligible = [
+                job for job in pending
+                if per_project.get(job['project'], 0) < _concurrency(config, job['project']) and
+                per_branch.get((job['project'], job['branch']), 0) <
+                _concurrency(config, job['project'], job['branch'])
+            ]
+            if not eligible:
+                break
+            job = min(
+                eligible,
+                key=lambda job: (
+                    per_project.get(job['project'], 0),
+                    last_started.get(job['project'], 0),
+                    job['submitted']
+                )
+            )
+            pending.remove(job)
+            selected.append(job)
+            slots -= 1
+            per_project[job['project']] = per_project.get(job['project'], 0) + 1
+            branch = (job['project'], job['branch'])
+            per_branch[branch] = per_branch.get(branch, 0) + 1
+            last_started[job['project']] = now
+    return selected
+
+
+class JobQueue(EventHandler):
+    '''
+    Publish the queued jobs and keep track of the running ones.
+    '''
+
+    maintenance_interval = 1
+
+    def setup(self):
+        self.config = get_config(self.opts)
+        self.state = QueueState(self.opts)
+        self.local = None
+        self.event = salt.utils.event.MasterEvent(self.opts['sock_dir'])
+        with self.state.locked() as state:
+            for job in state['jobs'].itervalues():
+                if job['state'] == PUBLISHING:
+                    # The master stopped while publishing it
+                    job['state'] = QUEUED
+        # jid -> queue id, of the running jobs
+        self.running = dict(
+            (job['jid'], job['id']) for job in self.state.read()['jobs'].itervalues()
+            if job['state'] == RUNNING
+        )
+        # queue id -> when the running job was last heard of, published, returned or found running
+        self.activity = {}
+        # queue id -> (when, find_job jid), of the running jobs whose missing minions were asked if
+        # they're still running them
+        self.checking = {}
+        # find_job jid -> queue id
+        self.find_jobs = {}
+
+    def _fire(self, job):
+        self.event.fire_event(
+            dict(
+                (key, job.get(key)) for key in (
+                    'id', 'state', 'project', 'branch', 'revision', 'priority', 'fun', 'jid',
+                    'minions', 'error'
+                )
+            ),
+            QUEUE_EVENT_TAG
+        )
+
+    def _checked(self, queue_id):
+        find_jid = self.checking.pop(queue_id, (None, None))[1]
+        self.find_jobs.pop(find_jid, None)
+
+    def _finish(self, job, error=None):
+        job.update(state=DONE, finished=time.time(), error=error)
+        self.running.pop(job['jid'], None)
+        self.activity.pop(job['id'], None)
+        self._checked(job['id'])
+        if job['pool_minions']:
+            pool.release(self.opts, job['pool_minions'], owner=job['id'])
+        self._fire(job)
+
+    def handle_event(self, tag, data):
+        if not is_job_return(tag, data):
+            return
+        if tag in self.find_jobs:
+            if data['return']:
+                # The minion is still running the job, wait some more
+                queue_id = self.find_jobs[tag]
+                self.activity[queue_id] = time.time()
+                self._checked(queue_id)
+            return
+        if tag not in self.running:
+            return
+
+        queue_id = self.running[tag]
+        self.activity[queue_id] = time.time()
+        job = self.state.read()['jobs'].get(queue_id)
+        if job is None or job['state'] != RUNNING:
+            self.running.pop(tag, None)
+            return
+        if data['id'] in job['returned']:
+            # Duplicated return, no need to lock the queue
+            return
+
+        with self.state.locked() as state:
+            job = state['jobs'].get(queue_id)
+            if job is None or job['state'] != RUNNING:
+                self.running.pop(tag, None)
+                return
+            if data['id'] not in job['returned']:
+                job['returned'].append(data['id'])
+            if not set(job['minions']).difference(job['returned']):
+                self._finish(job)
+                log.info('Job {0}({1}) is done'.format(job['id'], job['jid']))
+
+    def _publish(self, job, now):
+        if job['pool_count']:
+            minions = pool.try_acquire(self.opts, job['pool_count'], job['id'], job['submitted'])
+            if minions is None:
+                # The pool is scaling up for this job, try again later
+                return False
+            job.update(pool_minions=minions, tgt=minions, expr_form='list')
+
+        if self.local is None:
+            self.local = salt.client.LocalClient(mopts=self.opts)
+        jid = new_jid()
+        try:
+            # Announced before publishing, so that it's known as a build before any return
+            fire_build(
+                self.opts, jid, job['project'], job['branch'], job['revision'], job['fun'],
+                event=self.event
+            )
+            pub_data = self.local.pub(
+                job['tgt'], job['fun'], job['arg'], job['expr_form'], job['ret'], jid=jid
+            )
+        except Exception, err:
+            pub_data = {}
+            log.error('Failed to publish job {0}: {1}'.format(job['id'], err), exc_info=True)
+
+        job['started'] = now
+        if not pub_data or not pub_data.get('minions'):
+            self._finish(job, error='The job was not published to any minion')
+            return True
+
+        job.update(state=RUNNING, jid=pub_data['jid'], minions=list(pub_data['minions']))
+        self.running[job['jid']] = job['id']
+        self.activity[job['id']] = now
+        self._fire(job)
+        log.info('Published job {0} as {1}'.format(job['id'], job['jid']))
+        return True
+
+    def _timed_out(self, job, now):
+        return job['state'] == RUNNING and now - job['started'] > job['timeout']
+
+    def _expired(self, job, now):
+        return job['state'] in (DONE, CANCELLED) and \
+            now - job['finished'] > self.config['keep_finished']
+
+    def _check_returns(self, state, now):
+        '''
+        Ask the minions which did not return if they're still running their jobs. Returns the ids
+        of the jobs none of the missing minions is running anymore.
+        '''
+        gone = set()
+        for queue_id, job in state['jobs'].iteritems():
+            if job['state'] != RUNNING:
+                continue
+            if queue_id in self.checking:
+                if now - self.checking[queue_id][0] > self.opts['timeout']:
+                    # None of the missing minions answered that it's still running the job
+                    gone.add(queue_id)
+                continue
+            if now - self.activity.setdefault(queue_id, job['started']) < \
+                    self.config['return_timeout']:
+                continue
+            missing = set(job['minions']).difference(job['returned'])
+            if not missing:
+                continue
+            if self.local is None:
+                self.local = salt.client.LocalClient(mopts=self.opts)
+            find_jid = self.local.cmd_async(
+                salt.utils.isorted(missing), 'saltutil.find_job', [job['jid']], expr_form='list'
+            )
+            if find_jid:
+                self.checking[queue_id] = (now, find_jid)
+                self.find_jobs[find_jid] = queue_id
+        return gone
+
+    def maintenance(self):
+        now = time.time()
+        state = self.state.read()
+        gone = self._check_returns(state, now)
+        if not gone and not any(self._timed_out(job, now) or self._expired(job, now)
+                                for job in state['jobs'].itervalues()) and \
+                not schedule(self.config, state, now):
+            # Nothing to do, no need to lock the queue
+            return
+
+        with self.state.locked() as state:
+            for queue_id, job in state['jobs'].items():
+                if self._timed_out(job, now):
+                    log.warning('Job {0}({1}) timed out'.format(queue_id, job['jid']))
+                    self._finish(job, error='Timed out')
+                elif queue_id in gone and job['state'] == RUNNING:
+                    log.info('Job {0}({1}) is done, {2} did not return'.format(
+                        queue_id,
+                        job['jid'],
+                        ', '.join(salt.utils.isorted(
+                            set(job['minions']).difference(job['returned'])
+                        ))
+                    ))
+                    self._finish(job)
+                elif self._expired(job, now):
+                    state['jobs'].pop(queue_id)
+
+            selected = []
+            for job in schedule(self.config, state, now):
+                job['state'] = PUBLISHING
+                selected.append(dict(job))
+
+        if not selected:
+            return
+
+        # Publishing, and acquiring the build minions, is done without holding the queue lock,
+        # the jobs taken off the queue are left alone by `submit` and `cancel`
+        published = [(job, self._publish(job, now)) for job in selected]
+
+        with self.state.locked() as state:
+            for job, started in published:
+                if job['id'] not in state['jobs']:
+                    continue
+                if started:
+                    state['jobs'][job['id']] = job
+                    state['last_started'][job['project']] = now
+                else:
+                    state['jobs'][job['id']]['state'] = QUEUED
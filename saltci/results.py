@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+'''
+    saltci.results
+    ~~~~~~~~~~~~~~
+
+    Job results recording.
+
+    The master writes the minions returns of the build jobs, the ones announced by a
+    :data:`saltci.events.BUILD_EVENT_TAG` event, to the database, in batches, and bumps the
+    results generation on every batch, which is what invalidates the web API cached responses.
+    The returns of any other job are ignored.
+
+    A job return which is a dictionary can report it's individual test results under the
+    ``tests`` key, either as ``{test: success}`` or ``{test: {'result': ..., 'duration': ...}}``.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import python libs
+import json
+import time
+import logging
+from datetime import datetime
+
+# Import salt-ci libs
+from saltci import database
+from saltci.events import EventHandler, is_build, is_job_return
+
+log = logging.getLogger(__name__)
+
+# Write the pending results once there are this many of them, no matter the interval
+MAX_PENDING = 500
+
+# Failed attempts at writing the pending results after which they're dropped
+MAX_ATTEMPTS = 5
+
+# The job return key holding the individual test results
+TESTS_KEY = 'tests'
+
+# Seconds a return waits for it's build to be announced before being ignored, the announcement
+# and the first returns can reach the event bus out of order
+BUILD_GRACE = 10
+
+
+def is_success(ret):
+    '''
+    Return ``True`` if the minion job return reports a success.
+    '''
+    if isinstance(ret, dict):
+        if 'retcode' in ret:
+            return ret['retcode'] == 0
+        if 'result' in ret:
+            return ret['result'] is True
+    return ret is not False
+
+
+def iter_tests(ret):
+    '''
+    Yield the ``(name, success, duration)`` of the test results reported on a job return.
+    '''
+    if not isinstance(ret, dict) or not isinstance(ret.get(TESTS_KEY), dict):
+        return
+    for name, result in ret[TESTS_KEY].iteritems():
+        if isinstance(result, dict):
+            yield name, result.get('result') is True, result.get('duration')
+        else:
+            yield name, result is True, None
+
+
+class ResultRecorder(EventHandler):
+    '''
+    Write the job returns to the database.
+    '''
+
+    maintenance_interval = 1
+
+    def setup(self):
+        self.enabled = bool(self.opts.get('SQLALCHEMY_DATABASE_URI'))
+        if not self.enabled:
+            return
+        self.app = database.make_app(self.opts)
+        # (received, is a build announcement, event data)
+        self.pending = []
+        # Consecutive failed attempts at writing the pending results
+        self.attempts = 0
+
+    def handle_event(self, tag, data):
+        if not self.enabled:
+            return
+        if is_build(tag, data):
+            self.pending.append((time.time(), True, data))
+        elif is_job_return(tag, data):
+            self.pending.append((time.time(), False, data))
+        else:
+            return
+        if len(self.pending) >= MAX_PENDING and not self.attempts:
+            # While failing, the writes are only retried on the maintenance interval
+            self.maintenance()
+
+    def maintenance(self):
+        if not self.enabled or not self.pending:
+            return
+        try:
+            deferred = self._record(self.pending)
+        except Exception:
+            database.db.session.rollback()
+            self.attempts += 1
+            if self.attempts >= MAX_ATTEMPTS:
+                log.error('Dropping {0} build event(s) after {1} failed attempts'.format(
+                    len(self.pending), self.attempts
+                ))
+                self.pending = []
+                self.attempts = 0
+            raise
+        self.attempts = 0
+        self.pending = deferred
+
+    def _record(self, pending):
+        '''
+        Write the ``pending`` events on a single transaction. Returns the ones to retry later.
+        '''
+        # Late import, the models need the database setup
+        from saltci.database.models import Build, BuildResult, TestResult
+
+        jids = set(load['jid'] for _, _, load in pending)
+        builds = dict(
+            (build.jid, build) for build in Build.query.filter(Build.jid.in_(jids))
+        )
+        now = datetime.utcnow()
+        # The returns whose build might still be announced
+        deferred = []
+        recorded = 0
+
+        for received, announced, load in pending:
+            if announced:
+                if load['jid'] not in builds:
+                    build = builds[load['jid']] = Build(
+                        jid=load['jid'],
+                        project=load.get('project') or '',
+                        branch=load.get('branch') or '',
+                        revision=load.get('revision'),
+                        fun=str(load.get('fun', '')),
+                        created=now
+                    )
+                    database.db.session.add(build)
+                    database.db.session.flush()
+                    recorded += 1
+                continue
+
+            build = builds.get(load['jid'])
+            if build is None:
+                if time.time() - received < BUILD_GRACE:
+                    deferred.append((received, announced, load))
+                # Otherwise, it's not a build
+                continue
+            if BuildResult.query.filter_by(build_id=build.id, minion_id=load['id']).count():
+                # Duplicated return
+                continue
+
+            ret = load['return']
+            success = is_success(ret)
+            result = BuildResult(
+                build_id=build.id,
+                minion_id=load['id'],
+                success=success,
+                retcode=ret.get('retcode') if isinstance(ret, dict) else None,
+                created=now,
+                data=json.dumps(ret, default=repr)
+            )
+            database.db.session.add(result)
+            tests = list(iter_tests(ret))
+            if tests:
+                database.db.session.flush()
+                for name, test_success, duration in tests:
+                    database.db.session.add(
+                        TestResult(
+                            result_id=result.id,
+                            build_id=build.id,
+                            name=name,
+                            success=test_success,
+                            duration=duration
+                        )
+                    )
+            build.returned += 1
+            build.failed += not success
+            build.updated = now
+            recorded += 1
+
+        if recorded:
+            database.bump_generation()
+            database.db.session.commit()
+            log.debug('Recorded {0} build event(s)'.format(recorded))
+        return deferred
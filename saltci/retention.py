@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+'''
+    saltci.retention
+    ~~~~~~~~~~~~~~~~
+
+    Historical results retention.
+
+    Once a day is old enough for late job returns to be unlikely, it's raw results are rolled up
+    into the daily build counts of each project branch and the daily results and duration
+    percentiles of each test. The history queries, dashboards and analysis alike, use the
+    rollups, a row per day instead of a row per run.
+
+    The raw results older than their project's TTL, and already rolled up, are then deleted in
+    small batches, sleeping between them, so that the compaction does not hog the database I/O.
+    It runs on it's own process, the master's event processing is never held up by it.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import python libs
+import os
+import math
+import time
+import shutil
+import logging
+import multiprocessing
+from datetime import date, datetime, timedelta
+
+# Import 3rd-party libs
+from sqlalchemy import case, func
+
+# Import salt-ci libs
+from saltci import database, flaky, logs
+from saltci.config import section_config, _DEFAULT_RETENTION_CONFIG
+
+log = logging.getLogger(__name__)
+
+# The `saltci_meta` key holding the last rolled up day, as a date ordinal
+ROLLUP_WATERMARK = 'rollup_day'
+
+# Rows fetched at once while rolling up the test results
+FETCH_SIZE = 5000
+
+
+def get_config(opts):
+    '''
+    Return the results retention configuration merged with it's defaults.
+    '''
+    return section_config(opts, 'retention', _DEFAULT_RETENTION_CONFIG)
+
+
+def percentile(values, pct):
+    '''
+    Return the nearest-rank ``pct`` percentile of the sorted ``values``.
+    '''
+    if not values:
+        return None
+    rank = int(math.ceil(pct / 100.0 * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+def _day_range(day):
+    start = datetime(day.year, day.month, day.day)
+    return start, start + timedelta(days=1)
+
+
+def rollup_day(day):
+    '''
+    (Re)compute the rollups of ``day``, on the current transaction.
+    '''
+    from saltci.database.models import Build, DailyRollup, TestResult, TestRollup
+
+    start, end = _day_range(day)
+    DailyRollup.query.filter_by(day=day).delete()
+    TestRollup.query.filter_by(day=day).delete()
+
+    builds = database.db.session.query(
+        Build.project,
+        Build.branch,
+        func.count(Build.id),
+        func.sum(case([(Build.failed > 0, 1)], else_=0))
+    ).filter(Build.created >= start, Build.created < end).group_by(Build.project, Build.branch)
+    for project, branch, count, failed in builds:
+        database.db.session.add(
+            DailyRollup(
+                day=day,
+                project=project,
+                branch=branch,
+                builds=count,
+                passed=count - (failed or 0),
+                failed=failed or 0
+            )
+        )
+
+    # (project, name) -> [runs, passed, durations]
+    tests = {}
+    results = database.db.session.query(
+        Build.project, TestResult.name, TestResult.success, TestResult.duration
+    ).join(TestResult, TestResult.build_id == Build.id).filter(
+        Build.created >= start, Build.created < end
+    )
+    for project, name, success, duration in results.yield_per(FETCH_SIZE):
+        entry = tests.setdefault((project, name), [0, 0, []])
+        entry[0] += 1
+        entry[1] += bool(success)
+        if duration is not None:
+            entry[2].append(duration)
+
+    for (project, name), (runs, passed, durations) in tests.iteritems():
+        durations.sort()
+        database.db.session.add(
+            TestRollup(
+                day=day,
+                project=project,
+                name=name,
+                runs=runs,
+                passed=passed,
+                failed=runs - passed,
+                duration_p50=percentile(durations, 50),
+                duration_p90=percentile(durations, 90),
+                duration_p99=percentile(durations, 99)
+            )
+        )
+
+
+def _set_watermark(day):
+    from saltci.database.models import Meta
+    meta = Meta.query.get(ROLLUP_WATERMARK)
+    if meta is None:
+        meta = Meta(key=ROLLUP_WATERMARK)
+        database.db.session.add(meta)
+    meta.value = day.toordinal()
+
+
+def _bump_generation():
+    # Once per rollup or compaction run, not per transaction, the web API cached responses are
+    # invalidated by every bump
+    try:
+        database.bump_generation()
+        database.db.session.commit()
+    except Exception:
+        database.db.session.rollback()
+        raise
+
+
+def rolled_up_until():
+    '''
+    Return the last rolled up day, or ``None``.
+    '''
+    from saltci.database.models import Meta
+    meta = Meta.query.get(ROLLUP_WATERMARK)
+    if meta is None:
+        return None
+    return date.fromordinal(meta.value)
+
+
+def rollup(config, today=None):
+    '''
+    Roll up the days which are old enough and were not rolled up yet, one transaction per day.
+    '''
+    from saltci.database.models import Build
+
+    today = today or datetime.utcnow().date()
+    last = today - timedelta(days=config['rollup_delay'] + 1)
+    day = rolled_up_until()
+    if day is None:
+        first = database.db.session.query(func.min(Build.created)).scalar()
+        if first is None:
+            return
+        day = first.date()
+    else:
+        day += timedelta(days=1)
+
+    rolled_up = 0
+    try:
+        while day <= last:
+            started = time.time()
+            try:
+                rollup_day(day)
+                _set_watermark(day)
+                database.db.session.commit()
+            except Exception:
+                database.db.session.rollback()
+                raise
+            log.info('Rolled up {0} in {1:.1f} seconds'.format(day, time.time() - started))
+            rolled_up += 1
+            day += timedelta(days=1)
+    finally:
+        if rolled_up:
+            _bump_generation()
+
+
+def _compact_batches(config, query):
+    from saltci.database.models import Build, BuildResult, TestResult
+
+    deleted = 0
+    while True:
+        ids = [row[0] for row in query.order_by(Build.id).limit(config['batch_size'])]
+        if not ids:
+            return deleted
+        try:
+            TestResult.query.filter(TestResult.build_id.in_(ids)).delete(
+                synchronize_session=False
+            )
+            BuildResult.query.filter(BuildResult.build_id.in_(ids)).delete(
+                synchronize_session=False
+            )
+            Build.query.filter(Build.id.in_(ids)).delete(synchronize_session=False)
+            database.db.session.commit()
+        except Exception:
+            database.db.session.rollback()
+            raise
+        deleted += len(ids)
+        if config['batch_sleep']:
+            time.sleep(config['batch_sleep'])
+
+
+def compact(config, now=None, keep_from=None):
+    '''
+    Delete the raw results which are past their project's TTL and were already rolled up.
+    The builds from the ``keep_from`` build id on are kept. Returns the number of deleted builds.
+    '''
+    from saltci.database.models import Build
+
+    rolled_up = rolled_up_until()
+    if rolled_up is None:
+        return 0
+    now = now or datetime.utcnow()
+    rolled_up_end = _day_range(rolled_up)[1]
+
+    def cutoff(ttl):
+        return min(now - timedelta(days=ttl), rolled_up_end)
+
+    def builds(ttl):
+        query = database.db.session.query(Build.id).filter(Build.created < cutoff(ttl))
+        if keep_from is not None:
+            query = query.filter(Build.id < keep_from)
+        return query
+
+    overrides = config['project_raw_ttl']
+    deleted = 0
+    try:
+        for project, ttl in overrides.iteritems():
+            deleted += _compact_batches(config, builds(ttl).filter(Build.project == project))
+        query = builds(config['raw_ttl'])
+        if overrides:
+            query = query.filter(~Build.project.in_(list(overrides)))
+        deleted += _compact_batches(config, query)
+    except Exception:
+        # The batches deleted before the failure are gone
+        _bump_generation()
+        raise
+    if deleted:
+        _bump_generation()
+        log.info('Compacted {0} builds'.format(deleted))
+    return deleted
+
+
+def clean_logs(opts, config, now=None):
+    '''
+    Delete the shipped build logs older than ``logs_ttl`` days.
+    '''
+    logs_dir = logs.get_config(opts)['logs_dir']
+    if not os.path.isdir(logs_dir):
+        return
+    cutoff = (now or time.time()) - config['logs_ttl'] * 86400
+    for jid in os.listdir(logs_dir):
+        path = os.path.join(logs_dir, jid)
+        if os.path.isdir(path) and os.path.getmtime(path) < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
+            log.debug('Deleted the build logs of job {0}'.format(jid))
+
+
+class RetentionProcess(multiprocessing.Process):
+    '''
+    Periodically roll up and compact the historical results.
+    '''
+
+    def __init__(self, opts):
+        super(RetentionProcess, self).__init__(name='RetentionProcess')
+        self.opts = opts
+        self.daemon = True
+
+    def run(self):
+        config = get_config(self.opts)
+        has_database = bool(self.opts.get('SQLALCHEMY_DATABASE_URI'))
+        if has_database:
+            database.make_app(self.opts)
+
+        while True:
+            if has_database:
+                self._run(rollup, config)
+                self._run(self.compact, config)
+            self._run(clean_logs, self.opts, config)
+            time.sleep(config['check_interval'])
+
+    def compact(self, config):
+        keep_from = None
+        if flaky.get_config(self.opts)['enabled']:
+            # Do not delete the test results the flaky tests analysis did not get to yet
+            keep_from = flaky.first_pending_build()
+        compact(config, keep_from=keep_from)
+
+    def _run(self, func, *args):
+        try:
+            func(*args)
+        except Exception, err:
+            log.error(
+                'Failed to run the results retention {0}: {1}'.format(func.__name__, err),
+                exc_info=True
+            )
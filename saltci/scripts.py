@@ -39,3 +39,15 @@ def run_salt_ci_notif_call():
     from saltci.notif.cli import SaltCINotifCall
     saltcinotifcall = SaltCINotifCall()
     saltcinotifcall.run()
+
+
+def run_salt_ci_web():
+    from saltci.web.cli import SaltCIWeb
+    saltciweb = SaltCIWeb()
+    saltciweb.start()
+
+
+def run_salt_ci_migrate():
+    from saltci.database.cli import SaltCIMigrate
+    saltcimigrate = SaltCIMigrate()
+    saltcimigrate.run()
@@ -0,0 +1,439 @@
+# -*- coding: utf-8 -*-
+'''
+    saltci.stream
+    ~~~~~~~~~~~~~
+
+    Live build events, pushed to the dashboards as Server-Sent Events.
+
+    The master's event processing, which already is the single subscriber of salt's event bus,
+    hands the CI job events over to :class:`StreamServer`, a single non-blocking server thread
+    which fans them out to every connected client. Each event is serialized once, whatever the
+    number of clients, and no client ever causes a database query.
+
+    Clients subscribe to ``/events``, optionally filtered by project,
+    ``/events?project=salt&project=salt-ci``, and get the following events:
+
+    ``job``
+        A queued job was published, or finished, the data is the queue job summary
+    ``return``
+        A minion returned for a build, ``{'jid': ..., 'minion': ..., 'success': ..., ...}``
+    ``resync``
+        The server no longer has the events missed by the client, it should reload the build
+        state from the web API
+
+    The project of a return is the one of the build announcement, see
+    :data:`saltci.events.BUILD_EVENT_TAG`, which salt-ci fires before publishing any build job,
+    queued or not. The returns of the jobs which are not builds are not streamed.
+
+    A client which does not keep up, and has more than ``max_buffer`` bytes of events waiting to
+    be sent, is disconnected instead of slowing down everyone else or growing the master's
+    memory. The browser reconnects on it's own, sending the last event id it got, and the missed
+    events are replayed from the recent events history.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import python libs
+import os
+import json
+import time
+import errno
+import fcntl
+import select
+import socket
+import logging
+import urlparse
+import threading
+import collections
+
+# Import salt-ci libs
+from saltci.config import section_config, _DEFAULT_STREAM_CONFIG
+from saltci.events import EventHandler, is_build, is_job_return
+from saltci.queue import QUEUE_EVENT_TAG
+from saltci.results import BUILD_GRACE, is_success
+
+log = logging.getLogger(__name__)
+
+# Seconds a client has to send it's request
+REQUEST_TIMEOUT = 10
+# Maximum size of a client request
+MAX_REQUEST_SIZE = 8192
+# Number of job id to project mappings to keep
+MAX_JOBS = 10000
+# Number of returns kept waiting for their build announcement
+MAX_HELD = 1000
+
+_POLL_READ = select.POLLIN | select.POLLPRI
+_POLL_ERROR = select.POLLERR | select.POLLHUP | select.POLLNVAL
+
+
+def get_config(opts):
+    '''
+    Return the live build events configuration merged with it's defaults.
+    '''
+    return section_config(opts, 'stream', _DEFAULT_STREAM_CONFIG)
+
+
+def _set_nonblocking(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+def format_event(event_id, event_type, data):
+    '''
+    Return the Server-Sent Events frame of an event.
+    '''
+    return 'id: {0}\nevent: {1}\ndata: {2}\n\n'.format(event_id, event_type, json.dumps(data))
+
+
+class StreamClient(object):
+    '''
+    A connected client and the frames waiting to be sent to it.
+    '''
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        # The file descriptor, still known once the socket is closed
+        self.fd = sock.fileno()
+        self.address = address
+        self.connected = time.time()
+        self.request = ''
+        self.projects = set()
+        self.streaming = False
+        # Close the connection once the buffer is flushed
+        self.closing = False
+        self.buffer = collections.deque()
+        self.buffered = 0
+
+    def matches(self, project):
+        return not self.projects or project in self.projects
+
+    def queue(self, frame):
+        self.buffer.append(frame)
+        self.buffered += len(frame)
+
+    def flush(self):
+        '''
+        Send as much of the buffer as the socket takes. Returns ``True`` once it's empty.
+        '''
+        while self.buffer:
+            frame = self.buffer[0]
+            try:
+                sent = self.sock.send(frame)
+            except socket.error, err:
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return False
+                raise
+            self.buffered -= sent
+            if sent < len(frame):
+                self.buffer[0] = frame[sent:]
+                return False
+            self.buffer.popleft()
+        return True
+
+
+class StreamServer(threading.Thread):
+    '''
+    Non-blocking Server-Sent Events server.
+
+    :meth:`publish` is the only method which is meant to be called from other threads.
+    '''
+
+    def __init__(self, config):
+        super(StreamServer, self).__init__(name='StreamServer')
+        self.daemon = True
+        self.config = config
+        self.clients = {}
+        self.last_id = 0
+        # (event id, project, frame)
+        self.history = collections.deque(maxlen=config['history_size'])
+        # (project, event type, data), published and not yet dispatched
+        self.pending = collections.deque()
+        self.last_keepalive = time.time()
+
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((config['interface'], config['port']))
+        self.listener.listen(128)
+        self.listener.setblocking(0)
+
+        # Wakes the server up when events are published
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        _set_nonblocking(self.wakeup_r)
+        _set_nonblocking(self.wakeup_w)
+
+        self.poller = select.poll()
+        self.poller.register(self.listener.fileno(), _POLL_READ)
+        self.poller.register(self.wakeup_r, _POLL_READ)
+
+    def publish(self, project, event_type, data):
+        '''
+        Queue an event to be sent to the clients subscribed to ``project``.
+        '''
+        self.pending.append((project, event_type, data))
+        try:
+            os.write(self.wakeup_w, 'x')
+        except OSError, err:
+            if err.errno != errno.EAGAIN:
+                raise
+            # The server has plenty of wake ups pending
+
+    def run(self):
+        log.info('Serving the live build events on {0}:{1}{2}'.format(
+            self.config['interface'], self.config['port'], self.config['path']
+        ))
+        while True:
+            try:
+                ready = self.poller.poll(1000)
+            except select.error, err:
+                if err.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            for fd, mask in ready:
+                if fd == self.listener.fileno():
+                    self._accept()
+                elif fd == self.wakeup_r:
+                    try:
+                        while os.read(self.wakeup_r, 4096):
+                            pass
+                    except OSError, err:
+                        if err.errno != errno.EAGAIN:
+                            raise
+                elif fd in self.clients:
+                    self._handle(self.clients[fd], mask)
+
+            self._dispatch()
+            self._housekeeping()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, address = self.listener.accept()
+            except socket.error, err:
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                log.warning('Failed to accept a live events client: {0}'.format(err))
+                return
+            sock.setblocking(0)
+            client = StreamClient(sock, address)
+            self.clients[client.fd] = client
+            self.poller.register(client.fd, _POLL_READ)
+            if len(self.clients) > self.config['max_clients']:
+                log.warning('Too many live events clients, refusing {0}'.format(address[0]))
+                self._respond(client, '503 Service Unavailable')
+
+    def _close(self, client):
+        fd = client.fd
+        self.clients.pop(fd, None)
+        try:
+            self.poller.unregister(fd)
+        except KeyError:
+            pass
+        client.sock.close()
+
+    def _send(self, client, frame):
+        was_empty = not client.buffer
+        client.queue(frame)
+        if was_empty:
+            # Write right away, most of the time the socket takes it all
+            self._write(client)
+
+    def _write(self, client):
+        try:
+            flushed = client.flush()
+        except socket.error:
+            self._close(client)
+            return
+        if flushed and client.closing:
+            self._close(client)
+            return
+        events = _POLL_READ if flushed else _POLL_READ | select.POLLOUT
+        self.poller.modify(client.fd, events)
+
+    def _handle(self, client, mask):
+        if mask & _POLL_ERROR:
+            self._close(client)
+            return
+
+        if mask & _POLL_READ:
+            try:
+                data = client.sock.recv(4096)
+            except socket.error, err:
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    data = None
+                else:
+                    data = ''
+            if data == '':
+                # The client is gone
+                self._close(client)
+                return
+            if data and not client.streaming and not client.closing:
+                client.request += data
+                if '\r\n\r\n' in client.request:
+                    self._start(client)
+                elif len(client.request) > MAX_REQUEST_SIZE:
+                    self._respond(client, '413 Request Entity Too Large')
+
+        if mask & select.POLLOUT and client.fd in self.clients:
+            self._write(client)
+
+    def _respond(self, client, status):
+        client.closing = True
+        self._send(client, 'HTTP/1.1 {0}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'.format(
+            status
+        ))
+
+    def _start(self, client):
+        lines = client.request.split('\r\n\r\n', 1)[0].split('\r\n')
+        try:
+            method, target, _ = lines[0].split(' ', 2)
+        except ValueError:
+            self._respond(client, '400 Bad Request')
+            return
+        url = urlparse.urlsplit(target)
+        if method != 'GET':
+            self._respond(client, '405 Method Not Allowed')
+            return
+        if url.path != self.config['path']:
+            self._respond(client, '404 Not Found')
+            return
+
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        query = urlparse.parse_qs(url.query)
+        client.projects = set(query.get('project', []))
+        # Polyfills which can not set headers pass the last event id on the query string
+        last_id = headers.get('last-event-id', query.get('last_event_id', [None])[0])
+
+        client.streaming = True
+        client.request = ''
+        response = [
+            'HTTP/1.1 200 OK',
+            'Content-Type: text/event-stream',
+            'Cache-Control: no-cache',
+            'Connection: keep-alive'
+        ]
+        if self.config['allow_origin']:
+            response.append('Access-Control-Allow-Origin: {0}'.format(self.config['allow_origin']))
+        self._send(client, '\r\n'.join(response) + '\r\n\r\n' + 'retry: 3000\n\n')
+
+        if last_id is None:
+            return
+        try:
+            last_id = int(last_id)
+        except ValueError:
+            last_id = -1
+        oldest = self.history[0][0] if self.history else self.last_id + 1
+        if last_id > self.last_id or last_id < oldest - 1:
+            # The events the client missed are gone, or it's from before a master restart
+            self._send(client, format_event(self.last_id, 'resync', {}))
+            return
+        for event_id, project, frame in self.history:
+            if event_id > last_id and client.matches(project):
+                self._send(client, frame)
+                if client.fd not in self.clients:
+                    return
+
+    def _dispatch(self):
+        while self.pending:
+            project, event_type, data = self.pending.popleft()
+            self.last_id += 1
+            # Serialized once for all the clients
+            frame = format_event(self.last_id, event_type, data)
+            self.history.append((self.last_id, project, frame))
+            for client in self.clients.values():
+                if not client.streaming or not client.matches(project):
+                    continue
+                if client.buffered + len(frame) > self.config['max_buffer']:
+                    log.debug('Disconnecting the slow live events client {0}'.format(
+                        client.address[0]
+                    ))
+                    self._close(client)
+                    continue
+                self._send(client, frame)
+
+    def _housekeeping(self):
+        now = time.time()
+        keepalive = now - self.last_keepalive >= self.config['keepalive']
+        if keepalive:
+            self.last_keepalive = now
+        for client in self.clients.values():
+            if not client.streaming:
+                if now - client.connected > REQUEST_TIMEOUT:
+                    self._close(client)
+            elif keepalive and not client.buffer:
+                # Keeps proxies from timing out the connection and finds the dead clients
+                self._send(client, ':\n\n')
+
+
+class EventStream(EventHandler):
+    '''
+    Hand the CI job events over to the live events server.
+    '''
+
+    maintenance_interval = 1
+
+    def setup(self):
+        self.config = get_config(self.opts)
+        self.server = None
+        if not self.config['enabled']:
+            return
+        self.server = StreamServer(self.config)
+        self.server.start()
+        # jid -> project, of the builds
+        self.projects = collections.OrderedDict()
+        # (received, data) of the returns which came before their build announcement
+        self.held = collections.deque(maxlen=MAX_HELD)
+
+    def handle_event(self, tag, data):
+        if self.server is None:
+            return
+
+        if is_build(tag, data):
+            self.projects[data['jid']] = data['project']
+            while len(self.projects) > MAX_JOBS:
+                self.projects.popitem(last=False)
+            return
+
+        if tag == QUEUE_EVENT_TAG and isinstance(data, dict):
+            self.server.publish(data['project'], 'job', data)
+            return
+
+        if not is_job_return(tag, data):
+            return
+        if tag in self.projects:
+            self._publish_return(data)
+        else:
+            self.held.append((time.time(), data))
+
+    def _publish_return(self, data):
+        ret = data['return']
+        self.server.publish(
+            self.projects[data['jid']],
+            'return',
+            {
+                'jid': data['jid'],
+                'minion': data['id'],
+                'fun': data.get('fun'),
+                'success': is_success(ret),
+                'retcode': ret.get('retcode') if isinstance(ret, dict) else None
+            }
+        )
+
+    def maintenance(self):
+        if self.server is None or not self.held:
+            return
+        now = time.time()
+        held, self.held = self.held, collections.deque(maxlen=MAX_HELD)
+        for received, data in held:
+            if data['jid'] in self.projects:
+                self._publish_return(data)
+            elif now - received < BUILD_GRACE:
+                self.held.append((received, data))
+            # Otherwise, it's not a build
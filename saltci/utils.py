@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+'''
+    saltci.utils
+    ~~~~~~~~~~~~
+
+    Salt-CI utilities.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import python libs
+import os
+import copy
+import fcntl
+from contextlib import contextmanager
+
+# Import salt libs
+import salt.utils
+import salt.payload
+
+
+class SharedState(object):
+    '''
+    A dictionary persisted on the master's cache directory and shared between processes through
+    a locked file.
+
+    Subclasses set :attr:`name`, the state file name, and :attr:`default`, the initial state.
+    '''
+
+    name = None
+    default = {}
+
+    def __init__(self, opts):
+        self.path = os.path.join(opts['cachedir'], 'salt-ci', '{0}.p'.format(self.name))
+        self.serial = salt.payload.Serial(opts)
+
+    def read(self):
+        '''
+        Load and return the state without locking it, for read-only access.
+        '''
+        state = copy.deepcopy(self.default)
+        if os.path.isfile(self.path) and os.path.getsize(self.path):
+            with salt.utils.fopen(self.path, 'rb') as rfh:
+                state.update(self.serial.load(rfh))
+        return state
+
+    @contextmanager
+    def locked(self):
+        '''
+        Lock, load and yield the state. The state is saved back when the context exits cleanly,
+        if it was changed.
+        '''
+        dirname = os.path.dirname(self.path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with salt.utils.fopen('{0}.lock'.format(self.path), 'w+') as lfh:
+            fcntl.flock(lfh.fileno(), fcntl.LOCK_EX)
+            try:
+                state = self.read()
+                loaded = copy.deepcopy(state)
+                yield state
+                if state == loaded:
+                    return
+                tmp_path = '{0}.tmp'.format(self.path)
+                with salt.utils.fopen(tmp_path, 'w+b') as wfh:
+                    self.serial.dump(state, wfh)
+                # Readers never see a partially written state
+                os.rename(tmp_path, self.path)
+            finally:
+                fcntl.flock(lfh.fileno(), fcntl.LOCK_UN)
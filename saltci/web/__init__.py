@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+'''
+    saltci.web
+    ~~~~~~~~~~
+
+    Salt-CI web dashboard.
+
+    The stylesheets are compiled from their SASS sources when the package is built, see
+    `setup.py`, and served as plain static files.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import 3rd-party libs
+from flask import Flask
+
+# Import salt-ci libs
+from saltci import database
+
+
+def create_app(opts):
+    '''
+    Return the web application configured from the `salt-ci-web` options.
+    '''
+    app = Flask(__name__)
+    app.config.update((key, value) for key, value in opts.iteritems() if key.isupper())
+    database.init_app(app)
+
+    from saltci.web.api import api
+    app.register_blueprint(api)
+    return app
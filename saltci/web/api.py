@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+'''
+    saltci.web.api
+    ~~~~~~~~~~~~~~
+
+    Salt-CI web dashboard API.
+
+    The build listings are keyset paginated, newest first. A page is requested with the ``next``
+    cursor returned by the previous one, ``/api/builds?before=<next>``, so, no matter how deep the
+    page, the database only walks an index range instead of counting and skipping rows.
+
+    The history, ``/api/rollups/builds`` and ``/api/rollups/tests``, is served from the daily
+    rollups, see :mod:`saltci.retention`, never from the raw results.
+
+    The responses are cached and carry an ``ETag``. A client sending it back on
+    ``If-None-Match`` gets a body-less ``304 Not Modified`` until new job results are written.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import python libs
+import json
+from datetime import datetime, timedelta
+from functools import wraps
+
+# Import 3rd-party libs
+from flask import Blueprint, abort, current_app, request
+
+# Import salt-ci libs
+from saltci.database.models import Build, DailyRollup, TestFlakiness, TestRollup
+from saltci.web.cache import GenerationTracker, ResponseCache, make_etag
+
+api = Blueprint('api', __name__, url_prefix='/api')
+
+
+@api.record_once
+def setup_cache(state):
+    state.app.extensions['saltci_api'] = {
+        'cache': ResponseCache(state.app.config['API_CACHE_SIZE']),
+        'generation': GenerationTracker(state.app.config['API_GENERATION_TTL'])
+    }
+
+
+def cached(func):
+    '''
+    Cache the JSON serialized return of the view, until the job results generation changes,
+    and answer the conditional requests.
+    '''
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        extension = current_app.extensions['saltci_api']
+        generation = extension['generation'].get()
+        # The same query, whatever the arguments order, shares the cached response
+        key = '{0}?{1}'.format(request.path, sorted(request.args.iteritems(multi=True)))
+        etag = make_etag(generation, key)
+
+        if request.if_none_match.contains(etag):
+            response = current_app.response_class(status=304)
+        else:
+            body = extension['cache'].get(key, generation)
+            if body is None:
+                body = json.dumps(func(*args, **kwargs))
+                extension['cache'].set(key, generation, body)
+            response = current_app.response_class(body, mimetype='application/json')
+
+        response.set_etag(etag)
+        # Cacheable, but always revalidated, the revalidation is cheap
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return wrapper
+
+
+@api.route('/builds')
+@cached
+def builds():
+    '''
+    List the builds, newest first, optionally filtered by ``project`` and, within it, ``branch``.
+    '''
+    limit = min(
+        request.args.get('limit', current_app.config['API_PAGE_SIZE'], type=int),
+        current_app.config['API_MAX_PAGE_SIZE']
+    )
+    if limit <= 0:
+        abort(400)
+
+    query = Build.query
+    if 'project' in request.args:
+        query = query.filter(Build.project == request.args['project'])
+        if 'branch' in request.args:
+            query = query.filter(Build.branch == request.args['branch'])
+    before = request.args.get('before', type=int)
+    if before is not None:
+        query = query.filter(Build.id < before)
+
+    # One extra row tells if there's a next page
+    rows = query.order_by(Build.id.desc()).limit(limit + 1).all()
+    return {
+        'builds': [build.to_dict() for build in rows[:limit]],
+        'next': rows[limit - 1].id if len(rows) > limit else None
+    }
+
+
+@api.route('/builds/<jid>')
+@cached
+def build(jid):
+    '''
+    Return a build and it's minions results.
+    '''
+    build = Build.query.filter_by(jid=jid).first_or_404()
+    data = build.to_dict()
+    data['results'] = [result.to_dict() for result in build.results.order_by('minion_id')]
+    return data
+
+
+def _history_days():
+    days = request.args.get('days', 30, type=int)
+    if days <= 0 or days > current_app.config['API_MAX_HISTORY_DAYS']:
+        abort(400)
+    return datetime.utcnow().date() - timedelta(days=days)
+
+
+@api.route('/rollups/builds')
+@cached
+def build_rollups():
+    '''
+    The daily build counts of the last ``days``, optionally filtered by ``project`` and, within
+    it, ``branch``.
+    '''
+    query = DailyRollup.query.filter(DailyRollup.day >= _history_days())
+    if 'project' in request.args:
+        query = query.filter(DailyRollup.project == request.args['project'])
+        if 'branch' in request.args:
+            query = query.filter(DailyRollup.branch == request.args['branch'])
+    return {
+        'rollups': [
+            rollup.to_dict() for rollup in query.order_by(
+                DailyRollup.day, DailyRollup.project, DailyRollup.branch
+            )
+        ]
+    }
+
+
+@api.route('/rollups/tests')
+@cached
+def test_rollups():
+    '''
+    The daily results and duration percentiles of the ``project`` tests for the last ``days``,
+    optionally only of the test ``name``.
+    '''
+    if 'project' not in request.args:
+        abort(400)
+    query = TestRollup.query.filter(
+        TestRollup.project == request.args['project'],
+        TestRollup.day >= _history_days()
+    )
+    if 'name' in request.args:
+        query = query.filter(TestRollup.name == request.args['name'])
+    return {
+        'rollups': [
+            rollup.to_dict() for rollup in query.order_by(TestRollup.day, TestRollup.name)
+        ]
+    }
+
+
+@api.route('/tests/flaky')
+@cached
+def flaky_tests():
+    '''
+    The flakiest tests of ``project``, the most flaky first.
+    '''
+    if 'project' not in request.args:
+        abort(400)
+    limit = min(
+        request.args.get('limit', current_app.config['API_PAGE_SIZE'], type=int),
+        current_app.config['API_MAX_PAGE_SIZE']
+    )
+    if limit <= 0:
+        abort(400)
+    query = TestFlakiness.query.filter(
+        TestFlakiness.project == request.args['project'], TestFlakiness.score > 0
+    ).order_by(TestFlakiness.score.desc()).limit(limit)
+    return {'tests': [test.to_dict() for test in query]}
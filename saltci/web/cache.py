@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+'''
+    saltci.web.cache
+    ~~~~~~~~~~~~~~~~
+
+    Web API response caching.
+
+    Every cached response is tagged with the job results generation it was built from. The
+    master bumps the generation each time it writes new job results, so, checking it is enough to
+    know if a cached response, or the client's copy, is stale.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import python libs
+import time
+import hashlib
+import threading
+import collections
+
+# Import salt-ci libs
+from saltci import database
+
+
+class ResponseCache(object):
+    '''
+    A bounded, least recently used, response cache.
+    '''
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, generation):
+        '''
+        Return the cached value of ``key`` if it was built from ``generation``, else ``None``.
+        '''
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or entry[0] != generation:
+                return None
+            # Most recently used
+            self.entries[key] = entry
+            return entry[1]
+
+    def set(self, key, generation, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (generation, value)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+class GenerationTracker(object):
+    '''
+    Look up the job results generation on the database at most every ``ttl`` seconds.
+    '''
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.generation = None
+        self.checked = 0
+        self.lock = threading.Lock()
+
+    def get(self):
+        with self.lock:
+            now = time.time()
+            if self.generation is None or now - self.checked >= self.ttl:
+                self.generation = database.get_generation()
+                self.checked = now
+            return self.generation
+
+
+def make_etag(generation, key):
+    '''
+    Return the entity tag of the response to ``key`` built from ``generation``.
+    '''
+    return hashlib.md5('{0}:{1}'.format(generation, key)).hexdigest()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+'''
+    saltci.web.cli
+    ~~~~~~~~~~~~~~
+
+    Salt-CI web dashboard server.
+
+    `salt-ci-web` serves the dashboard with Werkzeug's development server, fine for trying it out
+    or for a handful of users. Production deployments should serve
+    :data:`saltci.web.wsgi.application` from a WSGI server instead.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import python libs
+import logging
+
+# Import salt libs
+from salt.utils import parsers
+
+# Import salt-ci libs
+from saltci import config
+
+log = logging.getLogger(__name__)
+
+
+class SaltCIWeb(parsers.OptionParser, parsers.ConfigDirMixIn, parsers.MergeConfigMixIn,
+                parsers.LogLevelMixIn, parsers.DaemonMixIn, parsers.PidfileMixin):
+
+    __metaclass__ = parsers.OptionParserMeta
+
+    description = 'The Salt-CI web dashboard.'
+
+    # ConfigDirMixIn configuration filename attribute
+    _config_filename_ = 'salt-ci-web'
+
+    def _mixin_setup(self):
+        self.add_option(
+            '-H', '--host',
+            default=None,
+            help='The address to listen on. Default: the configured one'
+        )
+        self.add_option(
+            '-p', '--port',
+            default=None,
+            type=int,
+            help='The port to listen on. Default: the configured one'
+        )
+
+    def setup_config(self):
+        return config.saltci_web_config(self.get_config_file_path())
+
+    def start(self):
+        self.parse_args()
+        self.setup_logfile_logger()
+
+        if not self.config['SQLALCHEMY_DATABASE_URI']:
+            self.error('No database is configured, please set SQLALCHEMY_DATABASE_URI')
+
+        # Late import so logging works correctly
+        from saltci.database import versioning
+        from saltci.web import create_app
+        app = create_app(self.config)
+
+        current = versioning.db_version(self.config['SQLALCHEMY_DATABASE_URI'])
+        if current != versioning.latest_version():
+            log.warning(
+                'The database schema version is {0}, please run `salt-ci-migrate upgrade`'.format(
+                    current
+                )
+            )
+
+        self.daemonize_if_required()
+        self.set_pidfile()
+        log.info('Serving the web dashboard on {0}:{1}'.format(
+            self.config['host'], self.config['port']
+        ))
+        log.warning(
+            'Using the development web server, serve saltci.web.wsgi:application from a WSGI '
+            'server in production'
+        )
+        app.run(
+            host=self.config['host'],
+            port=self.config['port'],
+            threaded=True,
+            use_reloader=False
+        )
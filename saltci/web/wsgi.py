@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+'''
+    saltci.web.wsgi
+    ~~~~~~~~~~~~~~~
+
+    WSGI entry point of the web dashboard, to serve it from a production WSGI server, for
+    example::
+
+        gunicorn --workers 4 --bind 0.0.0.0:5000 saltci.web.wsgi:application
+
+    The configuration is loaded from the file on the ``SALT_CI_WEB_CONFIG`` environment
+    variable, ``/etc/salt/salt-ci-web`` by default.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import python libs
+import os
+
+# Import salt-ci libs
+from saltci import config
+from saltci.web import create_app
+
+application = create_app(
+    config.saltci_web_config(os.environ.get('SALT_CI_WEB_CONFIG', '/etc/salt/salt-ci-web'))
+)
@@ -46,18 +46,25 @@ class CustomBuild(build.build):
             self.sass = os.path.abspath(os.path.expanduser(self.sass))
 
     def run(self):
-        build.build.run(self)
-        # Compile SASS files
+        # Compile SASS files before building, so that the stylesheets get packaged and are never
+        # compiled when serving requests
         static_path = os.path.join(os.path.dirname(package.__file__), 'web', 'static')
         for (dirpath, dirnames, filenames) in os.walk(static_path):
             for filename in filenames:
-                if not filename.endswith('.scss'):
+                if not filename.endswith('.scss') or filename.startswith('_'):
+                    # SASS partials are only compiled as part of the files importing them
                     continue
                 scss = os.path.join(static_path, dirpath, filename)
                 css = scss.replace('.scss', '.css')
                 log.info("Converting from %s to %s" % (scss, css))
-                p = subprocess.Popen([self.sass, '--unix-newlines', scss, css])
-                p.wait()
+                try:
+                    p = subprocess.Popen([self.sass or 'sass', '--unix-newlines', scss, css])
+                except OSError:
+                    log.warn("Unable to run the sass binary, please pass it's path with --sass")
+                    raise
+                if p.wait() != 0:
+                    raise RuntimeError('Failed to compile %s' % scss)
+        build.build.run(self)
 
 
 setup(name=package.__package_name__,
@@ -70,13 +77,25 @@ setup(name=package.__package_name__,
       license=package.__license__,
       platforms='Linux',
       keywords='Salt-CI Salt Continuous Integration',
-      packages=['saltci'],
+      packages=[
+          'saltci',
+          'saltci.database',
+          'saltci.database.migrations',
+          'saltci.database.migrations.versions',
+          'saltci.notif',
+          'saltci.notif.modules',
+          'saltci.pool',
+          'saltci.pool.drivers',
+          'saltci.web'
+      ],
       package_data={
-          'saltci.': [
+          'saltci': [
               '**.css',
               '**.js',
               '**.png',
               '**.cfg',
+              'minion/_modules/*.py',
+              'database/migrations/migrate.cfg',
               'web/translations/*/LC_MESSAGES/saltci.mo'
           ]
       },
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+'''
+    tests
+    ~~~~~
+
+    Salt-CI test suite. Run it with ``python -m unittest discover -s tests -t .``.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+'''
+    tests.fakes
+    ~~~~~~~~~~~
+
+    Stand-ins for salt's event bus and local client, which need a running master, and for the
+    minion pool drivers.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import salt libs
+import salt.client
+import salt.utils.event
+
+# Import salt-ci libs
+from saltci.exceptions import SaltCIPoolError
+from saltci.pool.drivers import PoolDriver
+
+
+class FakeEvent(object):
+    '''
+    Record the fired events instead of sending them to the master's event bus.
+    '''
+
+    fired = []
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def fire_event(self, data, tag):
+        self.fired.append((tag, data))
+
+
+class FakeLocalClient(object):
+    '''
+    Record the published jobs instead of publishing them. The published jobs target the
+    ``minions`` when given a list, otherwise, the ``targets`` mapping of each target to it's
+    minions.
+    '''
+
+    published = []
+    targets = {}
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def pub(self, tgt, fun, arg=(), expr_form='glob', ret='', jid='', **kwargs):
+        self.published.append((tgt, fun, list(arg), expr_form, jid))
+        minions = tgt if expr_form == 'list' else self.targets.get(tgt, [])
+        if not minions:
+            return {}
+        return {'jid': jid or '20130415123456789012', 'minions': list(minions)}
+
+    def cmd_async(self, tgt, fun, arg=(), expr_form='glob', ret='', **kwargs):
+        jid = '201304151234567{0:05d}'.format(len(self.published))
+        return self.pub(tgt, fun, arg, expr_form, ret, jid)['jid']
+
+
+class FakeDriver(PoolDriver):
+    '''
+    A minion pool driver which only keeps track of the minions it was asked to create. The
+    minions on ``failing`` fail to be created, used minions are reset when ``resets`` is set.
+    '''
+
+    def __init__(self, opts, driver_opts):
+        super(FakeDriver, self).__init__(opts, driver_opts)
+        self.minions = {}
+        self.destroyed = []
+        self.failing = set()
+        self.resets = driver_opts.get('resets', False)
+
+    def create(self, minion_id, minion_config, priv, pub):
+        if minion_id in self.failing:
+            raise SaltCIPoolError('Failed to create {0}'.format(minion_id))
+        self.minions[minion_id] = minion_config
+
+    def reset(self, minion_id):
+        return self.resets
+
+    def destroy(self, minion_id):
+        self.minions.pop(minion_id, None)
+        self.destroyed.append(minion_id)
+
+    def list(self):
+        return list(self.minions)
+
+
+def install(testcase):
+    '''
+    Have ``testcase`` use the fakes, and reset them, until it's cleaned up.
+    '''
+    FakeEvent.fired = []
+    FakeLocalClient.published = []
+    FakeLocalClient.targets = {}
+    for module, name, fake in ((salt.utils.event, 'MasterEvent', FakeEvent),
+                               (salt.client, 'LocalClient', FakeLocalClient)):
+        testcase.addCleanup(setattr, module, name, getattr(module, name))
+        setattr(module, name, fake)
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+'''
+    tests.test_flaky
+    ~~~~~~~~~~~~~~~~
+
+    Flaky tests analysis tests.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import python libs
+import os
+import shutil
+import tempfile
+import unittest
+
+# Import salt-ci libs
+from saltci import database, flaky
+from saltci.database import versioning
+
+
+class AnalyzeBatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.opts = {
+            'cachedir': self.tmpdir,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///{0}'.format(
+                os.path.join(self.tmpdir, 'salt-ci.db')
+            ),
+            'flaky': {'min_flaky_revisions': 2}
+        }
+        versioning.upgrade(self.opts['SQLALCHEMY_DATABASE_URI'])
+        database.make_app(self.opts)
+        self.config = flaky.get_config(self.opts)
+        self.builds = 0
+
+    def tearDown(self):
+        database.db.session.remove()
+        shutil.rmtree(self.tmpdir)
+
+    def add_build(self, tests, project='salt', revision='abc'):
+        '''
+        Record a build of ``revision`` with the ``{name: success}`` ``tests`` results.
+        '''
+        from saltci.database.models import Build, BuildResult, TestResult
+
+        self.builds += 1
+        build = Build(
+            jid='2013041512345678{0:04d}'.format(self.builds),
+            project=project,
+            branch='develop',
+            revision=revision,
+            returned=1,
+            failed=0
+        )
+        database.db.session.add(build)
+        database.db.session.flush()
+        result = BuildResult(build_id=build.id, minion_id='build-1', success=True)
+        database.db.session.add(result)
+        database.db.session.flush()
+        for name, success in sorted(tests.iteritems()):
+            database.db.session.add(
+                TestResult(result_id=result.id, build_id=build.id, name=name, success=success)
+            )
+        database.db.session.commit()
+
+    def scores(self, project='salt'):
+        from saltci.database.models import TestFlakiness
+        return dict(
+            (row.name, row) for row in TestFlakiness.query.filter_by(project=project)
+        )
+
+    def analyze(self):
+        projects = set()
+        while True:
+            analyzed = flaky.analyze_batch(self.config)
+            if not analyzed:
+                return projects
+            projects.update(analyzed)
+
+    def test_nothing_to_analyze(self):
+        self.assertEqual(flaky.analyze_batch(self.config), set())
+        self.assertEqual(flaky.analyzed_until(), 0)
+
+    def test_flaky_on_a_revision(self):
+        self.add_build({'stable': True, 'flaky': True, 'broken': False}, revision='r1')
+        self.add_build({'stable': True, 'flaky': False, 'broken': False}, revision='r1')
+        self.assertEqual(self.analyze(), set(['salt']))
+
+        scores = self.scores()
+        self.assertEqual(scores['flaky'].runs, 2)
+        self.assertEqual(scores['flaky'].failures, 1)
+        self.assertEqual(scores['flaky'].flaky_revisions, 1)
+        self.assertEqual(scores['flaky'].score, 1.0)
+        # Failing consistently is not being flaky
+        self.assertEqual(scores['broken'].flaky_revisions, 0)
+        self.assertEqual(scores['broken'].score, 0.0)
+        self.assertEqual(scores['stable'].score, 0.0)
+
+    def test_quarantine(self):
+        for revision in ('r1', 'r2'):
+            self.add_build({'flaky': True}, revision=revision)
+            self.add_build({'flaky': False}, revision=revision)
+            self.analyze()
+            # Quarantined once flaky on `min_flaky_revisions` revisions
+            self.assertEqual(self.scores()['flaky'].quarantined, revision == 'r2')
+
+        # The fixed test's score fades away
+        for revision in ('r3', 'r4', 'r5', 'r6', 'r7'):
+            self.add_build({'flaky': True}, revision=revision)
+        self.analyze()
+        score = self.scores()['flaky']
+        self.assertEqual(score.revisions, 7)
+        self.assertEqual(score.flaky_revisions, 2)
+        self.assertTrue(score.score < self.config['quarantine_score'])
+        self.assertFalse(score.quarantined)
+
+    def test_builds_without_revision(self):
+        self.add_build({'flaky': True}, revision=None)
+        self.add_build({'flaky': False}, revision=None)
+        self.analyze()
+        score = self.scores()['flaky']
+        self.assertEqual(score.runs, 2)
+        self.assertEqual(score.revisions, 0)
+        self.assertEqual(score.score, 0.0)
+
+    def test_projects_are_scored_apart(self):
+        self.add_build({'flaky': True}, project='salt', revision='r1')
+        self.add_build({'flaky': False}, project='salt-ci', revision='r1')
+        self.assertEqual(self.analyze(), set(['salt', 'salt-ci']))
+        self.assertEqual(self.scores('salt')['flaky'].flaky_revisions, 0)
+        self.assertEqual(self.scores('salt-ci')['flaky'].flaky_revisions, 0)
+
+    def test_incremental_batches(self):
+        self.config['batch_size'] = 2
+        self.add_build({'a': True, 'b': True, 'c': False}, revision='r1')
+        self.assertEqual(flaky.analyze_batch(self.config), set(['salt']))
+        self.assertEqual(flaky.first_pending_build(), 1)
+        self.assertEqual(sum(score.runs for score in self.scores().itervalues()), 2)
+
+        self.assertEqual(flaky.analyze_batch(self.config), set(['salt']))
+        self.assertIsNone(flaky.first_pending_build())
+        self.assertEqual(flaky.analyze_batch(self.config), set())
+
+        # The already analyzed results are never counted twice
+        self.add_build({'a': False}, revision='r1')
+        self.analyze()
+        scores = self.scores()
+        self.assertEqual(scores['a'].runs, 2)
+        self.assertEqual(scores['a'].flaky_revisions, 1)
+        self.assertEqual(scores['c'].runs, 1)
+
+    def test_export(self):
+        self.add_build({'flaky': True, 'stable': True}, revision='r1')
+        self.add_build({'flaky': False, 'stable': True}, revision='r1')
+        flaky.export(self.opts, self.config, self.analyze())
+        self.assertEqual(
+            flaky.project_tests(self.opts, 'salt'),
+            {'flaky': {'score': 1.0, 'quarantined': False}}
+        )
+
+    def test_check_bumps_the_generation_once(self):
+        self.config['batch_size'] = 1
+        self.add_build({'a': True, 'b': False}, revision='r1')
+        process = flaky.FlakyProcess(self.opts)
+        process.check(self.config)
+        self.assertIsNone(flaky.first_pending_build())
+        self.assertEqual(database.get_generation(), 1)
+
+        # Nothing new to analyze
+        process.check(self.config)
+        self.assertEqual(database.get_generation(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
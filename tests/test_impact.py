@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+'''
+    tests.test_impact
+    ~~~~~~~~~~~~~~~~~
+
+    Change-impact index and test selection tests.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import python libs
+import os
+import shutil
+import tempfile
+import unittest
+
+# Import salt libs
+from salt.cli import SaltCMD
+
+# Import salt-ci libs
+from saltci import impact
+from saltci.cli_adapt import ChangeImpactMixIn, SaltCICMD
+from saltci.exceptions import SaltCIChangeImpactError
+
+COVERAGE = {
+    'tests.unit.test_config': ['saltci/config.py', 'saltci/utils.py'],
+    'tests.unit.test_queue': ['saltci/queue.py', 'saltci/utils.py', 'saltci/config.py'],
+    u'tests.unit.test_ünicode': [u'saltci/ünicode.py']
+}
+
+
+class ImpactTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.opts = {'cachedir': self.tmpdir}
+        self.index_path = impact.get_config(self.opts)['index_path']
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+
+class IndexTestCase(ImpactTestCase):
+
+    def test_round_trip(self):
+        impact.write_index(self.index_path, COVERAGE)
+        with impact.ChangeImpactIndex(self.index_path) as index:
+            self.assertEqual(index.tests_count, 3)
+            self.assertEqual(index.files_count, 4)
+            self.assertEqual(index.postings_count, 6)
+            self.assertEqual(
+                index.load(),
+                dict(
+                    (impact._encode(test), set(impact._encode(fpath) for fpath in paths))
+                    for test, paths in COVERAGE.iteritems()
+                )
+            )
+
+    def test_tests_for(self):
+        impact.write_index(self.index_path, COVERAGE)
+        with impact.ChangeImpactIndex(self.index_path) as index:
+            self.assertEqual(
+                index.tests_for('saltci/utils.py'),
+                set(['tests.unit.test_config', 'tests.unit.test_queue'])
+            )
+            self.assertEqual(index.tests_for('saltci/queue.py'), set(['tests.unit.test_queue']))
+            self.assertEqual(
+                index.tests_for(u'saltci/ünicode.py'),
+                set([u'tests.unit.test_ünicode'.encode('utf-8')])
+            )
+            self.assertIsNone(index.tests_for('saltci/unknown.py'))
+            # Before and after every path on the binary search
+            self.assertIsNone(index.tests_for('a'))
+            self.assertIsNone(index.tests_for('z'))
+
+    def test_missing_index(self):
+        with impact.ChangeImpactIndex(self.index_path) as index:
+            self.assertIsNone(index.tests_for('saltci/config.py'))
+            self.assertEqual(index.load(), {})
+
+    def test_invalid_index(self):
+        os.makedirs(os.path.dirname(self.index_path))
+        with open(self.index_path, 'wb') as wfh:
+            wfh.write('not an impact index')
+        self.assertRaises(SaltCIChangeImpactError, impact.ChangeImpactIndex, self.index_path)
+
+    def test_update_index(self):
+        impact.write_index(self.index_path, COVERAGE)
+        impact.update_index(
+            self.index_path,
+            {'tests.unit.test_queue': ['saltci/queue.py'], 'tests.unit.test_config': []}
+        )
+        with impact.ChangeImpactIndex(self.index_path) as index:
+            self.assertEqual(
+                index.load(),
+                {
+                    'tests.unit.test_queue': set(['saltci/queue.py']),
+                    u'tests.unit.test_ünicode'.encode('utf-8'): set(
+                        [u'saltci/ünicode.py'.encode('utf-8')]
+                    )
+                }
+            )
+
+
+class NormalizationTestCase(ImpactTestCase):
+
+    def test_strip_prefixes(self):
+        self.opts['impact'] = {'strip_prefixes': ['/srv/build/salt', '/tmp/']}
+        recorder = impact.ImpactRecorder(self.opts)
+        recorder.setup()
+        recorder.handle_event(
+            '20130415123456789012',
+            {
+                'id': 'build-1',
+                'jid': '20130415123456789012',
+                'return': {
+                    'coverage': {
+                        'tests.unit.test_config': [
+                            '/srv/build/salt/saltci/config.py',
+                            '/tmp/saltci/./utils.py',
+                            'saltci/web/../queue.py'
+                        ],
+                        'tests.unit.test_removed': None
+                    }
+                }
+            }
+        )
+        self.assertEqual(
+            recorder.pending,
+            {
+                'tests.unit.test_config': [
+                    'saltci/config.py', 'saltci/utils.py', 'saltci/queue.py'
+                ],
+                'tests.unit.test_removed': []
+            }
+        )
+
+        recorder.maintenance()
+        self.assertEqual(recorder.pending, {})
+        with impact.ChangeImpactIndex(self.index_path) as index:
+            self.assertEqual(
+                index.tests_for('saltci/queue.py'), set(['tests.unit.test_config'])
+            )
+
+    def test_ignores_other_returns(self):
+        recorder = impact.ImpactRecorder(self.opts)
+        recorder.setup()
+        recorder.handle_event(
+            '20130415123456789012',
+            {'id': 'build-1', 'jid': '20130415123456789012', 'return': True}
+        )
+        recorder.handle_event('salt/auth', {'id': 'build-1', 'result': True})
+        self.assertEqual(recorder.pending, {})
+
+
+class SelectionTestCase(ImpactTestCase):
+
+    def setUp(self):
+        super(SelectionTestCase, self).setUp()
+        impact.write_index(self.index_path, COVERAGE)
+
+    def test_select_tests(self):
+        self.assertEqual(
+            impact.select_tests(self.opts, ['saltci/queue.py']),
+            set(['tests.unit.test_queue'])
+        )
+        self.assertEqual(
+            impact.select_tests(self.opts, ['saltci/queue.py', 'saltci/config.py']),
+            set(['tests.unit.test_config', 'tests.unit.test_queue'])
+        )
+
+    def test_unknown_path_selects_everything(self):
+        self.assertIsNone(impact.select_tests(self.opts, ['saltci/queue.py', 'setup.py']))
+
+    def test_ignored_paths(self):
+        self.assertEqual(impact.select_tests(self.opts, ['README.rst', 'doc/index.txt']), set())
+        # The requirements are not ignored, nothing can be assumed about them
+        self.assertIsNone(impact.select_tests(self.opts, ['requirements.txt']))
+
+
+class ChangeImpactMixInTestCase(unittest.TestCase):
+
+    def test_registered_on_salt_ci_only(self):
+        self.assertIn(
+            ChangeImpactMixIn._mixin_after_parsed.__func__,
+            [getattr(func, '__func__', func) for func in SaltCICMD._mixin_after_parsed_funcs]
+        )
+        self.assertNotIn(
+            ChangeImpactMixIn._mixin_after_parsed.__func__,
+            [getattr(func, '__func__', func) for func in SaltCMD._mixin_after_parsed_funcs]
+        )
+        self.assertNotIn(
+            ChangeImpactMixIn._mixin_setup.__func__,
+            [getattr(func, '__func__', func) for func in SaltCMD._mixin_setup_funcs]
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+'''
+    tests.test_keys
+    ~~~~~~~~~~~~~~~
+
+    Bulk key management tests.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import python libs
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+# Import salt libs
+import salt.utils
+
+# Import salt-ci libs
+from saltci import keys
+from tests import fakes
+from tests.fakes import FakeEvent, FakeLocalClient
+
+PUB = '''-----BEGIN PUBLIC KEY-----
+MIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8AMIIBCgKCAQEA{0}
+-----END PUBLIC KEY-----
+'''
+
+
+class KeysTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.opts = {
+            'pki_dir': os.path.join(self.tmpdir, 'pki'),
+            'sock_dir': self.tmpdir,
+            'timeout': 5,
+            'quiet': False,
+            'yes': False
+        }
+        fakes.install(self)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def add_key(self, status, minion_id, pub=None):
+        dirname = os.path.join(self.opts['pki_dir'], status)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with salt.utils.fopen(os.path.join(dirname, minion_id), 'w+') as wfh:
+            wfh.write(pub or PUB.format(minion_id))
+
+    def keys_of(self, status):
+        return sorted(os.listdir(os.path.join(self.opts['pki_dir'], status)))
+
+
+class KeyIndexTestCase(KeysTestCase):
+
+    def test_bulk_accept(self):
+        for minion_id in ('ci-1', 'ci-2', 'web-1', 'db-1'):
+            self.add_key(keys.PENDING, minion_id)
+        index = keys.KeyIndex(self.opts)
+        fingerprint = salt.utils.pem_finger(
+            os.path.join(self.opts['pki_dir'], keys.PENDING, 'db-1')
+        )
+        self.assertEqual(keys.finger(PUB.format('db-1')), fingerprint)
+
+        accepted = index.bulk_accept(['ci-*'], [fingerprint.upper()])
+        self.assertEqual(accepted, ['ci-1', 'ci-2', 'db-1'])
+        self.assertEqual(self.keys_of(keys.ACCEPTED), ['ci-1', 'ci-2', 'db-1'])
+        self.assertEqual(self.keys_of(keys.PENDING), ['web-1'])
+        self.assertEqual(
+            [data['id'] for tag, data in FakeEvent.fired if tag == 'key'],
+            ['ci-1', 'ci-2', 'db-1']
+        )
+
+    def test_accept_include_rejected(self):
+        self.add_key(keys.PENDING, 'ci-1')
+        self.add_key(keys.REJECTED, 'ci-2')
+        index = keys.KeyIndex(self.opts)
+        self.assertEqual(index.accept(['ci-1', 'ci-2']), ['ci-1'])
+        self.assertEqual(index.accept(['ci-2'], include_rejected=True), ['ci-2'])
+        self.assertEqual(self.keys_of(keys.ACCEPTED), ['ci-1', 'ci-2'])
+        self.assertEqual(index.status('ci-2'), keys.ACCEPTED)
+
+    def test_clean_ephemeral(self):
+        for minion_id in ('ci-1', 'ci-2', 'web-1'):
+            self.add_key(keys.ACCEPTED, minion_id)
+        index = keys.KeyIndex(self.opts)
+        self.assertEqual(index.clean_ephemeral(['ci-*'], ['ci-2']), ['ci-1'])
+        self.assertEqual(self.keys_of(keys.ACCEPTED), ['ci-2', 'web-1'])
+        self.assertIsNone(index.status('ci-1'))
+
+
+class SaltCIKeyCLITestCase(KeysTestCase):
+
+    def accept(self, match, **opts):
+        self.opts.update(opts)
+        cli = keys.SaltCIKeyCLI(self.opts)
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            cli.accept(match)
+            return sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+    def test_salt_accept(self):
+        # Without `--yes` salt's own accept is used
+        self.add_key(keys.PENDING, 'ci-1')
+        self.add_key(keys.REJECTED, 'ci-2')
+        self.assertEqual(self.accept('ci-*'), 'Key for minion ci-1 accepted.\n')
+        self.assertEqual(self.keys_of(keys.ACCEPTED), ['ci-1'])
+        self.assertEqual(
+            self.accept('ci-*'), 'The key glob ci-* does not match any unaccepted keys.\n'
+        )
+
+    def test_accept_yes(self):
+        self.add_key(keys.PENDING, 'ci-1')
+        self.add_key(keys.PENDING, 'web-1')
+        self.assertEqual(self.accept('ci-*', yes=True), 'Key for minion ci-1 accepted.\n')
+        self.assertEqual(self.keys_of(keys.ACCEPTED), ['ci-1'])
+        self.add_key(keys.PENDING, 'ci-2')
+        self.assertEqual(self.accept('ci-*', yes=True, quiet=True), '')
+        self.assertEqual(self.keys_of(keys.ACCEPTED), ['ci-1', 'ci-2'])
+
+    def test_accept_include_rejected(self):
+        self.add_key(keys.PENDING, 'ci-1')
+        self.add_key(keys.REJECTED, 'ci-2')
+        self.assertEqual(
+            self.accept('ci-*', include_rejected=True),
+            'Key for minion ci-1 accepted.\nKey for minion ci-2 accepted.\n'
+        )
+        self.assertEqual(self.keys_of(keys.ACCEPTED), ['ci-1', 'ci-2'])
+        self.assertEqual(self.keys_of(keys.REJECTED), [])
+        self.assertEqual(
+            self.accept('ci-*', include_rejected=True),
+            'The key glob ci-* does not match any unaccepted or rejected keys.\n'
+        )
+
+
+class KeyManagerTestCase(KeysTestCase):
+
+    def setUp(self):
+        super(KeyManagerTestCase, self).setUp()
+        self.opts['keys'] = {
+            'accept_patterns': ['ci-*'],
+            'accept_fingerprints': [keys.finger(PUB.format('db-1'))],
+            'ephemeral_patterns': ['ci-*'],
+            'ephemeral_ttl': 60
+        }
+
+    def manager(self):
+        manager = keys.KeyManager(self.opts)
+        manager.setup()
+        return manager
+
+    def pend(self, manager, minion_id):
+        # Salt places the key in pending and then fires the event
+        self.add_key(keys.PENDING, minion_id)
+        manager.handle_event(
+            'auth', {'id': minion_id, 'act': 'pend', 'pub': PUB.format(minion_id)}
+        )
+
+    def test_auto_accept(self):
+        manager = self.manager()
+        for minion_id in ('ci-1', 'db-1', 'web-1'):
+            self.pend(manager, minion_id)
+        self.assertEqual(self.keys_of(keys.ACCEPTED), ['ci-1', 'db-1'])
+        self.assertEqual(self.keys_of(keys.PENDING), ['web-1'])
+
+    def test_ephemeral_pinging(self):
+        for minion_id in ('ci-1', 'ci-2', 'web-1'):
+            self.add_key(keys.ACCEPTED, minion_id)
+        manager = self.manager()
+        manager.last_seen['ci-3'] = time.time()
+
+        # Quiet for longer than `ephemeral_ttl`, pinged without waiting for them
+        past = time.time() - 120
+        manager.last_seen.update({'ci-1': past, 'ci-2': past})
+        manager.maintenance()
+        self.assertEqual(
+            [publish[:2] for publish in FakeLocalClient.published],
+            [(['ci-1', 'ci-2'], 'test.ping')]
+        )
+        self.assertEqual(self.keys_of(keys.ACCEPTED), ['ci-1', 'ci-2', 'web-1'])
+
+        # Not pinged again while waiting for their returns
+        manager.maintenance()
+        self.assertEqual(len(FakeLocalClient.published), 1)
+
+        # ci-1 returns, ci-2 does not within the master timeout
+        manager.handle_event(
+            '20130415123456789012',
+            {'id': 'ci-1', 'jid': '20130415123456789012', 'return': True}
+        )
+        manager.pinged['ci-2'] = manager.pinged['ci-1'] = time.time() - self.opts['timeout']
+        manager.maintenance()
+        self.assertEqual(self.keys_of(keys.ACCEPTED), ['ci-1', 'web-1'])
+        self.assertEqual(manager.pinged, {})
+        self.assertEqual(len(FakeLocalClient.published), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
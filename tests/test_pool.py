@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+'''
+    tests.test_pool
+    ~~~~~~~~~~~~~~~
+
+    Build minions pool tests.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import python libs
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+# Import salt libs
+import salt.crypt
+import salt.utils
+
+# Import salt-ci libs
+from saltci import keys, pool
+from tests import fakes
+from tests.fakes import FakeDriver
+
+
+def fake_gen_keys(keydir, keyname, keysize):
+    for ext in ('pem', 'pub'):
+        with salt.utils.fopen(os.path.join(keydir, '{0}.{1}'.format(keyname, ext)), 'w+') as wfh:
+            wfh.write('{0} {1}'.format(keyname, ext))
+
+
+class PoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.opts = {
+            'cachedir': self.tmpdir,
+            'sock_dir': self.tmpdir,
+            'pki_dir': os.path.join(self.tmpdir, 'pki'),
+            'interface': '127.0.0.1',
+            'ret_port': 4506,
+            'pool': {
+                'driver': 'fake',
+                'min_idle': 2,
+                'max_size': 4,
+                'max_boots_per_check': 3,
+                'idle_ttl': 0
+            }
+        }
+        for status in (keys.ACCEPTED, keys.PENDING, keys.REJECTED):
+            os.makedirs(os.path.join(self.opts['pki_dir'], status))
+        fakes.install(self)
+        self.addCleanup(setattr, salt.crypt, 'gen_keys', salt.crypt.gen_keys)
+        salt.crypt.gen_keys = fake_gen_keys
+        self.addCleanup(setattr, pool, 'get_driver', pool.get_driver)
+        pool.get_driver = lambda name, opts, driver_opts: FakeDriver(opts, driver_opts)
+
+        self.pool = pool.MinionPool(self.opts)
+        self.pool.setup()
+        self.process = pool.PoolProcess(self.opts)
+        self.process.setup()
+        self.driver = self.process.driver
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def minions(self, *states):
+        return sorted(
+            minion_id for minion_id, minion in pool.PoolState(self.opts).read()['minions'].items()
+            if minion['state'] in states
+        )
+
+    def boot(self):
+        '''
+        Decide, boot and start the wanted build minions.
+        '''
+        self.pool.maintenance()
+        self.process.check()
+        for minion_id in self.minions(pool.BOOTING):
+            self.pool.handle_event('minion_start', {'id': minion_id})
+
+    def test_scale_up(self):
+        self.pool.maintenance()
+        pending = self.minions(pool.PENDING)
+        self.assertEqual(len(pending), 2)
+        # Nothing was booted by the master's event processing
+        self.assertEqual(self.driver.minions, {})
+
+        self.process.check()
+        self.assertEqual(self.minions(pool.BOOTING), pending)
+        self.assertEqual(sorted(self.driver.minions), pending)
+        accepted = os.listdir(os.path.join(self.opts['pki_dir'], keys.ACCEPTED))
+        self.assertEqual(sorted(accepted), pending)
+
+        self.pool.handle_event('minion_start', {'id': pending[0]})
+        self.assertEqual(self.minions(pool.IDLE), pending[:1])
+
+    def test_scale_up_waiting(self):
+        self.boot()
+        self.assertIsNone(pool.try_acquire(self.opts, 3, 'job'))
+        self.pool.maintenance()
+        # Two idle ones kept, on top of the three waited for, capped at the maximum size
+        self.assertEqual(len(self.minions(pool.IDLE)), 2)
+        self.assertEqual(len(self.minions(pool.PENDING)), 2)
+
+        self.process.check()
+        self.boot()
+        self.assertEqual(len(pool.try_acquire(self.opts, 3, 'job')), 3)
+        self.assertEqual(pool.PoolState(self.opts).read()['waiting'], {})
+
+    def test_max_boots_per_check(self):
+        self.opts['pool']['min_idle'] = 4
+        self.pool.setup()
+        self.pool.maintenance()
+        self.pool.maintenance()
+        self.assertEqual(len(self.minions(pool.PENDING)), 3)
+
+    def test_failed_boot(self):
+        self.pool.maintenance()
+        pending = self.minions(pool.PENDING)
+        self.driver.failing.add(pending[0])
+        self.process.check()
+        self.assertEqual(self.minions(pool.BOOTING), pending[1:])
+        self.assertEqual(self.minions(pool.PENDING), [])
+
+    def test_acquire_release(self):
+        self.boot()
+        self.assertIsNone(pool.try_acquire(self.opts, 3, 'job'))
+        acquired = pool.try_acquire(self.opts, 2, 'job')
+        self.assertEqual(acquired, self.minions(pool.BUSY))
+
+        # Only the owner releases them
+        pool.release(self.opts, acquired, owner='other')
+        self.assertEqual(self.minions(pool.BUSY), acquired)
+        pool.release(self.opts, acquired, owner='job')
+        self.assertEqual(self.minions(pool.DIRTY), acquired)
+
+        # Used minions are destroyed when they can't be reset
+        self.process.check()
+        self.assertEqual(self.minions(pool.DIRTY), [])
+        self.assertEqual(sorted(self.driver.destroyed), acquired)
+
+    def test_reset(self):
+        self.driver.resets = True
+        self.boot()
+        acquired = pool.try_acquire(self.opts, 1, 'job')
+        pool.release(self.opts, acquired, owner='job')
+        self.process.check()
+        self.assertEqual(self.minions(pool.BOOTING), acquired)
+        self.assertEqual(self.driver.destroyed, [])
+
+    def test_stale_owner(self):
+        self.boot()
+        acquired = pool.try_acquire(self.opts, 1, 'job')
+        with pool.PoolState(self.opts).locked() as state:
+            # A pid that is not running
+            state['minions'][acquired[0]]['pid'] = 2 ** 22 + 1
+        self.pool.maintenance()
+        self.assertEqual(self.minions(pool.DIRTY), acquired)
+
+    def test_boot_timeout(self):
+        self.pool.maintenance()
+        self.process.check()
+        with pool.PoolState(self.opts).locked() as state:
+            for minion in state['minions'].values():
+                minion['since'] -= self.pool.config['boot_timeout'] + 1
+        booting = self.minions(pool.BOOTING)
+        self.pool.maintenance()
+        self.assertEqual(self.minions(pool.DESTROYING), booting)
+        self.process.check()
+        self.assertEqual(sorted(self.driver.destroyed), booting)
+
+    def test_scale_down(self):
+        self.boot()
+        with pool.PoolState(self.opts).locked() as state:
+            state['waiting']['job'] = {'count': 2, 'since': time.time(), 'seen': time.time()}
+        self.boot()
+        self.assertEqual(len(self.minions(pool.IDLE)), 4)
+
+        # The waiting request is gone, scale back down to the minimum idle minions
+        pool.cancel(self.opts, 'job')
+        self.pool.maintenance()
+        self.assertEqual(len(self.minions(pool.DESTROYING)), 2)
+        self.process.check()
+        self.assertEqual(len(self.minions(pool.IDLE)), 2)
+        self.assertEqual(len(self.driver.minions), 2)
+
+    def test_reconcile(self):
+        self.boot()
+        known = self.minions(pool.IDLE)
+        self.driver.minions.pop(known[0])
+        self.driver.minions['salt-ci-build-orphan'] = {}
+        self.driver.minions['not-ours'] = {}
+        self.process.reconcile()
+        self.assertEqual(self.minions(pool.IDLE), known[1:])
+        self.assertEqual(self.driver.destroyed, ['salt-ci-build-orphan'])
+        self.assertIn('not-ours', self.driver.minions)
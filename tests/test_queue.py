@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+'''
+    tests.test_queue
+    ~~~~~~~~~~~~~~~~
+
+    Job queue scheduling and superseding tests.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import python libs
+import time
+import shutil
+import tempfile
+import unittest
+
+# Import salt-ci libs
+from saltci import queue
+from tests import fakes
+from tests.fakes import FakeLocalClient
+
+
+def make_job(queue_id, project='salt', branch='develop', state=queue.QUEUED,
+             priority='default', submitted=0):
+    return {
+        'id': queue_id,
+        'state': state,
+        'project': project,
+        'branch': branch,
+        'priority': priority,
+        'submitted': submitted
+    }
+
+
+def make_state(*jobs, **last_started):
+    return {'jobs': dict((job['id'], job) for job in jobs), 'last_started': last_started}
+
+
+def scheduled(config, state):
+    return [job['id'] for job in queue.schedule(config, state, now=1000)]
+
+
+class ScheduleTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.config = queue.get_config({})
+
+    def test_empty_queue(self):
+        self.assertEqual(scheduled(self.config, make_state()), [])
+
+    def test_priority_classes(self):
+        state = make_state(
+            make_job('nightly', project='a', priority='nightly', submitted=1),
+            make_job('default', project='b', submitted=2),
+            make_job('interactive', project='c', priority='interactive', submitted=3)
+        )
+        self.assertEqual(scheduled(self.config, state), ['interactive', 'default', 'nightly'])
+
+    def test_max_running(self):
+        self.config['max_running'] = 2
+        state = make_state(
+            make_job('running', project='a', state=queue.RUNNING),
+            make_job('first', project='b', submitted=1),
+            make_job('second', project='c', submitted=2)
+        )
+        self.assertEqual(scheduled(self.config, state), ['first'])
+
+    def test_publishing_jobs_take_capacity(self):
+        self.config['max_running'] = 1
+        state = make_state(
+            make_job('publishing', project='a', state=queue.PUBLISHING),
+            make_job('queued', project='b')
+        )
+        self.assertEqual(scheduled(self.config, state), [])
+
+    def test_branch_concurrency(self):
+        state = make_state(
+            make_job('running', state=queue.RUNNING),
+            make_job('first', submitted=1),
+            make_job('second', submitted=2),
+            make_job('other-branch', branch='master', submitted=3)
+        )
+        self.assertEqual(scheduled(self.config, state), ['first', 'other-branch'])
+
+    def test_project_concurrency_overrides(self):
+        self.config['concurrency_overrides'] = {'salt': 1, 'salt/master': 3}
+        state = make_state(
+            make_job('first', branch='master', submitted=1),
+            make_job('second', branch='master', submitted=2),
+            make_job('other-project', project='salt-ci', submitted=3)
+        )
+        self.assertEqual(scheduled(self.config, state), ['first', 'other-project'])
+
+    def test_fair_share_between_projects(self):
+        state = make_state(
+            make_job('busy-running', project='busy', state=queue.RUNNING),
+            make_job('busy-1', project='busy', branch='a', submitted=1),
+            make_job('busy-2', project='busy', branch='b', submitted=2),
+            make_job('recent-1', project='recent', submitted=3),
+            make_job('idle-1', project='idle', submitted=4),
+            recent=900,
+            idle=100
+        )
+        # The projects with the fewest running jobs go first, then the one which started a job
+        # the longest ago
+        self.assertEqual(
+            scheduled(self.config, state), ['idle-1', 'recent-1', 'busy-1', 'busy-2']
+        )
+
+    def test_schedule_does_not_change_the_state(self):
+        state = make_state(make_job('queued'), salt=10)
+        scheduled(self.config, state)
+        self.assertEqual(state['jobs']['queued']['state'], queue.QUEUED)
+        self.assertEqual(state['last_started'], {'salt': 10})
+
+
+class SupersedeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.opts = {'cachedir': self.tmpdir}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def state_of(self, queue_id):
+        return queue.get_job(self.opts, queue_id)['state']
+
+    def test_supersede_identical_jobs(self):
+        older = queue.submit(self.opts, 'salt', 'develop', 'build-*', 'cilog.run', ['make'])
+        newer = queue.submit(self.opts, 'salt', 'develop', 'build-*', 'cilog.run', ['make'])
+        self.assertEqual(self.state_of(older), queue.CANCELLED)
+        self.assertEqual(queue.get_job(self.opts, older)['superseded_by'], newer)
+        self.assertEqual(self.state_of(newer), queue.QUEUED)
+
+    def test_different_target_or_arguments(self):
+        web = queue.submit(self.opts, 'salt', 'develop', 'web*', 'state.highstate')
+        queue.submit(self.opts, 'salt', 'develop', 'db*', 'state.highstate')
+        make = queue.submit(self.opts, 'salt', 'develop', 'build-*', 'cilog.run', ['make'])
+        queue.submit(self.opts, 'salt', 'develop', 'build-*', 'cilog.run', ['make test'])
+        self.assertEqual(self.state_of(web), queue.QUEUED)
+        self.assertEqual(self.state_of(make), queue.QUEUED)
+
+    def test_not_superseding(self):
+        older = queue.submit(self.opts, 'default', 'default', 'web*', 'state.highstate')
+        queue.submit(
+            self.opts, 'default', 'default', 'web*', 'state.highstate', supersede=False
+        )
+        self.assertEqual(self.state_of(older), queue.QUEUED)
+        queue.submit(self.opts, 'default', 'default', 'web*', 'state.highstate')
+        self.assertEqual(self.state_of(older), queue.CANCELLED)
+
+    def test_not_superseded(self):
+        # The jobs which do not supersede others are not superseded either
+        newer = queue.submit(
+            self.opts, 'salt', 'develop', 'web*', 'state.highstate', supersede=False
+        )
+        queue.submit(self.opts, 'salt', 'develop', 'web*', 'state.highstate')
+        self.assertEqual(self.state_of(newer), queue.QUEUED)
+
+
+class JobQueueTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.opts = {'cachedir': self.tmpdir, 'sock_dir': self.tmpdir, 'timeout': 5}
+        fakes.install(self)
+        FakeLocalClient.targets = {'build-*': ['build-1', 'build-2']}
+        self.queue = queue.JobQueue(self.opts)
+        self.queue.setup()
+        self.queue_id = queue.submit(self.opts, 'salt', 'develop', 'build-*', 'cilog.run')
+        self.queue.maintenance()
+        self.job = queue.get_job(self.opts, self.queue_id)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def ret(self, minion_id, jid=None, ret=True):
+        jid = jid or self.job['jid']
+        self.queue.handle_event(jid, {'id': minion_id, 'jid': jid, 'return': ret})
+
+    def state(self):
+        return queue.get_job(self.opts, self.queue_id)['state']
+
+    def test_publish(self):
+        self.assertEqual(self.job['state'], queue.RUNNING)
+        self.assertEqual(self.job['minions'], ['build-1', 'build-2'])
+        self.assertEqual(FakeLocalClient.published[0][:2], ('build-*', 'cilog.run'))
+
+    def test_all_minions_returned(self):
+        self.ret('build-1')
+        self.ret('build-1')
+        self.assertEqual(self.state(), queue.RUNNING)
+        self.ret('build-2')
+        self.assertEqual(self.state(), queue.DONE)
+
+    def test_missing_minions_no_longer_running(self):
+        self.ret('build-1')
+        self.queue.activity[self.queue_id] = time.time() - 120
+        self.queue.maintenance()
+        # The missing minion was asked if it's still running the job
+        tgt, fun, arg, expr_form, find_jid = FakeLocalClient.published[-1]
+        self.assertEqual((tgt, fun, arg), (['build-2'], 'saltutil.find_job', [self.job['jid']]))
+
+        # Not asked again while waiting for it's answer
+        self.queue.maintenance()
+        self.assertEqual(len(FakeLocalClient.published), 2)
+        self.assertEqual(self.state(), queue.RUNNING)
+
+        # No answer within the master timeout
+        self.queue.checking[self.queue_id] = (time.time() - 10, find_jid)
+        self.queue.maintenance()
+        self.assertEqual(self.state(), queue.DONE)
+        self.assertEqual(self.queue.checking, {})
+        self.assertEqual(self.queue.find_jobs, {})
+
+    def test_missing_minions_still_running(self):
+        self.queue.activity[self.queue_id] = time.time() - 120
+        self.queue.maintenance()
+        find_jid = FakeLocalClient.published[-1][-1]
+        # build-1 is not running it, build-2 still is
+        self.ret('build-1', find_jid, {})
+        self.assertIn(self.queue_id, self.queue.checking)
+        self.ret('build-2', find_jid, {'jid': self.job['jid'], 'fun': 'cilog.run'})
+        self.assertEqual(self.queue.checking, {})
+
+        self.queue.maintenance()
+        self.assertEqual(len(FakeLocalClient.published), 2)
+        self.assertEqual(self.state(), queue.RUNNING)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+'''
+    tests.test_web
+    ~~~~~~~~~~~~~~
+
+    Web API pagination and response caching tests.
+
+    :codeauthor: :email:`Pedro Algarvio (pedro@algarvio.me)`
+    :copyright: © 2013 by the SaltStack Team, see AUTHORS for more details.
+    :license: Apache 2.0, see LICENSE for more details.
+'''
+
+# Import python libs
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+# Import salt-ci libs
+from saltci import config, database
+from saltci.database import versioning
+from saltci.web import create_app
+from saltci.web.cache import ResponseCache
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+
+    def test_generation(self):
+        cache = ResponseCache(2)
+        cache.set('a', 1, 'a1')
+        self.assertEqual(cache.get('a', 1), 'a1')
+        # Built from an older generation
+        self.assertIsNone(cache.get('a', 2))
+        self.assertIsNone(cache.get('b', 1))
+
+    def test_least_recently_used(self):
+        cache = ResponseCache(2)
+        cache.set('a', 1, 'a1')
+        cache.set('b', 1, 'b1')
+        cache.get('a', 1)
+        cache.set('c', 1, 'c1')
+        self.assertEqual(cache.get('a', 1), 'a1')
+        self.assertIsNone(cache.get('b', 1))
+        self.assertEqual(cache.get('c', 1), 'c1')
+
+        # Setting a cached key does not evict another one
+        cache.set('c', 2, 'c2')
+        self.assertEqual(cache.get('a', 1), 'a1')
+        self.assertEqual(cache.get('c', 2), 'c2')
+
+
+class WebTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        opts = config._DEFAULT_WEB_API_CONFIG.copy()
+        opts.update(
+            SQLALCHEMY_DATABASE_URI='sqlite:///{0}'.format(
+                os.path.join(self.tmpdir, 'salt-ci.db')
+            ),
+            # Always look up the generation
+            API_GENERATION_TTL=0
+        )
+        versioning.upgrade(opts['SQLALCHEMY_DATABASE_URI'])
+        self.app = create_app(opts)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        database.db.session.remove()
+        shutil.rmtree(self.tmpdir)
+
+    def add_builds(self, count, project='salt'):
+        from saltci.database.models import Build
+        for _ in range(count):
+            database.db.session.add(
+                Build(
+                    jid='2013041512345678{0:04d}'.format(self.builds()),
+                    project=project,
+                    branch='develop'
+                )
+            )
+            database.db.session.flush()
+        database.db.session.commit()
+
+    def builds(self):
+        from saltci.database.models import Build
+        return Build.query.count()
+
+    def bump(self):
+        database.bump_generation()
+        database.db.session.commit()
+
+    def get(self, url, **headers):
+        response = self.client.get(url, headers=headers)
+        database.db.session.remove()
+        return response
+
+    def test_bump_generation(self):
+        self.assertEqual(database.get_generation(), 0)
+        self.bump()
+        self.bump()
+        database.db.session.remove()
+        self.assertEqual(database.get_generation(), 2)
+
+    def test_keyset_pagination(self):
+        self.add_builds(5)
+        self.add_builds(2, project='salt-ci')
+
+        pages = []
+        url = '/api/builds?project=salt&limit=2'
+        while url:
+            data = json.loads(self.get(url).data)
+            pages.append([build['id'] for build in data['builds']])
+            url = data['next'] and '/api/builds?project=salt&limit=2&before={0}'.format(
+                data['next']
+            )
+        self.assertEqual(pages, [[5, 4], [3, 2], [1]])
+
+        data = json.loads(self.get('/api/builds').data)
+        self.assertEqual([build['id'] for build in data['builds']], [7, 6, 5, 4, 3, 2, 1])
+        self.assertIsNone(data['next'])
+
+        self.assertEqual(self.get('/api/builds?limit=0').status_code, 400)
+
+    def test_not_modified(self):
+        self.add_builds(1)
+        response = self.get('/api/builds')
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+
+        response = self.get('/api/builds', **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, '')
+        self.assertEqual(response.headers['ETag'], etag)
+
+        # The arguments order does not matter
+        etag = self.get('/api/builds?project=salt&limit=5').headers['ETag']
+        response = self.get('/api/builds?limit=5&project=salt', **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_cache_invalidation(self):
+        self.add_builds(1)
+        response = self.get('/api/builds')
+        etag = response.headers['ETag']
+        self.assertEqual(len(json.loads(response.data)['builds']), 1)
+
+        # Not written by the master, the cached response is served
+        self.add_builds(1)
+        self.assertEqual(len(json.loads(self.get('/api/builds').data)['builds']), 1)
+
+        self.bump()
+        response = self.get('/api/builds', **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(len(json.loads(response.data)['builds']), 2)